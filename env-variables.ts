@@ -4,6 +4,22 @@ const variables: any = {
     dev: 'development environment value',
     prod: 'production environment value',
   },
+  // 'sync' updates product star counters in rate_product,
+  // 'stream' leaves them to the star-aggregator function
+  star_aggregation: {
+    dev: 'sync',
+    prod: 'sync',
+  },
+  // 'true' adds a Server-Timing header and an EMF log line per API request
+  request_metrics: {
+    dev: 'true',
+    prod: 'false',
+  },
+  // 'true' lets Admin requests with an X-Profile header be profiled into profile_bucket_name
+  request_profiling: {
+    dev: 'true',
+    prod: 'false',
+  },
 }
 
 // "Static variables", meaning eg. dynamodb table names
@@ -26,13 +42,21 @@ const staticVars = {
   pricehistory_table_name: generateVariable('pricehistory'),
   users_table_name: generateVariable('users'),
   public_content_bucket_name: generateVariable(['public-content', account_id]),
+  profile_bucket_name: generateVariable(['profiles', account_id]),
   user_pool_id: {
     'Fn::ImportValue': generateVariable('UserPoolId'),
   },
   user_pool_client_id: {
     'Fn::ImportValue': generateVariable('UserPoolClientId'),
   },
+  // Base of the image urls in products/{ean}/manifest.json: the stage's own CloudFront distribution
+  public_content_url: {
+    'Fn::Join': ['', ['https://', { 'Fn::ImportValue': generateVariable('PublicContentDomainName') }]],
+  },
   region: '${self:provider.region}',
+  // HMAC key for GET /products and /rankings page cursors, one per stage. Create it with
+  // aws ssm put-parameter --type SecureString --name /juomaranking-api-<stage>/cursor_secret
+  cursor_secret: '${ssm:/' + baseName + '/cursor_secret}',
 }
 
 // Parse variable list from two objects above and return it
@@ -9,6 +9,26 @@ export const Resources = {
           AttributeName: 'ean',
           AttributeType: 'S',
         },
+        {
+          AttributeName: 'category',
+          AttributeType: 'S',
+        },
+        {
+          AttributeName: 'score',
+          AttributeType: 'N',
+        },
+        {
+          AttributeName: 'rank_partition',
+          AttributeType: 'S',
+        },
+        {
+          AttributeName: 'price',
+          AttributeType: 'N',
+        },
+        {
+          AttributeName: 'updated_at',
+          AttributeType: 'N',
+        },
       ],
       KeySchema: [
         {
@@ -16,6 +36,72 @@ export const Resources = {
           KeyType: 'HASH',
         },
       ],
+      GlobalSecondaryIndexes: [
+        {
+          IndexName: 'category-score-index',
+          KeySchema: [
+            {
+              AttributeName: 'category',
+              KeyType: 'HASH',
+            },
+            {
+              AttributeName: 'score',
+              KeyType: 'RANGE',
+            },
+          ],
+          Projection: {
+            ProjectionType: 'ALL',
+          },
+        },
+        {
+          IndexName: 'score-index',
+          KeySchema: [
+            {
+              AttributeName: 'rank_partition',
+              KeyType: 'HASH',
+            },
+            {
+              AttributeName: 'score',
+              KeyType: 'RANGE',
+            },
+          ],
+          Projection: {
+            ProjectionType: 'ALL',
+          },
+        },
+        {
+          IndexName: 'category-price-index',
+          KeySchema: [
+            {
+              AttributeName: 'category',
+              KeyType: 'HASH',
+            },
+            {
+              AttributeName: 'price',
+              KeyType: 'RANGE',
+            },
+          ],
+          Projection: {
+            ProjectionType: 'ALL',
+          },
+        },
+        {
+          IndexName: 'category-updated_at-index',
+          KeySchema: [
+            {
+              AttributeName: 'category',
+              KeyType: 'HASH',
+            },
+            {
+              AttributeName: 'updated_at',
+              KeyType: 'RANGE',
+            },
+          ],
+          Projection: {
+            ProjectionType: 'ALL',
+          },
+        },
+      ],
       StreamSpecification: {
         StreamViewType: 'NEW_IMAGE',
       },
@@ -49,6 +135,9 @@ export const Resources = {
           KeyType: 'RANGE',
         },
       ],
+      StreamSpecification: {
+        StreamViewType: 'NEW_AND_OLD_IMAGES',
+      },
     },
   },
   PricehistoryTable: {
@@ -188,6 +277,28 @@ export const Resources = {
       },
     },
   },
+  ProfileBucket: {
+    Type: 'AWS::S3::Bucket',
+    Properties: {
+      BucketName: '${self:provider.environment.profile_bucket_name}',
+      PublicAccessBlockConfiguration: {
+        BlockPublicAcls: true,
+        BlockPublicPolicy: true,
+        IgnorePublicAcls: true,
+        RestrictPublicBuckets: true,
+      },
+      LifecycleConfiguration: {
+        Rules: [
+          {
+            Id: 'ExpireProfiles',
+            Status: 'Enabled',
+            Prefix: 'profiles/',
+            ExpirationInDays: 14,
+          },
+        ],
+      },
+    },
+  },
   DistributionCachePolicy: {
     Type: 'AWS::CloudFront::CachePolicy',
     Properties: {
@@ -270,4 +381,22 @@ export const Outputs = {
       Name: '${self:service}-${self:provider.stage}-ProductsTableStreamArn',
     },
   },
+  RatingsTableStreamArn: {
+    Description: 'Ratings table stream arn',
+    Value: {
+      'Fn::GetAtt': ['RatingsTable', 'StreamArn'],
+    },
+    Export: {
+      Name: '${self:service}-${self:provider.stage}-RatingsTableStreamArn',
+    },
+  },
+  PublicContentDomainName: {
+    Description: 'Domain name of the public content CloudFront distribution',
+    Value: {
+      'Fn::GetAtt': ['PublicContentDistribution', 'DomainName'],
+    },
+    Export: {
+      Name: '${self:service}-${self:provider.stage}-PublicContentDomainName',
+    },
+  },
 }
@@ -54,7 +54,7 @@ const serverlessConfiguration: AWS = {
           },
           {
             Effect: 'Allow',
-            Action: ['s3:PutObject'],
+            Action: ['s3:GetObject', 's3:PutObject', 's3:AbortMultipartUpload'],
             Resource: [
               {
                 'Fn::Sub': 'arn:aws:s3:::${self:service}-${self:provider.stage}-*',
@@ -94,6 +94,9 @@ const serverlessConfiguration: AWS = {
         'image-download-handler': {
           path: './src/functions/image-download-handler',
         },
+        'star-aggregator': {
+          path: './src/functions/star-aggregator',
+        },
       },
     },
   },
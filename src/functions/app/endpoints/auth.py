@@ -1,5 +1,4 @@
 import os
-import boto3
 from time import time
 from fastapi import APIRouter
 import random
@@ -10,6 +9,7 @@ from fastapi import HTTPException
 from typing import Optional
 from pydantic import BaseModel
 from models.users import UserModel
+from utils.clients import get_client
 
 user_pool_id = os.environ.get("user_pool_id", None)
 user_pool_client_id = os.environ.get("user_pool_client_id", None)
@@ -20,12 +20,11 @@ router = APIRouter(
     tags=["Authentication"],
 )
 
-cognito = boto3.client("cognito-idp", region_name=region)
-
 regex = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
 
 
 def disableUser(email: str):
+    cognito = get_client("cognito-idp")
     try:
         cognito.admin_disable_user(UserPoolId=user_pool_id, Username=email)
         return True
@@ -34,6 +33,7 @@ def disableUser(email: str):
 
 
 def verifyCredentials(email: str, password: str):
+    cognito = get_client("cognito-idp")
     try:
         cognito.admin_initiate_auth(
             UserPoolId=user_pool_id,
@@ -61,6 +61,7 @@ class Body(BaseModel):
 
 @router.post("/login")
 def login(body: Body):
+    cognito = get_client("cognito-idp")
     try:
         response = cognito.admin_initiate_auth(
             UserPoolId=user_pool_id,
@@ -78,6 +79,7 @@ def login(body: Body):
 
 @router.post("/register")
 def register(body: Body):
+    cognito = get_client("cognito-idp")
     if isValidEmail(body.email) != True:
         raise HTTPException(status_code=400, detail="Invalid email.")
 
@@ -121,6 +123,7 @@ def register(body: Body):
 
 @router.post("/refresh")
 def refresh_access_token(body: Body):
+    cognito = get_client("cognito-idp")
     response = cognito.admin_initiate_auth(
         UserPoolId=user_pool_id,
         ClientId=user_pool_client_id,
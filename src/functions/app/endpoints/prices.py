@@ -1,19 +1,154 @@
-from typing import List
-from fastapi import APIRouter, HTTPException
+from typing import Dict, List, Optional
 
-from models.pricehistory import PriceHistoryModel, PriceHistoryDTO
+from fastapi import APIRouter, HTTPException, Query, Request
+
+from models.pricehistory import PriceHistoryModel, ROLLUP_PREFIX
+from utils.http import conditional_response
+from utils.serialization import encode_price_history
 
 router = APIRouter(
-    prefix="/ratings",
-    tags=["Ratings"],
+    prefix="/prices",
+    tags=["Prices"],
 )
 
+DATE_REGEX = r"^\d{4}-\d{2}-\d{2}$"
+
+# 1970-01-01 was a Thursday, day 4 is the first Monday
+EPOCH_MONDAY = 4
+
+
+def query_price_history(ean: str, start: str, end: str) -> List[PriceHistoryModel]:
+    # "~" sorts after "-" so the end date includes every store of that day
+    return list(
+        PriceHistoryModel.query(
+            ean, PriceHistoryModel.sk.between(start, "{}~".format(end))
+        )
+    )
+
+
+def query_monthly_rollups(ean: str, start: str, end: str) -> List[PriceHistoryModel]:
+    return list(
+        PriceHistoryModel.query(
+            ean,
+            PriceHistoryModel.sk.between(
+                ROLLUP_PREFIX + start[:7], "{}{}~".format(ROLLUP_PREFIX, end[:7])
+            ),
+        )
+    )
+
+
+# numpy is only needed by the stats endpoint and is the heaviest import in
+# the app, so the functions below import it on first use instead of the
+# module doing it for every cold start.
+
+
+def summarize(mins, maxs, sums, counts) -> dict:
+    count = int(counts.sum())
+    return {
+        "min": int(mins.min()),
+        "max": int(maxs.max()),
+        "mean": round(float(sums.sum()) / count, 2),
+        "count": count,
+    }
+
+
+def series(keys, mins, maxs, sums, counts) -> List[dict]:
+    import numpy as np
+
+    means = np.round(sums / counts, 2)
+    return [
+        {"date": date, "min": low, "max": high, "mean": mean}
+        for date, low, high, mean in zip(
+            keys.tolist(), mins.tolist(), maxs.tolist(), means.tolist()
+        )
+    ]
+
+
+def downsample(phms: List[PriceHistoryModel], interval: str) -> Dict[str, dict]:
+    """Per-store stats plus a min/max/mean series bucketed by day or ISO week."""
+    import numpy as np
+
+    stores: Dict[str, List[PriceHistoryModel]] = {}
+    for phm in phms:
+        stores.setdefault(phm.store, []).append(phm)
+
+    rval = {}
+    for store, rows in stores.items():
+        days = np.array([r.sk[:10] for r in rows], dtype="datetime64[D]")
+        days = days.astype(np.int64)
+        prices = np.array([r.price for r in rows], dtype=np.int64)
+
+        if interval == "week":
+            days = days - (days - EPOCH_MONDAY) % 7
+
+        buckets, inverse = np.unique(days, return_inverse=True)
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=prices)
+        mins = np.full(len(buckets), np.iinfo(np.int64).max)
+        maxs = np.full(len(buckets), np.iinfo(np.int64).min)
+        np.minimum.at(mins, inverse, prices)
+        np.maximum.at(maxs, inverse, prices)
+
+        keys = buckets.astype("datetime64[D]").astype(str)
+        rval[store] = dict(
+            summarize(mins, maxs, sums, counts),
+            series=series(keys, mins, maxs, sums, counts),
+        )
+    return rval
+
+
+def from_rollups(rollups: List[PriceHistoryModel]) -> Dict[str, dict]:
+    import numpy as np
+
+    stores: Dict[str, List[PriceHistoryModel]] = {}
+    for rollup in rollups:
+        stores.setdefault(rollup.store, []).append(rollup)
+
+    rval = {}
+    for store, rows in stores.items():
+        keys = np.array(["{}-01".format(r.sk[len(ROLLUP_PREFIX) :][:7]) for r in rows])
+        mins = np.array([r.price_min for r in rows], dtype=np.int64)
+        maxs = np.array([r.price_max for r in rows], dtype=np.int64)
+        sums = np.array([r.price_sum for r in rows], dtype=np.float64)
+        counts = np.array([r.price_count for r in rows], dtype=np.int64)
+        rval[store] = dict(
+            summarize(mins, maxs, sums, counts),
+            series=series(keys, mins, maxs, sums, counts),
+        )
+    return rval
+
+
+@router.get("/{ean}")
+def get_product_price_history(
+    request: Request,
+    ean: str,
+    start: str = Query("0000-01-01", regex=DATE_REGEX),
+    end: str = Query("9999-12-31", regex=DATE_REGEX),
+    store: Optional[str] = None,
+):
+    phms = query_price_history(ean, start, end)
+    if store is not None:
+        phms = [phm for phm in phms if phm.store == store]
+
+    return conditional_response(request, [encode_price_history(phm) for phm in phms])
+
+
+@router.get("/{ean}/stats")
+def get_product_price_stats(
+    request: Request,
+    ean: str,
+    start: str = Query("0000-01-01", regex=DATE_REGEX),
+    end: str = Query("9999-12-31", regex=DATE_REGEX),
+    interval: str = Query("day", regex="^(day|week|month)$"),
+):
+    if interval == "month":
+        stores = from_rollups(query_monthly_rollups(ean, start, end))
+    else:
+        stores = downsample(query_price_history(ean, start, end), interval)
 
-@router.get("/price-history/{ean}")
-def get_product_price_history(ean: str) -> List[PriceHistoryDTO]:
-    try:
-        phms = PriceHistoryModel.query(ean)
-    except PriceHistoryModel.DoesNotExist:
-        raise HTTPException(status_code=404, detail="PriceHistoryModel not found")
+    if len(stores) == 0:
+        raise HTTPException(status_code=404, detail="Price history not found")
 
-    return [PriceHistoryDTO(price_history=phm) for phm in phms]
+    return conditional_response(
+        request, {"ean": ean, "interval": interval, "stores": stores}
+    )
@@ -1,25 +1,42 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 from time import time
 from datetime import date
-from typing import List
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
-import boto3
-import jsons
-from fastapi import APIRouter, HTTPException, Depends
-from pynamodb.exceptions import PutError, VerboseClientError
+import orjson
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import ORJSONResponse
+from pynamodb.exceptions import PutError, UpdateError, VerboseClientError
 
 from models.pricehistory import PriceHistoryModel
 from models.products import (
     ProductModel,
     Product,
-    ProductDTO,
     PriceDataModel,
     NutrientsModel,
+    StarsModel,
 )
-from models.ratings import RatingDTO, RatingModel
+from models.ratings import RatingModel
 
-from utils.constants import public_content_bucket_name
+from utils.constants import batch_write_workers, public_content_bucket_name
 
 from utils.auth import auth, AccessUser
+from utils.cache import product_cache
+from utils.clients import get_client
+from utils.export import export_items
+from utils.http import conditional_response, etag_matches, make_etag, not_modified
+from utils.pagination import encode_cursor, decode_cursor, read_page
+from utils.pricehistory import update_monthly_rollups
+from utils.ranking import RANKING_PARTITION, apply_ranking, bayesian_score
+from utils.scan import parallel_scan
+from utils.serialization import (
+    PRODUCT_EXCLUDE,
+    encode_product,
+    encode_rating,
+    product_encoder,
+)
 
 router = APIRouter(
     prefix="/products",
@@ -39,27 +56,65 @@ def update_product_stores(
     return product_model
 
 
-def update_product_price_history(product_models: List[ProductModel]):
-    date = date.today().strftime("%Y-%m-%d")
+def price_snapshot(product_model: ProductModel) -> Dict[str, int]:
+    return {
+        pd.store: pd.price for pd in product_model.price_data or [] if pd is not None
+    }
+
+
+def update_product_price_history(
+    product_models: List[ProductModel], previous_prices: Dict[str, Dict[str, int]]
+):
+    """
+    Write a price history row for every store whose price differs from
+    `previous_prices[ean]`, the price_snapshot taken before the update.
+    """
+    now = int(time())
+    today = date.fromtimestamp(now).strftime("%Y-%m-%d")
     price_histories: List[PriceHistoryModel] = []
 
     for pm in product_models:
-        for pd in pm.price_data:
-            sk = "{}-{}".format(date, pd.store)
+        previous = previous_prices.get(pm.ean, {})
+        for pd in pm.price_data or []:
+            if pd is None or pd.price is None or previous.get(pd.store) == pd.price:
+                continue
+            sk = "{}-{}".format(today, pd.store)
             price_histories.append(
                 PriceHistoryModel(
                     ean=pm.ean,
                     sk=sk,
                     price=pd.price,
-                    created_at=int(time()),
+                    created_at=now,
                     store=pd.store,
                 )
             )
 
+    if len(price_histories) == 0:
+        return
+
+    # batch_write retries unprocessed items with backoff and raises once
+    # max_retry_attempts is used up
     with PriceHistoryModel.batch_write() as batch:
         for phm in price_histories:
             batch.save(phm)
 
+    update_monthly_rollups(price_histories)
+
+
+# Fields that change without the supplier data changing
+CONTENT_HASH_EXCLUDE = ("stars", "created_at", "updated_at", "score")
+
+
+def product_content_hash(product_model: ProductModel) -> str:
+    content = encode_product(product_model)
+    for field in CONTENT_HASH_EXCLUDE:
+        content.pop(field, None)
+    content["store"] = sorted(content["store"] or [])
+    content["price_data"] = sorted(
+        (pd["store"], pd["price"]) for pd in content["price_data"] or []
+    )
+    return hashlib.sha1(orjson.dumps(content, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
 
 def update_product_price_data(
     product_model: ProductModel, product: Product
@@ -96,18 +151,182 @@ def update_product_nutrients(
     return product_model
 
 
-@router.get("")
-def get_products():
-    results_iter = ProductModel.scan(limit=25)
-    results = list(results_iter)
-    total_count = results_iter.total_count
-    last_evaluated_key = results_iter.last_evaluated_key
+# What POST /products/batch and PUT /products/{ean} write. The star
+# counters, score and stars_seq belong to rating writes, which run
+# concurrently, so supplier writes update these attributes only instead
+# of putting the whole item.
+SUPPLIER_ATTRIBUTES = (
+    "name",
+    "photo",
+    "price",
+    "category",
+    "main_product_ean",
+    "name_fi",
+    "name_sv",
+    "name_en",
+    "description_fi",
+    "description_sv",
+    "description_en",
+    "ingredients_fi",
+    "ingredients_sv",
+    "ingredients_en",
+    "supplier",
+    "store",
+    "price_data",
+    "nutrients",
+    "updated_at",
+)
 
-    return {
-        "items": [ProductDTO(pm) for pm in results],
-        "total_count": total_count,
-        "last_evaluated_key": last_evaluated_key,
-    }
+
+def unrated_stars() -> StarsModel:
+    return StarsModel(one=0, two=0, three=0, four=0, five=0)
+
+
+def supplier_actions(product_model: ProductModel) -> list:
+    actions = [
+        (
+            getattr(ProductModel, name).remove()
+            if getattr(product_model, name) is None
+            else getattr(ProductModel, name).set(getattr(product_model, name))
+        )
+        for name in SUPPLIER_ATTRIBUTES
+    ]
+    # if_not_exists: these only take effect on new products and on ones
+    # written before rankings, which are scored from their stored stars
+    actions += [
+        ProductModel.stars.set(ProductModel.stars | unrated_stars()),
+        ProductModel.score.set(
+            ProductModel.score | bayesian_score(product_model.stars)
+        ),
+        ProductModel.rank_partition.set(
+            ProductModel.rank_partition | RANKING_PARTITION
+        ),
+    ]
+    actions.append(ProductModel.version.add(1))
+    if product_model.created_at is not None:
+        actions.append(
+            ProductModel.created_at.set(
+                ProductModel.created_at | product_model.created_at
+            )
+        )
+    return actions
+
+
+def write_supplier_data(product_models: List[ProductModel]) -> List[ProductModel]:
+    """
+    Update the supplier attributes of each product, in parallel since
+    UpdateItem has no batch form. Returns the products that were written.
+    """
+    written = []
+    with ThreadPoolExecutor(max_workers=batch_write_workers) as executor:
+        futures = [
+            (
+                product_model,
+                executor.submit(
+                    copy_context().run,
+                    product_model.update,
+                    actions=supplier_actions(product_model),
+                ),
+            )
+            for product_model in product_models
+        ]
+        for product_model, future in futures:
+            try:
+                future.result()
+                written.append(product_model)
+            except UpdateError as e:
+                print(e)
+    return written
+
+
+PRODUCT_FIELDS = frozenset(ProductModel.get_attributes()) - frozenset(PRODUCT_EXCLUDE)
+
+# Not an attribute: asks GET /products/{ean} for the latest ratings too
+RATINGS_FIELD = "ratings"
+
+
+def parse_fields(
+    fields: Optional[str], with_ratings: bool = False
+) -> Optional[FrozenSet[str]]:
+    """
+    Turn `?fields=name,photo,price` into the set of fields to return,
+    or None for all of them. ean is always included. `ratings` is only
+    accepted where the endpoint reads them, see `with_ratings`.
+    """
+    if fields is None:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    if RATINGS_FIELD in requested and not with_ratings:
+        raise HTTPException(
+            status_code=400, detail="ratings is only returned by GET /products/{ean}"
+        )
+    unknown = requested - PRODUCT_FIELDS - {RATINGS_FIELD}
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail="Unknown fields: {}".format(", ".join(sorted(unknown))),
+        )
+    return frozenset(requested | {"ean"})
+
+
+def attributes_to_get(fields: Optional[FrozenSet[str]]) -> Optional[List[str]]:
+    # Sent as the ProjectionExpression. DynamoDB still charges read capacity
+    # for the whole item, the saving is in transfer and decoding.
+    if fields is None:
+        return None
+    return sorted(fields - {RATINGS_FIELD})
+
+
+def fields_encoder(fields: Optional[FrozenSet[str]]):
+    if fields is None:
+        return encode_product
+    return product_encoder(fields - {RATINGS_FIELD})
+
+
+@router.get("")
+def get_products(
+    request: Request,
+    category: Optional[str] = None,
+    sort: str = Query("updated_at", regex="^(price|updated_at)$"),
+    order: str = Query("desc", regex="^(asc|desc)$"),
+    cursor: Optional[str] = None,
+    page_size: int = Query(25, ge=1, le=100),
+    fields: Optional[str] = None,
+):
+    fields = parse_fields(fields)
+    if category is None:
+        scope = "products"
+        results_iter = ProductModel.scan(
+            limit=page_size,
+            page_size=page_size,
+            last_evaluated_key=decode_cursor(cursor, scope),
+            attributes_to_get=attributes_to_get(fields),
+        )
+    else:
+        scope = "products:{}:{}:{}".format(category, sort, order)
+        if sort == "price":
+            index = ProductModel.category_price_index
+        else:
+            index = ProductModel.category_updated_at_index
+        results_iter = index.query(
+            category,
+            scan_index_forward=order == "asc",
+            limit=page_size,
+            page_size=page_size,
+            last_evaluated_key=decode_cursor(cursor, scope),
+            attributes_to_get=attributes_to_get(fields),
+        )
+    results = read_page(results_iter, cursor)
+    encode = fields_encoder(fields)
+
+    return conditional_response(
+        request,
+        {
+            "items": [encode(pm) for pm in results],
+            "total_count": results_iter.total_count,
+            "cursor": encode_cursor(results_iter.last_evaluated_key, scope),
+        },
+    )
 
 
 @router.post("")
@@ -119,7 +338,7 @@ def add_product(
         product_model = ProductModel(
             ean=product.ean,
             name=product.name,
-            stars={"one": 0, "two": 0, "three": 0, "four": 0, "five": 0},
+            stars=unrated_stars(),
             photo=product.photo,
             price=product.price,
             created_at=int(time()),
@@ -138,22 +357,25 @@ def add_product(
             ingredients_sv=product.ingredients_sv,
             ingredients_en=product.ingredients_en,
             supplier=product.supplier,
+            version=1,
         )
         update_product_price_data(product_model, product)
         update_product_nutrients(product_model, product)
+        apply_ranking(product_model)
         product_model.save(ProductModel.ean.does_not_exist())
+        product_cache.invalidate(product_model.ean)
     except PutError as e:
         if isinstance(e.cause, VerboseClientError):
             code = e.cause.response["Error"].get("Code")
             if code == "ConditionalCheckFailedException":
                 raise HTTPException(status_code=400, detail="Item already exists.")
-        raise HTTPException(status_code=500, detail=jsons.dumps(e))
+        raise HTTPException(status_code=500, detail=str(e))
     try:
-        update_product_price_history([product_model])
+        update_product_price_history([product_model], {})
     except Exception as e:
         print(e)
 
-    return product_model.to_dict()
+    return ORJSONResponse(encode_product(product_model))
 
 
 @router.put("/{ean}")
@@ -166,9 +388,9 @@ def update_product(
         product_model = ProductModel.get(ean)
     except ProductModel.DoesNotExist:
         raise HTTPException(status_code=404, detail="Product not found")
+    previous_prices = {ean: price_snapshot(product_model)}
     try:
         product_model.name = product.name
-        product_model.stars = product.stars
         product_model.photo = product.photo
         product_model.price = product.price
         product_model.category = product.category
@@ -191,16 +413,19 @@ def update_product(
         product_model = update_product_stores(product_model, product)
         product_model = update_product_nutrients(product_model, product)
 
-        product_model.save()
+        product_model.update(
+            actions=supplier_actions(product_model), condition=ProductModel.ean.exists()
+        )
+        product_cache.invalidate(ean)
     except Exception as e:
         raise HTTPException(status_code=500, detail=e)
 
     try:
-        update_product_price_history([product_model])
+        update_product_price_history([product_model], previous_prices)
     except Exception as e:
         print(e)
 
-    return product_model.to_dict()
+    return ORJSONResponse(encode_product(product_model))
 
 
 @router.post("/batch")
@@ -214,21 +439,39 @@ def batch_products(
         if product_model is not None:
             db_products[product_model.ean] = product_model
 
-    product_models = []
+    previous_prices = dict()
+    changed = dict()
+    skipped = 0
+    failed = 0
+
+    for product in products:
+        try:
+            # Prices as stored before this batch. A repeated EAN finds the
+            # model its earlier copy already changed, so only the first
+            # sight counts, and a new product had no prices at all
+            if product.ean not in previous_prices:
+                previous_prices[product.ean] = (
+                    price_snapshot(db_products[product.ean])
+                    if product.ean in db_products
+                    else {}
+                )
 
-    with ProductModel.batch_write() as batch:
-        for product in products:
             if product.ean in db_products:
                 product_model = db_products[product.ean]
+                old_hash = product_content_hash(product_model)
             else:
-                product_model = ProductModel(ean=product.ean, name=product.name)
+                product_model = ProductModel(
+                    ean=product.ean,
+                    name=product.name,
+                    created_at=int(time()),
+                )
+                db_products[product.ean] = product_model
+                old_hash = None
 
             product_model.name = product.name
-            product_model.stars = {"one": 0, "two": 0, "three": 0, "four": 0, "five": 0}
             product_model.photo = product.photo
             product_model.price = product.price
             product_model.category = product.category
-            product_model.updated_at = int(time())
             product_model.main_product_ean = product.main_product_ean
 
             product_model.name_fi = product.name_fi
@@ -246,22 +489,99 @@ def batch_products(
             product_model = update_product_stores(product_model, product)
             product_model = update_product_nutrients(product_model, product)
 
-            product_models.append(product_model)
+            if (
+                product.ean not in changed
+                and product_content_hash(product_model) == old_hash
+            ):
+                skipped += 1
+                continue
+
+            product_model.updated_at = int(time())
+            changed[product.ean] = product_model
+        except Exception as e:
+            print(e)
+            failed += 1
 
-            batch.save(product_model)
+    product_models = write_supplier_data(list(changed.values()))
+    failed += len(changed) - len(product_models)
+
+    for product_model in product_models:
+        product_cache.invalidate(product_model.ean)
 
     try:
         update_product_price_history(
-            product_models
-        )  # Update price history for all product_models
+            product_models, previous_prices
+        )  # Update price history for changed product_models only
     except Exception as e:
         print(e)
 
-    return [pm.to_dict() for pm in product_models]
+    return {"written": len(product_models), "skipped": skipped, "failed": failed}
 
 
-@router.get("/{ean}")
-def get_product(ean: str) -> ProductDTO:
+@router.get("/scan")
+def get_products_scan(
+    fields: Optional[str] = None,
+    current_user: AccessUser = Depends(auth.scope(["Admin"])),
+):
+    fields = parse_fields(fields)
+    encode = fields_encoder(fields)
+    return ORJSONResponse(
+        [
+            encode(pm)
+            for pm in parallel_scan(
+                ProductModel, attributes_to_get=attributes_to_get(fields)
+            )
+        ]
+    )
+
+
+# What the product ETag is derived from, readable without the full item.
+# Every write to a product bumps its version, updated_at only has
+# one-second resolution. ean is read too: a product written before
+# versions has none, and an empty projection reads as a missing item.
+VERSION_ATTRIBUTES = ["ean", "version"]
+
+ProductVersion = Optional[int]
+
+
+def product_version(product_model: ProductModel) -> ProductVersion:
+    return product_model.version
+
+
+def product_etag(
+    ean: str, version: ProductVersion, fields: Optional[FrozenSet[str]]
+) -> str:
+    return make_etag(
+        "product", ean, version, sorted(fields) if fields is not None else None
+    )
+
+
+def get_product_version(ean: str) -> ProductVersion:
+    try:
+        product_model = ProductModel.get(ean, attributes_to_get=VERSION_ATTRIBUTES)
+    except ProductModel.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product_version(product_model)
+
+
+def get_product_fields(ean: str, fields: FrozenSet[str]) -> Tuple[dict, ProductVersion]:
+    """
+    A projected read that skips the ratings query. Not cached, the cache
+    only holds complete products.
+    """
+    try:
+        product_model = ProductModel.get(
+            ean,
+            attributes_to_get=sorted(
+                set(attributes_to_get(fields)) | set(VERSION_ATTRIBUTES)
+            ),
+        )
+    except ProductModel.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return fields_encoder(fields)(product_model), product_version(product_model)
+
+
+def get_full_product(ean: str) -> Tuple[dict, ProductVersion]:
     try:
         product_model = ProductModel.get(ean)
     except ProductModel.DoesNotExist:
@@ -272,61 +592,72 @@ def get_product(ean: str) -> ProductDTO:
     except RatingModel.DoesNotExist:
         pass
 
-    dto = ProductDTO(product_model)
+    dto = encode_product(product_model)
 
     if rating_models is not None:
-        dto.ratings = sorted(
+        dto["ratings"] = sorted(
             [
-                RatingDTO(
-                    ean=ean,
-                    rating=sr.rating,
-                    comment=sr.comment,
-                    username=sr.username,
-                    created_at=sr.created_at,
-                    updated_at=sr.updated_at,
-                )
+                encode_rating(sr)
                 for sr in rating_models
                 if sr.comment is not None and len(sr.comment) > 0
             ],
-            key=lambda sr: sr.created_at,
+            key=lambda sr: sr["created_at"] or 0,
             reverse=True,
         )  # This python language is so wierd.
 
-    return dto
+    return dto, product_version(product_model)
 
 
-@router.get("/scan")
-def get_products_scan(current_user: AccessUser = Depends(auth.scope(["Admin"]))):
-    results_iter = ProductModel.scan(limit=99999)
-    results = list(results_iter)
-    total_count = results_iter.total_count
-    results_iter.last_evaluated_key
+@router.get("/{ean}")
+def get_product(request: Request, ean: str, fields: Optional[str] = None):
+    """
+    Conditional GETs are answered from the cache or from a read of just
+    the version attributes, so a 304 never reads the full item or ratings.
+    """
+    fields = parse_fields(fields, with_ratings=True)
+    if_none_match = request.headers.get("if-none-match")
+
+    cached = product_cache.get(ean)
+    if cached is None and if_none_match is not None:
+        etag = product_etag(ean, get_product_version(ean), fields)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag)
+
+    if cached is not None:
+        dto, version = cached
+    elif fields is not None and RATINGS_FIELD not in fields:
+        dto, version = get_product_fields(ean, fields)
+    else:
+        dto, version = get_full_product(ean)
+        product_cache.set(ean, (dto, version))
 
-    print(total_count, len(results))
-    return [ProductDTO(pm) for pm in results]
+    if fields is not None:
+        dto = {key: value for key, value in dto.items() if key in fields}
+    return conditional_response(request, dto, etag=product_etag(ean, version, fields))
 
 
 @router.delete("/delete-all")
 def delete_all_products(current_user: AccessUser = Depends(auth.scope(["Admin"]))):
-    results_iter = ProductModel.scan(limit=99999)
-    results = list(results_iter)
-
+    deleted = 0
     with ProductModel.batch_write() as batch:
-        for pm in results:
+        for pm in parallel_scan(ProductModel, attributes_to_get=["ean"]):
             batch.delete(pm)
-    return {"ok": len(results)}
+            deleted += 1
+    product_cache.clear()
+    return {"ok": deleted}
 
 
 @router.post("/export")
-def export_to_s3(current_user: AccessUser = Depends(auth.scope(["Admin"]))):
-    results_iter = ProductModel.scan(limit=99999)
-    results = list(results_iter)
-    products = [ProductDTO(pm) for pm in results]
-    s3_client = boto3.client("s3")
-    s3_client.put_object(
-        Bucket=public_content_bucket_name,
-        Key="products.json",
-        Body=jsons.dumps(products),
+def export_to_s3(
+    format: str = Query("ndjson", regex="^(ndjson|json)$"),
+    current_user: AccessUser = Depends(auth.scope(["Admin"])),
+):
+    manifest = export_items(
+        get_client("s3"),
+        public_content_bucket_name,
+        "products.{}".format(format),
+        parallel_scan(ProductModel),
+        serialize=lambda pm: orjson.dumps(encode_product(pm)),
+        json_array=format == "json",
     )
-    s3_client.close()
-    return {"ok": len(products)}
+    return {"ok": manifest["item_count"], "manifest": manifest}
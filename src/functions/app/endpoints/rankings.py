@@ -0,0 +1,87 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
+from pynamodb.exceptions import UpdateError
+
+from models.products import ProductModel
+from utils.auth import auth, AccessUser
+from utils.cache import product_cache
+from utils.pagination import encode_cursor, decode_cursor, read_page
+from utils.ranking import RANKING_PARTITION, ranking_actions
+from utils.scan import parallel_scan
+from utils.serialization import encode_product
+
+router = APIRouter(
+    prefix="/rankings",
+    tags=["Rankings"],
+)
+
+
+@router.get("")
+def get_rankings(
+    category: Optional[str] = None,
+    limit: int = Query(25, ge=1, le=100),
+    cursor: Optional[str] = None,
+):
+    scope = "rankings:{}".format(category or "")
+    if category is not None:
+        results_iter = ProductModel.category_score_index.query(
+            category,
+            scan_index_forward=False,
+            limit=limit,
+            last_evaluated_key=decode_cursor(cursor, scope),
+        )
+    else:
+        results_iter = ProductModel.score_index.query(
+            RANKING_PARTITION,
+            scan_index_forward=False,
+            limit=limit,
+            last_evaluated_key=decode_cursor(cursor, scope),
+        )
+    results = read_page(results_iter, cursor)
+
+    return ORJSONResponse(
+        {
+            "items": [encode_product(pm) for pm in results],
+            "cursor": encode_cursor(results_iter.last_evaluated_key, scope),
+        }
+    )
+
+
+@router.post("/backfill")
+def backfill_rankings(current_user: AccessUser = Depends(auth.scope(["Admin"]))):
+    """
+    Score the products written before rankings existed. Batch syncs skip
+    unchanged products, so without this they never reach the score indexes.
+    """
+    updated = 0
+    conflicts = 0
+    for product_model in parallel_scan(
+        ProductModel,
+        attributes_to_get=["ean", "stars", "score", "rank_partition", "version"],
+    ):
+        if product_model.score is not None and product_model.rank_partition is not None:
+            continue
+
+        # A rating landing in between changes the stars, the next run
+        # picks the product up again if that write did not score it
+        if product_model.version is None:
+            condition = ProductModel.version.does_not_exist()
+        else:
+            condition = ProductModel.version == product_model.version
+        try:
+            product_model.update(
+                actions=ranking_actions(product_model.stars)
+                + [ProductModel.version.add(1)],
+                condition=ProductModel.ean.exists() & condition,
+            )
+        except UpdateError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            conflicts += 1
+            continue
+        product_cache.invalidate(product_model.ean)
+        updated += 1
+
+    return {"ok": updated, "conflicts": conflicts}
@@ -1,13 +1,27 @@
-from time import time
-from fastapi import APIRouter, Depends, HTTPException, Response
+import random
+import re
+from time import sleep, time
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from pynamodb.connection import Connection
+from pynamodb.exceptions import TransactWriteError
+from pynamodb.transactions import TransactGet, TransactWrite
 
 from utils.auth import auth, AccessUser
+from utils.cache import product_cache
+from utils.constants import region, star_aggregation
+from utils.http import conditional_response
+from utils.ranking import STAR_VALUES, ranking_actions
 
+from models.dbmodel import ConnectionMeta
 from models.products import (
     ProductModel,
+    StarsModel,
 )
-from models.ratings import Rating, RatingDTO, RatingModel
+from models.ratings import Rating, RatingModel
 from models.users import UserModel
+from utils.serialization import encode_rating
 from utils.utils import RatingToString
 
 router = APIRouter(
@@ -15,63 +29,205 @@ router = APIRouter(
     tags=["Ratings"],
 )
 
+RATING_WRITE_ATTEMPTS = 3
+# Upper bound of the random wait before the first retry, doubled per retry
+RATING_RETRY_BASE_DELAY = 0.02
 
-@router.post("/{ean}")
-def rate_product(
-    ean: str,
-    new_rating: Rating,
-    current_user: AccessUser = Depends(auth.claim(AccessUser)),
-):
-    user = UserModel.get(current_user.sub)
+# Cancellation reasons that mean another write got in between the read
+# and the transaction, so a fresh read can succeed
+RACE_REASONS = {"ConditionalCheckFailed", "TransactionConflict"}
+
+transaction_connection = Connection(
+    region=region,
+    max_pool_connections=ConnectionMeta.max_pool_connections,
+    max_retry_attempts=ConnectionMeta.max_retry_attempts,
+    connect_timeout_seconds=ConnectionMeta.connect_timeout_seconds,
+    read_timeout_seconds=ConnectionMeta.read_timeout_seconds,
+)
 
-    if new_rating.rating < 1 or new_rating.rating > 5:
-        raise HTTPException(status_code=400, detail="Rating must be between 1-5")
+
+def read_rating_state(ean: str, user_id: str):
+    """Fetch the product and the user's previous rating in one round trip."""
+    with TransactGet(connection=transaction_connection) as transaction:
+        product_future = transaction.get(ProductModel, ean)
+        rating_future = transaction.get(RatingModel, ean, user_id)
 
     try:
-        old_rating = RatingModel.get(ean, current_user.sub)
-        old_num = RatingToString(old_rating.rating)
-    except:
-        old_num = None
-        print("Old rating not found")
+        product_model = product_future.get()
+    except ProductModel.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    try:
+        old_rating = rating_future.get()
+    except RatingModel.DoesNotExist:
+        old_rating = None
 
+    return product_model, old_rating
+
+
+def write_rating(
+    ean: str, user_id: str, new_rating: Rating, product_model: ProductModel, old_rating
+):
+    """
+    Write the rating and move the star counters between buckets in a single
+    transaction. The rating condition pins the previous value, so a
+    concurrent re-rate by the same user cancels this write instead of
+    decrementing the same bucket twice. The product condition pins
+    the product version, because the new score is computed from the counters
+    read in `product_model` and is only right if nobody else rated since.
+    """
+    now = int(time())
     num = RatingToString(new_rating.rating)
 
-    rating_model = RatingModel(ean=ean, userId=current_user.sub)
+    if old_rating is None:
+        old_num = None
+        username = UserModel.get(user_id).username
+        rating_condition = RatingModel.userId.does_not_exist()
+    else:
+        old_num = RatingToString(old_rating.rating)
+        username = old_rating.username
+        if username is None:
+            username = UserModel.get(user_id).username
+        rating_condition = RatingModel.rating == old_rating.rating
 
-    update_actions = [
+    rating_actions = [
         RatingModel.rating.set(new_rating.rating),
         RatingModel.comment.set(new_rating.comment),
-        RatingModel.updated_at.set(int(time())),
-        RatingModel.username.set(user.username),
+        RatingModel.updated_at.set(now),
+        RatingModel.username.set(username),
     ]
+    if old_num is None:
+        rating_actions.append(RatingModel.created_at.set(now))
+
+    with TransactWrite(connection=transaction_connection) as transaction:
+        transaction.update(
+            RatingModel(ean=ean, userId=user_id),
+            actions=rating_actions,
+            condition=rating_condition,
+        )
 
-    if num != old_num:
-        if old_num is None:
-            update_actions.append(RatingModel.created_at.set(int(time())))
-        else:
-            ProductModel(ean=ean).update(
-                actions=[
-                    ProductModel.stars[old_num].set(ProductModel.stars[old_num] - 1)
-                ]
+        # The product is written even when only the comment changed, its
+        # ETag covers the latest ratings through the product version
+        product_actions = [ProductModel.version.add(1)]
+        if num != old_num:
+            stars = {
+                name: getattr(product_model.stars, name, None) or 0
+                for name in STAR_VALUES
+            }
+            stars[num] += 1
+            product_actions.append(
+                ProductModel.stars[num].set(ProductModel.stars[num] + 1)
             )
+            if old_num is not None:
+                stars[old_num] -= 1
+                product_actions.append(
+                    ProductModel.stars[old_num].set(ProductModel.stars[old_num] - 1)
+                )
+            product_actions += ranking_actions(StarsModel(**stars))
 
-        ProductModel(ean=ean).update(
-            actions=[ProductModel.stars[num].set(ProductModel.stars[num] + 1)]
+        if product_model.version is None:
+            product_condition = ProductModel.version.does_not_exist()
+        else:
+            product_condition = ProductModel.version == product_model.version
+        transaction.update(
+            ProductModel(ean=ean),
+            actions=product_actions,
+            condition=ProductModel.ean.exists() & product_condition,
         )
 
+
+def write_rating_only(ean: str, user_id: str, new_rating: Rating):
+    """
+    Stream aggregation mode: only the rating item is written, the
+    star-aggregator function folds the change into the product's counters.
+    """
     try:
-        rating_model.update(actions=update_actions)
-    except Exception as e:
-        print(e)
-        raise HTTPException(status_code=500)
+        ProductModel.get(ean, attributes_to_get=["ean"])
+    except ProductModel.DoesNotExist:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    now = int(time())
+    try:
+        old_rating = RatingModel.get(ean, user_id, attributes_to_get=["username"])
+        username = old_rating.username
+    except RatingModel.DoesNotExist:
+        username = None
+    if username is None:
+        username = UserModel.get(user_id).username
+
+    RatingModel(ean=ean, userId=user_id).update(
+        actions=[
+            RatingModel.rating.set(new_rating.rating),
+            RatingModel.comment.set(new_rating.comment),
+            RatingModel.updated_at.set(now),
+            RatingModel.username.set(username),
+            RatingModel.created_at.set(RatingModel.created_at | now),
+        ]
+    )
+
+
+def cancellation_reasons(e: TransactWriteError) -> List[str]:
+    """
+    Per-item reason codes of a cancelled transaction. pynamodb drops the
+    CancellationReasons field, but DynamoDB repeats the codes in the message:
+    "... specific reasons [ConditionalCheckFailed, None]".
+    """
+    if e.cause_response_code != "TransactionCanceledException":
+        return []
+    match = re.search(r"\[([^\]]*)\]\s*$", e.cause_response_message or "")
+    if match is None:
+        return []
+    return [reason.strip() for reason in match.group(1).split(",")]
+
+
+def lost_race(e: TransactWriteError) -> bool:
+    reasons = set(cancellation_reasons(e)) - {"None"}
+    return bool(reasons) and reasons <= RACE_REASONS
+
+
+@router.post("/{ean}")
+def rate_product(
+    ean: str,
+    new_rating: Rating,
+    current_user: AccessUser = Depends(auth.claim(AccessUser)),
+):
+    if new_rating.rating < 1 or new_rating.rating > 5:
+        raise HTTPException(status_code=400, detail="Rating must be between 1-5")
+
+    try:
+        if star_aggregation == "stream":
+            write_rating_only(ean, current_user.sub, new_rating)
+            return Response(status_code=204)
+
+        for attempt in range(RATING_WRITE_ATTEMPTS):
+            product_model, old_rating = read_rating_state(ean, current_user.sub)
+            try:
+                write_rating(
+                    ean, current_user.sub, new_rating, product_model, old_rating
+                )
+                break
+            except TransactWriteError as e:
+                # Lost a race with another write to the same rating or
+                # product. Anything else, such as a validation error, is
+                # not fixed by trying again
+                if not lost_race(e):
+                    raise
+                print(e)
+                if attempt + 1 < RATING_WRITE_ATTEMPTS:
+                    sleep(random.uniform(0, RATING_RETRY_BASE_DELAY * 2**attempt))
+        else:
+            raise HTTPException(status_code=409, detail="Rating changed, try again.")
+    finally:
+        product_cache.invalidate(ean)
 
     return Response(status_code=204)
 
 
 @router.get("/{ean}")
 def get_product_ratings(
+    request: Request,
     ean: str,
 ):
     results_iter = RatingModel.query(ean, limit=10)
     results = list(results_iter)
-    return [RatingDTO(pm) for pm in results]
+    return conditional_response(request, [encode_rating(pm) for pm in results])
@@ -0,0 +1,54 @@
+from botocore.exceptions import ClientError
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+
+from models.products import ProductModel
+from utils.auth import auth, AccessUser
+from utils.clients import get_client
+from utils.constants import (
+    public_content_bucket_name,
+    search_index_key,
+    search_index_path,
+    search_index_ttl,
+)
+from utils.scan import parallel_scan
+from utils.search import SearchIndexLoader, build_index
+
+# Mounted in front of the products router so that /products/search is not
+# taken for an EAN by GET /products/{ean}
+router = APIRouter(
+    prefix="/products",
+    tags=["Products"],
+)
+
+search_index = SearchIndexLoader(
+    lambda: get_client("s3"),
+    bucket=public_content_bucket_name,
+    key=search_index_key,
+    path=search_index_path,
+    ttl=search_index_ttl,
+)
+
+
+@router.get("/search")
+def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    lang: str = Query("fi", regex="^(fi|sv|en)$"),
+    limit: int = Query(20, ge=1, le=50),
+):
+    try:
+        index = search_index.get()
+    except ClientError as e:
+        print(e)
+        raise HTTPException(status_code=503, detail="Search index is not available.")
+
+    return ORJSONResponse({"items": index.search(q, lang, limit)})
+
+
+@router.post("/search/index")
+def build_search_index(current_user: AccessUser = Depends(auth.scope(["Admin"]))):
+    path = "{}.build".format(search_index_path)
+    count = build_index(parallel_scan(ProductModel), path)
+
+    get_client("s3").upload_file(path, public_content_bucket_name, search_index_key)
+    return {"ok": count}
@@ -1,11 +1,13 @@
 import email
 from fastapi import APIRouter, Depends, Body, Response
+from fastapi.responses import ORJSONResponse
 
 from utils.auth import auth, AccessUser
 
 from .auth import verifyCredentials, disableUser
 
 from models.users import UserModel
+from utils.serialization import encode_user
 from typing import Optional
 
 router = APIRouter(
@@ -17,7 +19,7 @@ router = APIRouter(
 @router.get("/me")
 def get_current_user(current_user: AccessUser = Depends(auth.claim(AccessUser))):
     user = UserModel.get(current_user.sub)
-    return user.attribute_values
+    return ORJSONResponse(encode_user(user))
 
 
 @router.put("/me")
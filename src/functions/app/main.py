@@ -1,13 +1,24 @@
 from fastapi import FastAPI
 from mangum import Mangum
 
-from endpoints import auth, products, users, ratings
+from endpoints import auth, products, users, ratings, rankings, search, prices
+from utils import instrumentation, profiling
+from utils.constants import request_metrics, request_profiling
 
 app = FastAPI(title="Juoma Ranking", root_path="/")
 
+app.include_router(search.router)
 app.include_router(products.router)
 app.include_router(users.router)
 app.include_router(ratings.router)
+app.include_router(rankings.router)
+app.include_router(prices.router)
 app.include_router(auth.router)
 
+if request_metrics:
+    instrumentation.install(app)
+
+if request_profiling:
+    profiling.install(app)
+
 handler = Mangum(app)
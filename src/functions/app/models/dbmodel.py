@@ -1,8 +1,30 @@
 from pynamodb.models import Model
 
+from utils.constants import (
+    aws_connect_timeout,
+    aws_max_pool_connections,
+    aws_max_retries,
+    aws_read_timeout,
+)
+
+
+class ConnectionMeta:
+    """
+    Connection settings shared by every table model. Models declare
+    `class Meta(ConnectionMeta)` and add their table name and region.
+
+    The pool is sized for parallel scans, which run one request per segment.
+    """
+
+    max_pool_connections = aws_max_pool_connections
+    max_retry_attempts = aws_max_retries
+    connect_timeout_seconds = aws_connect_timeout
+    read_timeout_seconds = aws_read_timeout
+
+
 class DBModel(Model):
     def to_dict(self):
         rval = {}
         for key in self.attribute_values:
             rval[key] = self.__getattribute__(key)
-        return rval
\ No newline at end of file
+        return rval
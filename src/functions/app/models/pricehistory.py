@@ -3,7 +3,7 @@ import os
 from pydantic import BaseModel
 from pynamodb.attributes import UnicodeAttribute, NumberAttribute, NumberAttribute
 
-from .dbmodel import DBModel
+from .dbmodel import ConnectionMeta, DBModel
 
 table_name = os.getenv("pricehistory_table_name")
 region = os.getenv("region")
@@ -20,9 +20,12 @@ class PriceHistory(BaseModel):
 class PriceHistoryModel(DBModel):
     """
     A DynamoDB Pricehistory
+
+    Daily rows use sk "YYYY-MM-DD-store". Monthly rollups share the table
+    under sk "M#YYYY-MM#store" and carry the price_* aggregates.
     """
 
-    class Meta:
+    class Meta(ConnectionMeta):
         table_name = table_name
         region = region
 
@@ -31,11 +34,16 @@ class PriceHistoryModel(DBModel):
     price = NumberAttribute()
     created_at = NumberAttribute()
     store = UnicodeAttribute()
+    price_min = NumberAttribute(null=True)
+    price_max = NumberAttribute(null=True)
+    price_sum = NumberAttribute(null=True)
+    price_count = NumberAttribute(null=True)
+    # Rollups only: bumped on every rebuild, the next rebuild is conditioned on it
+    version = NumberAttribute(null=True)
+
+
+ROLLUP_PREFIX = "M#"
 
 
-class PriceHistoryDTO:
-    def __init__(self, price_history: PriceHistoryModel) -> None:
-        self.ean = price_history.ean
-        self.price = price_history.price
-        self.created_at = price_history.created_at
-        self.store = price_history.store
+def rollup_sk(month: str, store: str) -> str:
+    return "{}{}#{}".format(ROLLUP_PREFIX, month, store)
@@ -9,21 +9,14 @@ from pynamodb.attributes import (
     MapAttribute,
     ListAttribute,
 )
+from pynamodb.indexes import GlobalSecondaryIndex, AllProjection
 
-from .dbmodel import DBModel
-from .ratings import RatingDTO, RatingAmountDTO
+from .dbmodel import ConnectionMeta, DBModel
 
 table_name = os.getenv("products_table_name")
 region = os.getenv("region")
 
 
-class PriceDataDTO:
-    def __init__(self, price: int, updated_at: Optional[int], store: str) -> None:
-        self.price = price
-        self.updated_at = updated_at
-        self.store = store
-
-
 class PriceData(BaseModel):
     price: int
     updated_at: Optional[int]
@@ -42,13 +35,6 @@ class Nutrients(BaseModel):
     value: Optional[str]
 
 
-class NutrientsDTO:
-    def __init__(self, name: str, ri: str, value: str) -> None:
-        self.name = name
-        self.ri = ri
-        self.value = value
-
-
 class NutrientsModel(MapAttribute):
     name = UnicodeAttribute(null=True)
     ri = UnicodeAttribute(null=True)
@@ -71,13 +57,56 @@ class StarsModel(MapAttribute):
     five = NumberAttribute()
 
 
-class StarsDTO:
-    def __init__(self, one: int, two: int, three: int, four: int, five: int) -> None:
-        self.one = one
-        self.two = two
-        self.three = three
-        self.four = four
-        self.five = five
+class CategoryScoreIndex(GlobalSecondaryIndex):
+    """
+    Products of one category ordered by ranking score
+    """
+
+    class Meta:
+        index_name = "category-score-index"
+        projection = AllProjection()
+
+    category = UnicodeAttribute(hash_key=True)
+    score = NumberAttribute(range_key=True)
+
+
+class ScoreIndex(GlobalSecondaryIndex):
+    """
+    All ranked products ordered by ranking score
+    """
+
+    class Meta:
+        index_name = "score-index"
+        projection = AllProjection()
+
+    rank_partition = UnicodeAttribute(hash_key=True)
+    score = NumberAttribute(range_key=True)
+
+
+class CategoryPriceIndex(GlobalSecondaryIndex):
+    """
+    Products of one category ordered by price
+    """
+
+    class Meta:
+        index_name = "category-price-index"
+        projection = AllProjection()
+
+    category = UnicodeAttribute(hash_key=True)
+    price = NumberAttribute(range_key=True)
+
+
+class CategoryUpdatedAtIndex(GlobalSecondaryIndex):
+    """
+    Products of one category ordered by last update
+    """
+
+    class Meta:
+        index_name = "category-updated_at-index"
+        projection = AllProjection()
+
+    category = UnicodeAttribute(hash_key=True)
+    updated_at = NumberAttribute(range_key=True)
 
 
 class ProductModel(DBModel):
@@ -85,7 +114,7 @@ class ProductModel(DBModel):
     A DynamoDB Products
     """
 
-    class Meta:
+    class Meta(ConnectionMeta):
         table_name = table_name
         region = region
 
@@ -111,6 +140,18 @@ class ProductModel(DBModel):
     ingredients_en = UnicodeAttribute(null=True)
     nutrients = ListAttribute(of=NutrientsModel, null=True)
     supplier = UnicodeAttribute(null=True)
+    score = NumberAttribute(null=True)
+    rank_partition = UnicodeAttribute(null=True)
+    # Bumped by every write to the product: the product ETag is derived
+    # from it and rating writes are conditioned on it
+    version = NumberAttribute(null=True)
+    # Stream aggregation mode: newest rating stream record folded into stars
+    stars_seq = NumberAttribute(null=True)
+
+    category_score_index = CategoryScoreIndex()
+    category_price_index = CategoryPriceIndex()
+    category_updated_at_index = CategoryUpdatedAtIndex()
+    score_index = ScoreIndex()
 
 
 class Product(BaseModel):
@@ -136,50 +177,3 @@ class Product(BaseModel):
     ingredients_en: Optional[str]
     nutrients: Optional[List[Nutrients]]
     supplier: Optional[str]
-
-
-class ProductDTO:
-    ratings: Optional[List[RatingDTO]]
-    rating_amounts: Optional[List[RatingAmountDTO]]
-
-    def __init__(self, product: ProductModel) -> None:
-        self.ean = product.ean
-        self.name = product.name
-        self.category = product.category
-        self.stars = StarsDTO(
-            one=product.stars.one,
-            two=product.stars.two,
-            three=product.stars.three,
-            four=product.stars.four,
-            five=product.stars.five,
-        )
-        self.photo = product.photo
-        self.price = product.price
-        self.created_at = product.created_at
-        self.updated_at = product.updated_at
-        if product.price_data is not None:
-            self.price_data = [
-                PriceDataDTO(price=pd.price, updated_at=pd.updated_at, store=pd.store)
-                for pd in product.price_data
-                if pd is not None
-            ]
-
-        self.store = product.store
-        self.main_product_ean = product.main_product_ean
-        self.name_fi = product.name_fi
-        self.name_sv = product.name_sv
-        self.name_en = product.name_en
-        self.description_fi = product.description_fi
-        self.description_sv = product.description_sv
-        self.description_en = product.description_en
-        self.ingredients_fi = product.ingredients_fi
-        self.ingredients_sv = product.ingredients_sv
-        self.ingredients_en = product.ingredients_en
-        if product.nutrients is not None:
-            self.nutrients = [
-                NutrientsDTO(name=n.name, ri=n.ri, value=n.value)
-                for n in product.nutrients
-                if n is not None
-            ]
-
-        self.supplier = product.supplier
@@ -3,7 +3,7 @@ import os
 from pydantic import BaseModel
 from pynamodb.attributes import NumberAttribute, UnicodeAttribute, BooleanAttribute
 
-from .dbmodel import DBModel
+from .dbmodel import ConnectionMeta, DBModel
 
 table_name = os.getenv("users_table_name")
 region = os.getenv("region")
@@ -24,7 +24,7 @@ class UserModel(DBModel):
     A DynamoDB User
     """
 
-    class Meta:
+    class Meta(ConnectionMeta):
         table_name = table_name
         region = region
 
@@ -35,13 +35,3 @@ class UserModel(DBModel):
     profileImgUrl = UnicodeAttribute()
     type = UnicodeAttribute(null=True)
     deleted = BooleanAttribute(null=True)
-
-
-class UserDTO:
-    def __init__(self, user: UserModel) -> None:
-        self.userId = user.userId
-        self.username = user.username
-        self.email = user.email
-        self.createdAt = user.createdAt
-        self.profileImgUrl = user.profileImgUrl
-        self.type = user.type
@@ -1,19 +1,190 @@
+import hashlib
+import json
 import os
+import threading
+from time import monotonic, time
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+from urllib.request import urlopen
+
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel, ValidationError
+
+from utils.cache import LRUCache
+from utils.instrumentation import timed
+from utils.constants import (
+    jwks_path,
+    jwks_refresh_interval,
+    region,
+    token_cache_size,
+    user_pool_client_id,
+    user_pool_id,
+)
+
+NOT_AUTHENTICATED = "Not authenticated"
+NO_PUBLICKEY = "JWK public Attribute for authorization token not found"
+NOT_VERIFIED = "Not verified"
+SCOPE_NOT_MATCHED = "Scope not matched"
+NOT_VALIDATED_CLAIMS = "Validation Error for Claims"
+
+T = TypeVar("T", bound=BaseModel)
 
-from pydantic import BaseModel
-from fastapi_cloudauth.cognito import Cognito, CognitoCurrentUser
 
 class AccessUser(BaseModel):
     sub: str
 
-auth = Cognito(
-    region=os.environ["region"], 
-    userPoolId=os.environ["user_pool_id"],
-    client_id=os.environ["user_pool_client_id"]
-)
 
-get_current_user = CognitoCurrentUser(
-    region=os.environ["region"], 
-    userPoolId=os.environ["user_pool_id"],
-    client_id=os.environ["user_pool_client_id"]
-)
+class JWKS:
+    """
+    Cognito signing keys, fetched on first use instead of at import.
+
+    The raw key set is persisted to `path` so a fresh process in the same
+    container can skip the download. An unknown `kid` (key rotation) triggers
+    a refetch, at most once every `refresh_interval` seconds.
+    """
+
+    def __init__(self, url: str, path: str, refresh_interval: float) -> None:
+        self.url = url
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._keys: Dict[str, Any] = {}
+        self._loaded = False
+        self._fetched_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def get(self, kid: str):
+        key = self._keys.get(kid)
+        if key is not None:
+            return key
+
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                self._load_file()
+            if kid not in self._keys and self._may_fetch():
+                self._fetch()
+            return self._keys.get(kid)
+
+    def _may_fetch(self) -> bool:
+        return self._fetched_at is None or monotonic() - self._fetched_at >= self.refresh_interval
+
+    def _load_file(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                self._set_keys(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    def _fetch(self) -> None:
+        self._fetched_at = monotonic()
+        with urlopen(self.url, timeout=5) as response:
+            body = response.read()
+        self._set_keys(json.loads(body))
+
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, self.path)
+
+    def _set_keys(self, jwks: dict) -> None:
+        from jose import jwk
+
+        self._keys = {key["kid"]: jwk.construct(key) for key in jwks["keys"]}
+
+
+class CognitoAuth:
+    """
+    Verifies Cognito access tokens. Drop-in for fastapi_cloudauth's Cognito:
+    `scope()` and `claim()` return FastAPI dependencies.
+
+    Verified claims are cached by token hash until the token expires, so a
+    warm container checks each signature once.
+    """
+
+    def __init__(self, region: str, user_pool_id: str, client_id: str) -> None:
+        self.issuer = "https://cognito-idp.{}.amazonaws.com/{}".format(region, user_pool_id)
+        self.client_id = client_id
+        self.scope_key = "cognito:groups"
+        self.jwks = JWKS(
+            "{}/.well-known/jwks.json".format(self.issuer),
+            jwks_path.format(user_pool_id),
+            jwks_refresh_interval,
+        )
+        self.claims_cache = LRUCache(maxsize=token_cache_size, ttl=0)
+        self._bearer = HTTPBearer(auto_error=False)
+
+    def verify(self, token: str) -> dict:
+        with timed("auth"):
+            return self._verify(token)
+
+    def _verify(self, token: str) -> dict:
+        cache_key = hashlib.sha256(token.encode()).digest()
+        claims = self.claims_cache.get(cache_key)
+        if claims is not None:
+            return claims
+
+        # python-jose pulls in cryptography, which public endpoints never need
+        from jose import jwt
+        from jose.exceptions import JWTError
+
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except JWTError:
+            raise HTTPException(status_code=401, detail=NOT_AUTHENTICATED)
+
+        key = self.jwks.get(kid) if kid else None
+        if key is None:
+            raise HTTPException(status_code=401, detail=NO_PUBLICKEY)
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=["RS256"],
+                issuer=self.issuer,
+                # Access tokens carry no aud, the app client is in client_id
+                options={"verify_aud": False, "verify_at_hash": False},
+            )
+        except JWTError:
+            raise HTTPException(status_code=401, detail=NOT_VERIFIED)
+
+        now = time()
+        if (
+            claims.get("token_use") != "access"
+            or claims.get("client_id") != self.client_id
+            or claims.get("iat", 0) > now
+        ):
+            raise HTTPException(status_code=401, detail=NOT_VERIFIED)
+
+        self.claims_cache.set(cache_key, claims, ttl=claims["exp"] - now)
+        return claims
+
+    def require_scope(self, token: str, groups: List[str]) -> dict:
+        claims = self.verify(token)
+        if not set(groups).issubset(claims.get(self.scope_key) or []):
+            raise HTTPException(status_code=403, detail=SCOPE_NOT_MATCHED)
+        return claims
+
+    def _credentials(self, http_auth: Optional[HTTPAuthorizationCredentials]) -> str:
+        if http_auth is None:
+            raise HTTPException(status_code=401, detail=NOT_AUTHENTICATED)
+        return http_auth.credentials
+
+    def scope(self, groups: List[str]) -> Callable[..., dict]:
+        def dependency(http_auth=Depends(self._bearer)) -> dict:
+            return self.require_scope(self._credentials(http_auth), groups)
+
+        return dependency
+
+    def claim(self, schema: Type[T]) -> Callable[..., T]:
+        def dependency(http_auth=Depends(self._bearer)) -> T:
+            claims = self.verify(self._credentials(http_auth))
+            try:
+                return schema.parse_obj(claims)
+            except ValidationError:
+                raise HTTPException(status_code=401, detail=NOT_VALIDATED_CLAIMS)
+
+        return dependency
+
+
+auth = CognitoAuth(region=region, user_pool_id=user_pool_id, client_id=user_pool_client_id)
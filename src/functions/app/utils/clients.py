@@ -0,0 +1,51 @@
+import threading
+from typing import Any, Dict
+
+from utils.constants import (
+    aws_connect_timeout,
+    aws_max_retries,
+    aws_max_pool_connections,
+    aws_read_timeout,
+    region,
+    request_metrics,
+)
+from utils.instrumentation import instrument_client
+
+_clients: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def client_config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=aws_max_pool_connections,
+        connect_timeout=aws_connect_timeout,
+        read_timeout=aws_read_timeout,
+        retries={"mode": "adaptive", "max_attempts": aws_max_retries},
+    )
+
+
+def get_client(service: str):
+    """
+    Shared boto3 client for `service`, created on first use.
+
+    boto3 is imported here rather than at module level so that cold starts
+    which never talk to S3 or Cognito do not pay for it. Clients are
+    thread-safe once built and keep their connection pool for the life of
+    the container; the lock only guards construction.
+    """
+    client = _clients.get(service)
+    if client is None:
+        with _lock:
+            client = _clients.get(service)
+            if client is None:
+                import boto3
+
+                client = boto3.session.Session().client(
+                    service, region_name=region, config=client_config()
+                )
+                if request_metrics:
+                    instrument_client(client)
+                _clients[service] = client
+    return client
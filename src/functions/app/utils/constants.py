@@ -5,3 +5,29 @@ public_content_bucket_name = os.environ.get("public_content_bucket_name", None)
 user_pool_id = os.environ.get("user_pool_id", None)
 user_pool_client_id = os.environ.get("user_pool_client_id", None)
 region = os.environ.get("region", None)
+cursor_secret = os.environ.get("cursor_secret", None)
+scan_segments = int(os.environ.get("scan_segments", 8))
+batch_write_workers = int(os.environ.get("batch_write_workers", 8))
+export_part_size = int(os.environ.get("export_part_size", 8 * 1024 * 1024))
+product_cache_ttl = int(os.environ.get("product_cache_ttl", 60))
+product_cache_size = int(os.environ.get("product_cache_size", 1024))
+ranking_prior_mean = float(os.environ.get("ranking_prior_mean", 3.0))
+ranking_prior_weight = float(os.environ.get("ranking_prior_weight", 10))
+search_index_key = os.environ.get("search_index_key", "search/products.idx")
+search_index_path = os.environ.get("search_index_path", "/tmp/products.idx")
+search_index_ttl = int(os.environ.get("search_index_ttl", 300))
+star_aggregation = os.environ.get("star_aggregation", "sync")
+jwks_path = os.environ.get("jwks_path", "/tmp/cognito-jwks-{}.json")
+jwks_refresh_interval = int(os.environ.get("jwks_refresh_interval", 60))
+token_cache_size = int(os.environ.get("token_cache_size", 1024))
+aws_max_pool_connections = int(os.environ.get("aws_max_pool_connections", 50))
+aws_max_retries = int(os.environ.get("aws_max_retries", 5))
+aws_connect_timeout = int(os.environ.get("aws_connect_timeout", 5))
+aws_read_timeout = int(os.environ.get("aws_read_timeout", 30))
+request_metrics = os.environ.get("request_metrics", "false").lower() == "true"
+request_profiling = os.environ.get("request_profiling", "false").lower() == "true"
+profile_bucket_name = os.environ.get("profile_bucket_name", None)
+profile_path = os.environ.get("profile_path", "/tmp/profiles")
+profile_interval_ms = float(os.environ.get("profile_interval_ms", 5))
+http_max_age = int(os.environ.get("http_max_age", 60))
+http_stale_while_revalidate = int(os.environ.get("http_stale_while_revalidate", 30))
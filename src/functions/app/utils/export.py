@@ -0,0 +1,134 @@
+import hashlib
+import json
+import zlib
+from time import time
+from typing import Callable, Iterable, Optional
+
+from utils.constants import export_part_size
+
+
+class GzipMultipartUpload:
+    """
+    Write-only stream that gzips its input and ships it to S3 as a multipart
+    upload, holding at most one part in memory.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket: str,
+        key: str,
+        content_type: str,
+        part_size: int = export_part_size,
+    ) -> None:
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.sha256 = hashlib.sha256()
+
+        # wbits=31 produces a gzip container instead of a raw zlib stream
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._buffer = bytearray()
+        self._parts = []
+
+        upload = s3_client.create_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            ContentType=content_type,
+            ContentEncoding="gzip",
+        )
+        self._upload_id = upload["UploadId"]
+
+    def write(self, data: bytes) -> None:
+        self.raw_bytes += len(data)
+        self.sha256.update(data)
+        self._buffer += self._compressor.compress(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self) -> None:
+        part_number = len(self._parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=bytes(self._buffer),
+        )
+        self._parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.compressed_bytes += len(self._buffer)
+        self._buffer = bytearray()
+
+    def close(self) -> None:
+        self._buffer += self._compressor.flush()
+        self._upload_part()
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": self._parts},
+        )
+
+    def abort(self) -> None:
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+        )
+
+
+def export_items(
+    s3_client,
+    bucket: str,
+    key: str,
+    items: Iterable,
+    serialize: Callable[[object], bytes],
+    json_array: bool = False,
+) -> dict:
+    """
+    Stream items to a gzipped S3 object, as NDJSON or as a single JSON array,
+    and store a manifest next to it at `<key>.manifest.json`.
+    """
+    upload = GzipMultipartUpload(
+        s3_client,
+        bucket,
+        key,
+        content_type="application/json" if json_array else "application/x-ndjson",
+    )
+    item_count = 0
+    try:
+        if json_array:
+            upload.write(b"[")
+        for item in items:
+            data = serialize(item)
+            if json_array:
+                upload.write(data if item_count == 0 else b"," + data)
+            else:
+                upload.write(data + b"\n")
+            item_count += 1
+        if json_array:
+            upload.write(b"]")
+        upload.close()
+    except Exception:
+        upload.abort()
+        raise
+
+    manifest = {
+        "key": key,
+        "format": "json" if json_array else "ndjson",
+        "content_encoding": "gzip",
+        "item_count": item_count,
+        "bytes": upload.raw_bytes,
+        "compressed_bytes": upload.compressed_bytes,
+        "sha256": upload.sha256.hexdigest(),
+        "created_at": int(time()),
+    }
+    s3_client.put_object(
+        Bucket=bucket,
+        Key="{}.manifest.json".format(key),
+        Body=json.dumps(manifest).encode(),
+        ContentType="application/json",
+    )
+    return manifest
@@ -0,0 +1,70 @@
+import hashlib
+from typing import Any, Optional
+
+import orjson
+from fastapi import Request, Response
+
+from utils.constants import http_max_age, http_stale_while_revalidate
+
+# Part of every precomputed ETag. Bump it when the JSON a resource is
+# served as changes without the stored version changing, e.g. a new or
+# renamed field, so clients and CDNs stop revalidating the old bodies.
+REPRESENTATION_VERSION = 1
+
+
+def make_etag(*parts: Any) -> str:
+    """Strong ETag from the values that determine a representation."""
+    digest = hashlib.blake2b(
+        orjson.dumps((REPRESENTATION_VERSION,) + parts), digest_size=16
+    ).hexdigest()
+    return '"{}"'.format(digest)
+
+
+def body_etag(body: bytes) -> str:
+    return '"{}"'.format(hashlib.blake2b(body, digest_size=16).hexdigest())
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses the weak comparison, so W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+
+def cache_headers(etag: str, max_age: Optional[int] = None) -> dict:
+    max_age = http_max_age if max_age is None else max_age
+    return {
+        "ETag": etag,
+        "Cache-Control": "public, max-age={}, stale-while-revalidate={}".format(
+            max_age, http_stale_while_revalidate
+        ),
+    }
+
+
+def not_modified(etag: str, max_age: Optional[int] = None) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, max_age))
+
+
+def conditional_response(
+    request: Request,
+    content: Any,
+    etag: Optional[str] = None,
+    max_age: Optional[int] = None,
+) -> Response:
+    """
+    JSON response with ETag and Cache-Control headers, or an empty 304 when
+    the client's If-None-Match already has it. Without a precomputed `etag`
+    the serialized body is hashed.
+    """
+    body = orjson.dumps(
+        content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+    )
+    etag = etag or body_etag(body)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag, max_age)
+    return Response(
+        body, media_type="application/json", headers=cache_headers(etag, max_age)
+    )
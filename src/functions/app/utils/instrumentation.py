@@ -0,0 +1,237 @@
+import json
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter, time
+from typing import Dict, List, Optional
+
+from starlette.datastructures import MutableHeaders
+
+from utils.cache import product_cache
+from utils.constants import stage
+
+NAMESPACE = "JuomaRanking"
+
+_current: "ContextVar[Optional[RequestMetrics]]" = ContextVar(
+    "request_metrics", default=None
+)
+
+
+class RequestMetrics:
+    """
+    Timings of one request, broken down by AWS service and operation.
+
+    Lives in a ContextVar, which FastAPI copies into the worker thread of a
+    sync endpoint; parallel_scan copies it into its segment threads. Those
+    threads update the same object, hence the lock.
+    """
+
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        # "dynamodb.GetItem" -> [count, milliseconds]
+        self.calls: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        self.segments: Dict[str, float] = defaultdict(float)
+        self.consumed_capacity: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record_call(self, service: str, operation: str, duration_ms: float) -> None:
+        with self._lock:
+            call = self.calls["{}.{}".format(service, operation)]
+            call[0] += 1
+            call[1] += duration_ms
+            self.segments[service] += duration_ms
+
+    def record_time(self, name: str, duration_ms: float) -> None:
+        with self._lock:
+            self.segments[name] += duration_ms
+
+    def record_capacity(self, consumed) -> None:
+        # A dict for single-table operations, a list for batch and transact
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        with self._lock:
+            for entry in consumed or ():
+                self.consumed_capacity[entry.get("TableName", "")] += entry.get(
+                    "CapacityUnits", 0
+                )
+
+    def elapsed_ms(self) -> float:
+        return (perf_counter() - self.start) * 1000
+
+    def server_timing(self, total_ms: float) -> str:
+        entries = [
+            (
+                '{};dur={:.1f};desc="{} calls"'.format(
+                    service, duration, self._count(service)
+                )
+                if self._count(service)
+                else "{};dur={:.1f}".format(service, duration)
+            )
+            for service, duration in self.segments.items()
+        ]
+        entries.append("total;dur={:.1f}".format(total_ms))
+        return ", ".join(entries)
+
+    def _count(self, service: str) -> int:
+        prefix = service + "."
+        return sum(
+            int(c[0]) for name, c in self.calls.items() if name.startswith(prefix)
+        )
+
+    def emf(self, route: str, method: str, status: int, total_ms: float) -> dict:
+        """One CloudWatch Embedded Metric Format record for the request."""
+        dynamodb_calls = self._count("dynamodb")
+        return {
+            "_aws": {
+                "Timestamp": int(time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [["Stage", "Route"]],
+                        "Metrics": [
+                            {"Name": "Latency", "Unit": "Milliseconds"},
+                            {"Name": "DynamoDBTime", "Unit": "Milliseconds"},
+                            {"Name": "DynamoDBCalls", "Unit": "Count"},
+                            {"Name": "ConsumedCapacity", "Unit": "Count"},
+                        ],
+                    }
+                ],
+            },
+            "Stage": stage or "local",
+            "Route": route,
+            "Method": method,
+            "Status": status,
+            "Latency": round(total_ms, 2),
+            "DynamoDBTime": round(self.segments.get("dynamodb", 0.0), 2),
+            "DynamoDBCalls": dynamodb_calls,
+            "ConsumedCapacity": sum(self.consumed_capacity.values()),
+            "calls": {
+                name: {"count": int(count), "ms": round(duration, 2)}
+                for name, (count, duration) in self.calls.items()
+            },
+            "segments": {
+                name: round(duration, 2) for name, duration in self.segments.items()
+            },
+            "consumed_capacity": dict(self.consumed_capacity),
+            "product_cache": product_cache.stats(),
+        }
+
+
+@contextmanager
+def timed(name: str):
+    """Add the duration of the block to segment `name` of the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record_time(name, (perf_counter() - start) * 1000)
+
+
+def _before_call(model, context, **kwargs) -> None:
+    if _current.get() is not None:
+        context["request_metrics_call"] = (
+            model.service_model.endpoint_prefix,
+            model.name,
+            perf_counter(),
+        )
+
+
+def _after_call(context, **kwargs) -> None:
+    # after-call-error is not given the operation model, so before-call
+    # keeps the names along with the start time
+    metrics = _current.get()
+    call = context.get("request_metrics_call")
+    if metrics is not None and call is not None:
+        service, operation, start = call
+        metrics.record_call(service, operation, (perf_counter() - start) * 1000)
+
+
+def instrument_client(client) -> None:
+    """Time every call made through a boto3 client."""
+    client.meta.events.register("before-call", _before_call)
+    client.meta.events.register("after-call", _after_call)
+    client.meta.events.register("after-call-error", _after_call)
+
+
+def instrument_pynamodb() -> None:
+    """
+    Time every pynamodb operation and collect its consumed capacity.
+
+    pynamodb sends requests itself instead of going through the botocore
+    client, so the before-call/after-call events never fire for it.
+    Connection.dispatch is the one place every operation passes through,
+    and pynamodb already asks for ReturnConsumedCapacity=TOTAL there.
+    """
+    from pynamodb.connection.base import Connection
+
+    dispatch = Connection.dispatch
+    if getattr(dispatch, "instrumented", False):
+        return
+
+    def instrumented_dispatch(self, operation_name, operation_kwargs, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None:
+            return dispatch(self, operation_name, operation_kwargs, *args, **kwargs)
+
+        start = perf_counter()
+        try:
+            data = dispatch(self, operation_name, operation_kwargs, *args, **kwargs)
+        finally:
+            metrics.record_call(
+                "dynamodb", operation_name, (perf_counter() - start) * 1000
+            )
+        if data:
+            metrics.record_capacity(data.get("ConsumedCapacity"))
+        return data
+
+    instrumented_dispatch.instrumented = True
+    Connection.dispatch = instrumented_dispatch
+
+
+class RequestMetricsMiddleware:
+    """
+    Collects RequestMetrics for each HTTP request, adds a Server-Timing
+    header and prints one EMF log line when the request is done.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        status = 500
+
+        async def send_with_timing(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing", metrics.server_timing(metrics.elapsed_ms())
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            endpoint = scope.get("endpoint")
+            route = endpoint.__name__ if endpoint is not None else scope["path"]
+            record = metrics.emf(route, scope["method"], status, metrics.elapsed_ms())
+            print(json.dumps(record))
+
+
+def install(app) -> None:
+    """Enable request metrics on `app`. Without this none of it runs."""
+    instrument_pynamodb()
+    app.add_middleware(RequestMetricsMiddleware)
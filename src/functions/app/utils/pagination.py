@@ -0,0 +1,78 @@
+import base64
+import hashlib
+import hmac
+import json
+from typing import Iterable, List, Optional
+
+from fastapi import HTTPException
+from pynamodb.exceptions import QueryError, ScanError
+
+from utils.constants import cursor_secret
+
+if not cursor_secret:
+    # Anyone who knows the key can forge cursors, so there is no fallback
+    raise RuntimeError("cursor_secret is not set")
+
+INVALID_CURSOR = "Invalid cursor."
+
+# Attribute value types a table or index key can have
+KEY_TYPES = {"S", "N", "B"}
+
+
+def _sign(payload: bytes, scope: str) -> bytes:
+    message = scope.encode() + b"\0" + payload
+    return hmac.new(cursor_secret.encode(), message, hashlib.sha256).digest()[:16]
+
+
+def _is_key(value) -> bool:
+    return isinstance(value, dict) and all(
+        isinstance(name, str)
+        and isinstance(attribute, dict)
+        and len(attribute) == 1
+        and set(attribute) <= KEY_TYPES
+        and all(isinstance(v, str) for v in attribute.values())
+        for name, attribute in value.items()
+    )
+
+
+def encode_cursor(last_evaluated_key: Optional[dict], scope: str = "") -> Optional[str]:
+    """
+    Pack a DynamoDB last_evaluated_key into an opaque, signed page token.
+
+    The scope names the table or index query the key belongs to, so a
+    cursor cannot be replayed against a different query.
+    """
+    if not last_evaluated_key:
+        return None
+    payload = json.dumps(last_evaluated_key, separators=(",", ":")).encode()
+    token = _sign(payload, scope) + payload
+    return base64.urlsafe_b64encode(token).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], scope: str = "") -> Optional[dict]:
+    if not cursor:
+        return None
+    try:
+        token = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        signature, payload = token[:16], token[16:]
+        if not hmac.compare_digest(signature, _sign(payload, scope)):
+            raise ValueError("Bad signature")
+        key = json.loads(payload)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=INVALID_CURSOR)
+    if not _is_key(key):
+        raise HTTPException(status_code=400, detail=INVALID_CURSOR)
+    return key
+
+
+def read_page(results: Iterable, cursor: Optional[str]) -> List:
+    """
+    Read one page of a scan or query started from `cursor`. A start key
+    DynamoDB rejects is the client's fault, so it is reported as a 400.
+    """
+    try:
+        return list(results)
+    except (QueryError, ScanError) as e:
+        if cursor and e.cause_response_code == "ValidationException":
+            raise HTTPException(status_code=400, detail=INVALID_CURSOR)
+        raise
@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional, Set, Tuple
+
+from pynamodb.exceptions import PutError
+
+from models.pricehistory import PriceHistoryModel, rollup_sk
+
+ROLLUP_WRITE_ATTEMPTS = 5
+
+
+def daily_rows_by_store(ean: str, month: str) -> Dict[str, List[PriceHistoryModel]]:
+    # Rollup keys start with "M#", so the month's range only has daily rows
+    rows: Dict[str, List[PriceHistoryModel]] = {}
+    for phm in PriceHistoryModel.query(
+        ean,
+        PriceHistoryModel.sk.between(month, "{}~".format(month)),
+        consistent_read=True,
+    ):
+        rows.setdefault(phm.store, []).append(phm)
+    return rows
+
+
+def build_rollup(
+    ean: str,
+    month: str,
+    store: str,
+    rows: List[PriceHistoryModel],
+    version: Optional[int],
+) -> PriceHistoryModel:
+    latest = rows[-1]
+    prices = [phm.price for phm in rows]
+    return PriceHistoryModel(
+        ean=ean,
+        sk=rollup_sk(month, store),
+        store=store,
+        price=latest.price,
+        created_at=latest.created_at,
+        price_min=min(prices),
+        price_max=max(prices),
+        price_sum=sum(prices),
+        price_count=len(prices),
+        version=(version or 0) + 1,
+    )
+
+
+def rebuild_rollups(ean: str, month: str, stores: Set[str]) -> Set[str]:
+    """
+    Rebuild the rollups of `stores` from the month's daily rows. Returns the
+    stores whose rollup another sync rewrote in the meantime.
+    """
+    sks = {store: rollup_sk(month, store) for store in stores}
+    versions = {
+        rollup.store: rollup.version
+        for rollup in PriceHistoryModel.batch_get(
+            [(ean, sk) for sk in sks.values()], consistent_read=True
+        )
+    }
+    rows = daily_rows_by_store(ean, month)
+
+    conflicts = set()
+    for store in stores:
+        if store not in versions:
+            condition = PriceHistoryModel.sk.does_not_exist()
+        elif versions[store] is None:
+            condition = PriceHistoryModel.version.does_not_exist()
+        else:
+            condition = PriceHistoryModel.version == versions[store]
+        rollup = build_rollup(ean, month, store, rows[store], versions.get(store))
+        try:
+            rollup.save(condition=condition)
+        except PutError as e:
+            if e.cause_response_code != "ConditionalCheckFailedException":
+                raise
+            conflicts.add(store)
+    return conflicts
+
+
+def update_monthly_rollups(price_histories: List[PriceHistoryModel]):
+    """
+    Rebuild the monthly rollup items of freshly written daily rows so that
+    long-range charts can read one item per store and month.
+
+    Rollups are rebuilt from the month's daily rows rather than added to:
+    a second price change on the same day overwrites that day's row, and
+    the rollup has to agree with what interval=day reports. Each write is
+    conditioned on the version it was rebuilt from, so of two overlapping
+    syncs the one that loses rebuilds again instead of overwriting.
+    """
+    months: Dict[Tuple[str, str], Set[str]] = {}
+    for phm in price_histories:
+        months.setdefault((phm.ean, phm.sk[:7]), set()).add(phm.store)
+
+    for (ean, month), stores in months.items():
+        for _ in range(ROLLUP_WRITE_ATTEMPTS):
+            stores = rebuild_rollups(ean, month, stores)
+            if not stores:
+                break
+        else:
+            print(
+                "Rollups of {} {} kept changing: {}".format(ean, month, sorted(stores))
+            )
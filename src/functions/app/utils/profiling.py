@@ -0,0 +1,232 @@
+import os
+import sys
+import threading
+import uuid
+from collections import Counter
+from time import perf_counter, strftime
+from typing import Dict, List, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+
+from utils.auth import auth
+from utils.clients import get_client
+from utils.constants import profile_bucket_name, profile_interval_ms, profile_path
+
+PROFILE_HEADER = b"x-profile"
+
+TOP_N = 25
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Innermost frames of a thread that is parked waiting for work
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+}
+
+Frame = Tuple[str, str, str]
+
+
+class Sampler:
+    """
+    Samples the stacks of every other thread every `interval` seconds.
+
+    Wall-clock sampling, so time spent waiting on DynamoDB shows up as well
+    as CPU time. Idle threads (event loop, parked pool workers) are skipped
+    unless they are waiting inside application code.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True
+        )
+
+    def start(self) -> None:
+        self.started_at = perf_counter()
+        self._thread.start()
+
+    def stop(self) -> float:
+        self._stop.set()
+        self._thread.join()
+        return perf_counter() - self.started_at
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = _stack(frame)
+                if not _is_idle(stack):
+                    self.stacks[stack] += 1
+
+
+def _stack(frame) -> Tuple[Frame, ...]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            (code.co_filename, code.co_name, os.path.basename(code.co_filename))
+        )
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _is_idle(stack: Tuple[Frame, ...]) -> bool:
+    if not stack or (stack[-1][2], stack[-1][1]) not in IDLE_FRAMES:
+        return False
+    return not any(filename.startswith(APP_ROOT) for filename, _, _ in stack)
+
+
+def _label(frame: Frame) -> str:
+    filename, name, basename = frame
+    if filename.startswith(APP_ROOT):
+        basename = os.path.relpath(filename, APP_ROOT)
+    elif "-packages" + os.sep in filename:
+        # "pynamodb/models.py" rather than an ambiguous "models.py"
+        basename = filename.rsplit("-packages" + os.sep, 1)[1]
+    return "{}:{}".format(basename, name)
+
+
+def collapsed_stacks(stacks: Counter) -> str:
+    """Brendan Gregg's collapsed format, ready for flamegraph.pl or speedscope."""
+    lines = Counter()
+    for stack, count in stacks.items():
+        lines[";".join(_label(frame) for frame in stack)] += count
+    return "".join(
+        "{} {}\n".format(line, count) for line, count in sorted(lines.items())
+    )
+
+
+def summary(
+    stacks: Counter, samples: int, duration: float, method: str, path: str
+) -> str:
+    own: Counter = Counter()
+    total: Counter = Counter()
+    for stack, count in stacks.items():
+        own[_label(stack[-1])] += count
+        for label in {_label(frame) for frame in stack}:
+            total[label] += count
+
+    sampled = sum(stacks.values()) or 1
+    lines = [
+        "{} {}".format(method, path),
+        "{:.1f} ms, {} samples, {} thread stacks".format(
+            duration * 1000, samples, sampled
+        ),
+        "",
+        "{:>7} {:>7}  {}".format("own%", "total%", "function"),
+    ]
+    for label, count in total.most_common(TOP_N):
+        lines.append(
+            "{:>7.1f} {:>7.1f}  {}".format(
+                own[label] * 100 / sampled, count * 100 / sampled, label
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def write_profile(name: str, files: Dict[str, str]) -> Dict[str, str]:
+    """Store the profile files and return where each one ended up."""
+    locations = {}
+    if profile_bucket_name:
+        s3_client = get_client("s3")
+        for suffix, body in files.items():
+            key = "profiles/{}.{}".format(name, suffix)
+            s3_client.put_object(
+                Bucket=profile_bucket_name, Key=key, Body=body.encode()
+            )
+            locations[suffix] = "s3://{}/{}".format(profile_bucket_name, key)
+    else:
+        os.makedirs(profile_path, exist_ok=True)
+        for suffix, body in files.items():
+            path = os.path.join(profile_path, "{}.{}".format(name, suffix))
+            with open(path, "w") as f:
+                f.write(body)
+            locations[suffix] = path
+    return locations
+
+
+def _bearer_token(headers: List[Tuple[bytes, bytes]]) -> Optional[str]:
+    for key, value in headers:
+        if key == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return token
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    Runs a request under the sampler when it carries an X-Profile header
+    and an Admin token. The profile location is returned in the
+    X-Profile-Location (collapsed stacks) and X-Profile-Summary headers.
+
+    Requests without the header only pay for the header lookup.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not any(
+            k == PROFILE_HEADER for k, _ in scope["headers"]
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        token = _bearer_token(scope["headers"])
+        try:
+            if token is None:
+                raise HTTPException(status_code=401, detail="Not authenticated")
+            await anyio.to_thread.run_sync(auth.require_scope, token, ["Admin"])
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code)
+            await response(scope, receive, send)
+            return
+
+        name = "{}-{}".format(strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex[:8])
+        sampler = Sampler(profile_interval_ms / 1000)
+        stopped = False
+
+        async def send_with_profile(message) -> None:
+            nonlocal stopped
+            if message["type"] == "http.response.start" and not stopped:
+                stopped = True
+                duration = sampler.stop()
+                files = {
+                    "collapsed": collapsed_stacks(sampler.stacks),
+                    "txt": summary(
+                        sampler.stacks,
+                        sampler.samples,
+                        duration,
+                        scope["method"],
+                        scope["path"],
+                    ),
+                }
+                locations = await anyio.to_thread.run_sync(write_profile, name, files)
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Profile-Location", locations["collapsed"])
+                headers.append("X-Profile-Summary", locations["txt"])
+            await send(message)
+
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            if not stopped:
+                sampler.stop()
+
+
+def install(app) -> None:
+    app.add_middleware(ProfilingMiddleware)
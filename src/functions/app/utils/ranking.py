@@ -0,0 +1,39 @@
+from models.products import ProductModel
+from utils.constants import ranking_prior_mean, ranking_prior_weight
+
+# Every ranked product shares this hash key in the score-index
+RANKING_PARTITION = "ALL"
+
+STAR_VALUES = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5}
+
+
+def bayesian_score(stars) -> float:
+    """
+    Bayesian average of the star counts, pulled towards ranking_prior_mean
+    so that a single five-star rating does not top the list.
+    """
+    count = 0
+    total = 0
+    if stars is not None:
+        for name, value in STAR_VALUES.items():
+            amount = getattr(stars, name, None) or 0
+            count += amount
+            total += amount * value
+
+    score = (ranking_prior_weight * ranking_prior_mean + total) / (
+        ranking_prior_weight + count
+    )
+    return round(score, 6)
+
+
+def apply_ranking(product_model: ProductModel) -> ProductModel:
+    product_model.score = bayesian_score(product_model.stars)
+    product_model.rank_partition = RANKING_PARTITION
+    return product_model
+
+
+def ranking_actions(stars) -> list:
+    return [
+        ProductModel.score.set(bayesian_score(stars)),
+        ProductModel.rank_partition.set(RANKING_PARTITION),
+    ]
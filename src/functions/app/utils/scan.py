@@ -0,0 +1,67 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Iterator, Optional, Type, TypeVar
+
+from pynamodb.models import Model
+
+from utils.constants import scan_segments
+
+_M = TypeVar("_M", bound=Model)
+
+_DONE = object()
+
+
+def parallel_scan(
+    model: Type[_M], total_segments: Optional[int] = None, **scan_kwargs
+) -> Iterator[_M]:
+    """
+    Scan the whole table with DynamoDB parallel scan, one thread per segment.
+
+    Items are yielded as soon as any segment returns them. The hand-off queue
+    is bounded so a slow consumer does not make the scan buffer the table.
+    """
+    total_segments = total_segments or scan_segments
+    items: "queue.Queue" = queue.Queue(maxsize=1000)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan_segment(segment: int):
+        try:
+            for item in model.scan(
+                segment=segment, total_segments=total_segments, **scan_kwargs
+            ):
+                if not put(item):
+                    return
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        for segment in range(total_segments):
+            # Each thread gets its own copy of the caller's context, so
+            # per-request state such as request metrics follows the scan
+            executor.submit(copy_context().run, scan_segment, segment)
+
+        try:
+            remaining = total_segments
+            while remaining > 0:
+                item = items.get()
+                if item is _DONE:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
@@ -0,0 +1,327 @@
+import bisect
+import heapq
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import unicodedata
+from array import array
+from collections import defaultdict
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models.products import ProductModel
+
+LANGUAGES = ("fi", "sv", "en")
+
+MAGIC = b"JRSIDX1\n"
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+_FOLD = str.maketrans({"å": "a", "ä": "a", "ö": "o", "é": "e", "ü": "u"})
+
+STOPWORDS = {
+    "fi": {"ja", "tai", "on", "ei", "se", "ne", "kuin", "myös", "sekä", "joka", "ole"},
+    "sv": {"och", "eller", "är", "en", "ett", "som", "med", "av", "på", "för", "till"},
+    "en": {"and", "or", "the", "a", "an", "of", "with", "in", "for", "to", "is"},
+}
+
+# Light suffix stripping, longest suffix first. Good enough to line up the
+# common inflected forms on product pages ("oluessa", "ölen", "flavours").
+SUFFIXES = {
+    "fi": (
+        "issa",
+        "issä",
+        "ista",
+        "istä",
+        "illa",
+        "illä",
+        "ilta",
+        "iltä",
+        "ssa",
+        "ssä",
+        "sta",
+        "stä",
+        "lla",
+        "llä",
+        "lta",
+        "ltä",
+        "lle",
+        "ksi",
+        "ine",
+        "jen",
+        "ien",
+        "en",
+        "an",
+        "än",
+        "ja",
+        "jä",
+        "t",
+        "n",
+    ),
+    "sv": (
+        "ernas",
+        "arnas",
+        "ornas",
+        "erna",
+        "arna",
+        "orna",
+        "ande",
+        "ende",
+        "heten",
+        "het",
+        "ens",
+        "ets",
+        "ar",
+        "er",
+        "or",
+        "en",
+        "et",
+        "na",
+        "s",
+    ),
+    "en": ("ings", "ing", "ies", "es", "ed", "ly", "s"),
+}
+
+MIN_STEM = 3
+
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.5
+
+MAX_PREFIX_TERMS = 50
+
+# Language-neutral fields are indexed into every language
+COMMON_FIELDS = ("name", "supplier", "category")
+LANGUAGE_FIELDS = ("name_{}", "description_{}", "ingredients_{}")
+DOC_FIELDS = (
+    "ean",
+    "name",
+    "name_fi",
+    "name_sv",
+    "name_en",
+    "photo",
+    "price",
+    "category",
+    "score",
+)
+
+
+def fold(word: str) -> str:
+    return word.translate(_FOLD)
+
+
+def stem(word: str, lang: str) -> str:
+    for suffix in SUFFIXES.get(lang, ()):
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM:
+            return word[: -len(suffix)]
+    return word
+
+
+def words(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return _WORD.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def tokenize(text: Optional[str], lang: str) -> List[str]:
+    stopwords = STOPWORDS.get(lang, set())
+    return [fold(stem(w, lang)) for w in words(text) if w not in stopwords]
+
+
+def within_distance(a: str, b: str, max_distance: int) -> bool:
+    """Levenshtein distance check that gives up as soon as the bound is exceeded."""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+def build_index(products: Iterable[ProductModel], path: str) -> int:
+    """
+    Write a search index for the given products to `path`.
+
+    Layout: MAGIC, a little-endian uint32 header length, the JSON header
+    (documents plus one sorted vocabulary per language with posting offsets)
+    and finally every posting list as a flat uint32 array of document ids.
+    """
+    docs = []
+    postings: Dict[str, Dict[str, set]] = {lang: defaultdict(set) for lang in LANGUAGES}
+
+    for doc_id, pm in enumerate(products):
+        docs.append({field: getattr(pm, field) for field in DOC_FIELDS})
+        common = [getattr(pm, field) for field in COMMON_FIELDS]
+        for lang in LANGUAGES:
+            texts = common + [
+                getattr(pm, field.format(lang)) for field in LANGUAGE_FIELDS
+            ]
+            for text in texts:
+                for token in tokenize(text, lang):
+                    postings[lang][token].add(doc_id)
+            postings[lang][pm.ean].add(doc_id)
+
+    data = array("I")
+    vocabularies = {}
+    for lang in LANGUAGES:
+        terms = sorted(postings[lang])
+        offsets = []
+        for term in terms:
+            offsets.append(len(data))
+            data.extend(sorted(postings[lang][term]))
+        offsets.append(len(data))
+        vocabularies[lang] = {"terms": terms, "offsets": offsets}
+
+    header = json.dumps({"docs": docs, "vocabularies": vocabularies}).encode()
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 4)
+
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        data.tofile(f)
+    os.replace(tmp_path, path)
+    return len(docs)
+
+
+class SearchIndex:
+    """
+    Read side of the index. Vocabularies and documents are parsed into
+    memory, posting lists stay in the memory-mapped file.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            raise ValueError("Not a search index: {}".format(path))
+        (header_length,) = struct.unpack_from("<I", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 4
+        header = json.loads(self._mmap[start : start + header_length])
+        self.docs: List[dict] = header["docs"]
+        self._vocabularies = header["vocabularies"]
+        self._postings = memoryview(self._mmap)[start + header_length :].cast("I")
+
+    def _posting(self, lang: str, position: int):
+        offsets = self._vocabularies[lang]["offsets"]
+        return self._postings[offsets[position] : offsets[position + 1]]
+
+    def _expand(self, lang: str, word: str) -> List[Tuple[int, float]]:
+        """Vocabulary positions (and match weights) a single query word can hit."""
+        terms = self._vocabularies[lang]["terms"]
+        token = fold(stem(word, lang))
+        prefix = fold(word)
+        matches: Dict[int, float] = {}
+
+        position = bisect.bisect_left(terms, token)
+        if position < len(terms) and terms[position] == token:
+            matches[position] = EXACT_WEIGHT
+
+        for p in (token, prefix) if len(prefix) >= 2 else ():
+            position = bisect.bisect_left(terms, p)
+            end = min(len(terms), position + MAX_PREFIX_TERMS)
+            while position < end and terms[position].startswith(p):
+                matches.setdefault(position, PREFIX_WEIGHT)
+                position += 1
+
+        if not matches and len(token) >= 4:
+            max_distance = 1 if len(token) < 8 else 2
+            # Typos in the first letter are not corrected, which keeps the
+            # candidate set to one slice of the sorted vocabulary
+            position = bisect.bisect_left(terms, token[0])
+            end = bisect.bisect_left(terms, chr(ord(token[0]) + 1))
+            for candidate in range(position, end):
+                if within_distance(token, terms[candidate], max_distance):
+                    matches[candidate] = FUZZY_WEIGHT
+
+        return list(matches.items())
+
+    def search(self, query: str, lang: str, limit: int) -> List[dict]:
+        stopwords = STOPWORDS.get(lang, set())
+        query_words = [w for w in words(query) if w not in stopwords]
+        if not query_words:
+            return []
+
+        per_word: List[Dict[int, float]] = []
+        candidates: Optional[set] = None
+        for word in query_words:
+            best: Dict[int, float] = {}
+            # Apply the weakest matches first so stronger ones overwrite them
+            for position, weight in sorted(
+                self._expand(lang, word), key=lambda m: m[1]
+            ):
+                best.update(dict.fromkeys(self._posting(lang, position), weight))
+            per_word.append(best)
+            # Every query word has to match something in the document
+            candidates = (
+                set(best) if candidates is None else candidates.intersection(best)
+            )
+            if not candidates:
+                return []
+
+        scores = {d: sum(best[d] for best in per_word) for d in candidates}
+        matched = heapq.nlargest(
+            limit, candidates, key=lambda d: (scores[d], self.docs[d]["score"] or 0)
+        )
+
+        return [
+            dict(self.docs[d], relevance=round(scores[d] / len(query_words), 3))
+            for d in matched
+        ]
+
+    def close(self) -> None:
+        self._postings.release()
+        self._mmap.close()
+
+
+class SearchIndexLoader:
+    """
+    Lazily fetch the index from S3 into /tmp on first use and re-check the
+    S3 object's ETag at most once every `ttl` seconds.
+    """
+
+    def __init__(
+        self, s3_client_factory, bucket: str, key: str, path: str, ttl: float
+    ) -> None:
+        self._s3_client_factory = s3_client_factory
+        self.bucket = bucket
+        self.key = key
+        self.path = path
+        self.ttl = ttl
+        self._index: Optional[SearchIndex] = None
+        self._etag: Optional[str] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> SearchIndex:
+        if self._index is not None and monotonic() - self._checked_at < self.ttl:
+            return self._index
+
+        with self._lock:
+            if self._index is None or monotonic() - self._checked_at >= self.ttl:
+                self._refresh()
+            return self._index
+
+    def _refresh(self) -> None:
+        s3_client = self._s3_client_factory()
+        etag = s3_client.head_object(Bucket=self.bucket, Key=self.key)["ETag"]
+        if etag != self._etag or self._index is None:
+            tmp_path = "{}.download".format(self.path)
+            s3_client.download_file(self.bucket, self.key, tmp_path)
+            os.replace(tmp_path, self.path)
+            # The old mapping is left to the garbage collector, a request may
+            # still be reading from it
+            self._index = SearchIndex(self.path)
+            self._etag = etag
+        self._checked_at = monotonic()
@@ -0,0 +1,70 @@
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional
+
+from pynamodb.attributes import Attribute, ListAttribute, MapAttribute
+
+from models.pricehistory import PriceHistoryModel
+from models.products import ProductModel
+from models.ratings import RatingModel
+from models.users import UserModel
+
+Encoder = Callable[[Any], Dict[str, Any]]
+
+
+def _value_encoder(attribute: Attribute) -> Optional[Callable[[Any], Any]]:
+    if isinstance(attribute, MapAttribute) and not attribute.is_raw():
+        return compile_encoder(type(attribute))
+
+    if isinstance(attribute, ListAttribute) and attribute.element_type is not None:
+        if issubclass(attribute.element_type, MapAttribute):
+            encode_element = compile_encoder(attribute.element_type)
+            return lambda values: [encode_element(v) for v in values if v is not None]
+
+    # Scalars are already plain python values in attribute_values
+    return None
+
+
+def compile_encoder(
+    container_cls, exclude: Iterable[str] = (), only: Optional[Iterable[str]] = None
+) -> Encoder:
+    """
+    Build a function that turns a pynamodb model (or typed MapAttribute)
+    instance into a plain dict by reading its attribute_values directly.
+    With `only`, the dict has just those attributes.
+
+    The attribute walk happens once here, not on every call.
+    """
+    fields = [
+        (name, _value_encoder(attribute))
+        for name, attribute in container_cls.get_attributes().items()
+        if name not in exclude and (only is None or name in only)
+    ]
+
+    def encode(obj) -> Dict[str, Any]:
+        values = obj.attribute_values
+        rval = {}
+        for name, encode_value in fields:
+            value = values.get(name)
+            if encode_value is not None and value is not None:
+                value = encode_value(value)
+            rval[name] = value
+        return rval
+
+    return encode
+
+
+PRODUCT_EXCLUDE = ("rank_partition", "version", "stars_seq")
+
+encode_product = compile_encoder(ProductModel, exclude=PRODUCT_EXCLUDE)
+encode_rating = compile_encoder(RatingModel, exclude=("userId",))
+encode_user = compile_encoder(UserModel)
+encode_price_history = compile_encoder(
+    PriceHistoryModel,
+    exclude=("sk", "price_min", "price_max", "price_sum", "price_count", "version"),
+)
+
+
+@lru_cache(maxsize=64)
+def product_encoder(fields: FrozenSet[str]) -> Encoder:
+    """encode_product trimmed to `fields`, compiled once per field set."""
+    return compile_encoder(ProductModel, exclude=PRODUCT_EXCLUDE, only=fields)
@@ -1,13 +1,75 @@
+import hashlib
 import io
+import json
 import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 
 import boto3
 import requests
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from PIL import Image
 from pydantic import BaseModel
 
 stage = os.environ.get('STAGE', None)
 public_content_bucket = os.environ.get('public_content_bucket_name', None)
+image_workers = int(os.environ.get('image_workers', 8))
+max_image_pixels = int(os.environ.get('max_image_pixels', 50_000_000))
+image_cache_prefix = os.environ.get('image_cache_prefix', 'image-cache/')
+image_widths = sorted({int(w) for w in os.environ.get('image_widths', '128,256,512,1080').split(',')})
+image_formats = [f.strip() for f in os.environ.get('image_formats', 'webp,avif').split(',')]
+encode_workers = int(os.environ.get('encode_workers', 4))
+public_content_url = os.environ.get('public_content_url', '').rstrip('/')
+
+try:
+    # Registers AVIF with Pillow, the variant matrix drops AVIF without it
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+Image.init()
+variant_formats = [f for f in image_formats if f.upper() in Image.SAVE]
+if variant_formats != image_formats:
+    print(f"Image formats not supported by this Pillow build: {set(image_formats) - set(variant_formats)}")
+
+MAIN_HEIGHT = 1080
+MAX_THUMBNAIL_SIZE = (500, 500)
+
+SAVE_OPTIONS = {
+    "webp": {"quality": 85},
+    "avif": {"quality": 60},
+}
+
+# Shared by every record being processed, so the total number of
+# concurrent encodes stays bounded however many records are in flight
+encode_executor = ThreadPoolExecutor(max_workers=encode_workers)
+
+# Pillow only warns at this size and errors out at twice it, the handler
+# skips anything above it
+Image.MAX_IMAGE_PIXELS = max_image_pixels
+
+s3_config = Config(
+    max_pool_connections=int(os.environ.get('aws_max_pool_connections', 20)),
+    connect_timeout=int(os.environ.get('aws_connect_timeout', 5)),
+    read_timeout=int(os.environ.get('aws_read_timeout', 30)),
+    retries={'mode': 'adaptive', 'max_attempts': int(os.environ.get('aws_max_retries', 5))},
+)
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    # Built on first use and kept for the life of the container so uploads
+    # reuse pooled connections instead of a new TLS handshake per image
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            _s3_client = boto3.session.Session().client('s3', config=s3_config)
+    return _s3_client
 
 
 class ImageRequest(BaseModel):
@@ -15,56 +77,380 @@ class ImageRequest(BaseModel):
     ean: str
 
 
+def fit(size: Tuple[int, int], width: Optional[int] = None, height: Optional[int] = None) -> Tuple[int, int]:
+    """Largest size within `width` x `height` keeping the aspect ratio, never upscaled."""
+    scale = min(
+        1.0,
+        width / size[0] if width else 1.0,
+        height / size[1] if height else 1.0,
+    )
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def decode(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """
+    Decode `image` once, at no less than `size`.
+
+    For JPEGs, draft() lets the decoder itself downscale by 1/2, 1/4 or 1/8
+    to the smallest size still at least the target, so a large supplier
+    photo is never fully decoded. Other formats ignore the draft request.
+    """
+    image.draft("RGB", size)
+    if image.mode not in ("RGB", "RGBA"):
+        has_alpha = image.mode in ("LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    image.load()
+    return image
+
+
+def scale(image: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    if image.size == size:
+        return image
+    return image.resize(size, Image.LANCZOS)
+
+
+class DedupStats:
+    """Thread-safe counters of how each image was handled, logged per batch."""
+
+    def __init__(self) -> None:
+        self._counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name: str) -> None:
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._counts)
+            self._counts.clear()
+        return counts
+
+
+stats = DedupStats()
+
+# key -> [lock, number of threads holding or waiting for it]
+_key_locks: Dict[str, list] = {}
+_key_locks_lock = threading.Lock()
+
+
+@contextmanager
+def key_lock(key: str):
+    # Variants sharing a main product usually arrive in the same batch with
+    # the same photo; serializing them lets all but the first hit the cache.
+    # A lock is dropped with its last user, so a warm container does not
+    # keep one for every URL it has ever seen
+    with _key_locks_lock:
+        entry = _key_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _key_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _key_locks[key]
+
+
+def variant_widths(source_width: int) -> List[int]:
+    """
+    The configured widths narrower than the source, plus the source width
+    itself when any configured width would have upscaled it. Images are
+    never upscaled, so those widths would only repeat the native variant.
+    """
+    widths = {w for w in image_widths if w < source_width}
+    if any(w >= source_width for w in image_widths):
+        widths.add(source_width)
+    return sorted(widths)
+
+
+def variant_matrix() -> dict:
+    return {"widths": image_widths, "formats": variant_formats}
+
+
+def output_key(ean: str, name: str) -> str:
+    # "main" and "thumbnail" are the original keys, still used by clients
+    # that do not read the manifest
+    if name == "main":
+        return "products/{}.webp".format(ean)
+    if name == "thumbnail":
+        return "products/{}_thumbnail.webp".format(ean)
+    return "products/{}/{}".format(ean, name)
+
+
+def manifest_key(ean: str) -> str:
+    return "products/{}/manifest.json".format(ean)
+
+
+def url_record_key(url: str) -> str:
+    return "{}urls/{}.json".format(image_cache_prefix, hashlib.sha256(url.encode()).hexdigest())
+
+
+def content_record_key(content_hash: str) -> str:
+    return "{}content/{}.json".format(image_cache_prefix, content_hash)
+
+
+def load_record(key: str) -> Optional[dict]:
+    try:
+        response = get_s3_client().get_object(Bucket=public_content_bucket, Key=key)
+    except ClientError:
+        # Without s3:ListBucket a missing key is a 403, not a 404
+        return None
+    return json.loads(response["Body"].read())
+
+
+def save_record(key: str, record: dict) -> None:
+    get_s3_client().put_object(
+        Bucket=public_content_bucket,
+        Key=key,
+        Body=json.dumps(record).encode(),
+        ContentType="application/json",
+    )
+
+
+def save_manifest(ean: str, variants: List[dict]) -> None:
+    save_record(
+        manifest_key(ean),
+        {
+            "ean": ean,
+            "variants": [
+                {
+                    "url": "{}/{}".format(public_content_url, output_key(ean, v["name"])),
+                    "width": v["width"],
+                    "height": v["height"],
+                    "format": v["format"],
+                }
+                for v in variants
+            ],
+        },
+    )
+
+
+def copy_outputs(content_hash: str, ean: str) -> bool:
+    """
+    Copy the images already encoded from this content to `ean`'s keys.
+    Returns False when there is nothing usable to copy, including records
+    written before the current variant matrix.
+    """
+    record = load_record(content_record_key(content_hash))
+    if record is None or record.get("matrix") != variant_matrix():
+        return False
+
+    try:
+        for name, source in record["keys"].items():
+            target = output_key(ean, name)
+            if source != target:
+                get_s3_client().copy_object(
+                    Bucket=public_content_bucket,
+                    CopySource={"Bucket": public_content_bucket, "Key": source},
+                    Key=target,
+                )
+    except ClientError as e:
+        print(f"Error copying existing images for {ean}: {e}")
+        return False
+
+    save_manifest(ean, record["variants"])
+    return True
+
+
+def conditional_headers(url_record: Optional[dict]) -> Dict[str, str]:
+    headers = {}
+    if url_record is not None:
+        if url_record.get("etag"):
+            headers["If-None-Match"] = url_record["etag"]
+        if url_record.get("last_modified"):
+            headers["If-Modified-Since"] = url_record["last_modified"]
+    return headers
+
+
+def renditions(image: Image.Image) -> List[Tuple[str, Image.Image, str]]:
+    """
+    Every (name, image, format) to encode, derived largest to smallest from
+    one decoded image.
+    """
+    widths = variant_widths(image.width)
+    main_size = fit(image.size, height=MAIN_HEIGHT)
+    base = decode(image, fit(image.size, width=max([main_size[0]] + widths)))
+
+    main = scale(base, fit(base.size, height=MAIN_HEIGHT))
+    rval = [
+        ("main", main, "webp"),
+        ("thumbnail", scale(main, fit(main.size, *MAX_THUMBNAIL_SIZE)), "webp"),
+    ]
+
+    previous = base
+    for width in reversed(widths):
+        previous = scale(previous, fit(previous.size, width=width))
+        rval.extend(("{}.{}".format(previous.width, f), previous, f) for f in variant_formats)
+
+    # Image.save keeps its options on the image object, so encodes running
+    # in parallel must not share one
+    seen = set()
+    for i, (name, rendition, fmt) in enumerate(rval):
+        if id(rendition) in seen:
+            rval[i] = (name, rendition.copy(), fmt)
+        seen.add(id(rendition))
+    return rval
+
+
+def encode_outputs(body: bytes, ean: str, image_url: str) -> bool:
+    try:
+        image = Image.open(io.BytesIO(body))
+        if image.width * image.height > max_image_pixels:
+            raise Image.DecompressionBombError(image.size)
+
+        jobs = [
+            (name, rendition, fmt, encode_executor.submit(save_image, rendition, output_key(ean, name), fmt))
+            for name, rendition, fmt in renditions(image)
+        ]
+        for _, _, _, job in jobs:
+            job.result()
+    except Image.DecompressionBombError as e:
+        # Retrying would not help, so this is not reported as a failure
+        print(f"Skipping oversized image {e}: {image_url}")
+        stats.increment("skipped")
+        return True
+    except Exception as e:
+        print(f"Error uploading to S3: {e}")
+        return False
+
+    # Smallest first, clients take the first variant that fits
+    variants = sorted(
+        (
+            {"name": name, "width": rendition.width, "height": rendition.height, "format": fmt}
+            for name, rendition, fmt, _ in jobs
+            if name not in ("main", "thumbnail")
+        ),
+        key=lambda v: (v["width"], v["format"]),
+    )
+    save_manifest(ean, variants)
+    save_record(
+        content_record_key(hashlib.sha256(body).hexdigest()),
+        {
+            "keys": {name: output_key(ean, name) for name, _, _, _ in jobs},
+            "variants": variants,
+            "matrix": variant_matrix(),
+        },
+    )
+    stats.increment("encoded")
+    return True
+
+
 def image_download(image_request: ImageRequest) -> bool:
-    r = requests.get(url=image_request.image_url, stream=True, timeout=30)
-    if r.status_code == 200:
-        obj_name = "products/{}.webp".format(image_request.ean)
-        thumbnail_name = "products/{}_thumbnail.webp".format(image_request.ean)
-        try:
-            image = Image.open(r.raw)
-            thumbnail = image.copy()
-
-            fixed_height = 1080
-            if fixed_height > image.height:
-                fixed_height = image.height
-            height_percent = (fixed_height / float(image.size[1]))
-            width_size = int(float(image.size[0]) * float(height_percent))
-            image = image.resize((width_size, fixed_height), Image.LANCZOS)
-
-            save_image(image, obj_name, False)
-
-            MAX_THUMBNAIL_SIZE = (500, 500)
-            thumbnail.thumbnail(MAX_THUMBNAIL_SIZE)
-
-            save_image(thumbnail, thumbnail_name, True)
-        except Exception as e:
-            print(f"Error uploading to S3: {e}")
-            return False
-    else:
+    with key_lock(url_record_key(image_request.image_url)):
+        return _image_download(image_request)
+
+
+def _image_download(image_request: ImageRequest) -> bool:
+    """
+    Download and encode `image_request`, skipping whatever work earlier
+    invocations already did.
+
+    The source URL's ETag/Last-Modified and content hash are remembered in
+    S3 under image_cache_prefix. An unchanged URL (304) or content that was
+    encoded before (same sha256, e.g. another EAN with the same photo) is
+    served by copying the existing S3 objects instead of decoding again.
+    """
+    image_url = image_request.image_url
+    url_key = url_record_key(image_url)
+    url_record = load_record(url_key)
+
+    try:
+        r = requests.get(url=image_url, headers=conditional_headers(url_record), timeout=30)
+        if r.status_code == 304:
+            if copy_outputs(url_record["content_sha256"], image_request.ean):
+                stats.increment("not_modified")
+                return True
+            # The remembered outputs are gone, fetch the image again
+            r = requests.get(url=image_url, timeout=30)
+    except requests.RequestException as e:
+        print(f"Error downloading image: {e}")
+        return False
+
+    if r.status_code != 200:
         print(f"Error downloading image: {r.status_code}")
-        print(f"Error removing bg from image: {image_request.image_url}")
+        print(f"Error removing bg from image: {image_url}")
         return False
 
+    body = r.content
+    content_hash = hashlib.sha256(body).hexdigest()
+    with key_lock(content_record_key(content_hash)):
+        if copy_outputs(content_hash, image_request.ean):
+            stats.increment("content_hit")
+        elif not encode_outputs(body, image_request.ean, image_url):
+            return False
+
+    save_record(
+        url_key,
+        {
+            "url": image_url,
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "content_sha256": content_hash,
+        },
+    )
+    return True
 
-def save_image(image: Image, obj_name: str, thumbnail: bool) -> bool:
+
+def save_image(image: Image.Image, obj_name: str, fmt: str) -> None:
     print(f"Uploading to S3: {obj_name}")
     in_mem_file = io.BytesIO()
 
-    image.save(in_mem_file, format="webp", optimize=True, quality=85)
+    image.save(in_mem_file, format=fmt, **SAVE_OPTIONS.get(fmt, {}))
     in_mem_file.seek(0)
 
-    s3 = boto3.client("s3")
-    s3.upload_fileobj(in_mem_file, public_content_bucket, obj_name)
+    get_s3_client().upload_fileobj(
+        in_mem_file,
+        public_content_bucket,
+        obj_name,
+        ExtraArgs={"ContentType": "image/{}".format(fmt)},
+    )
     print(f"Uploaded to S3: {obj_name}")
-    s3.close()
+
+
+def process_record(record) -> bool:
+    new_image = record["dynamodb"]["NewImage"]
+    photo_url = new_image.get("photo", {}).get("S")
+    ean = new_image["ean"]["S"]
+    if not photo_url:
+        # Nothing to download, retrying would not change that
+        return True
+
+    return image_download(ImageRequest(image_url=photo_url, ean=ean))
 
 
 def handler(event, context):
+    """
+    Process the batch concurrently and report failed records by sequence
+    number, so the stream only retries those instead of the whole batch.
+
+    Threads rather than processes: downloads and uploads are I/O bound and
+    Pillow releases the GIL while resampling, while multiprocessing pools
+    do not work in Lambda (no /dev/shm).
+    """
     print(event)
-    for record in event["Records"]:
-        if record["eventName"] != "INSERT":
-            continue
-        photo_url = record["dynamodb"]["NewImage"]["photo"]["S"]
-        ean = record["dynamodb"]["NewImage"]["ean"]["S"]
+    records = [r for r in event["Records"] if r["eventName"] == "INSERT"]
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=image_workers) as executor:
+        futures = [(r, executor.submit(process_record, r)) for r in records]
+        for record, future in futures:
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"Error processing record: {e}")
+                ok = False
+            if not ok:
+                failures.append({"itemIdentifier": record["dynamodb"]["SequenceNumber"]})
 
-        image_download(ImageRequest(image_url=photo_url, ean=ean))
\ No newline at end of file
+    counts = stats.snapshot()
+    reused = counts.get("not_modified", 0) + counts.get("content_hit", 0)
+    handled = reused + counts.get("encoded", 0)
+    print(f"Processed {len(records)} images, {len(failures)} failed")
+    print(
+        "Image dedup: {}, hit rate {:.0%}".format(
+            json.dumps(counts, sort_keys=True), reused / handled if handled else 0
+        )
+    )
+    return {"batchItemFailures": failures}
@@ -4,11 +4,12 @@ const functions: AWS['functions'] = {
   imageDownloadHandler: {
     image: 'image-download-handler',
     runtime: 'python3.8',
-    timeout: 30,
+    timeout: 120,
     events: [
       {
         stream: {
           type: 'dynamodb',
+          functionResponseType: 'ReportBatchItemFailures',
           arn: {
             'Fn::ImportValue': '${self:service}-${self:provider.stage}-ProductsTableStreamArn',
           },
@@ -1,7 +1,9 @@
 import heartbeat from './heartbeat'
 import imageDownloadHandler from './image-download-handler'
+import starAggregator from './star-aggregator'
 
 export default {
   ...heartbeat,
   ...imageDownloadHandler,
+  ...starAggregator,
 }
@@ -0,0 +1,187 @@
+import os
+from typing import Dict, List, Optional
+
+import boto3
+
+stage = os.environ.get("STAGE", None)
+products_table_name = os.environ.get("products_table_name", None)
+star_aggregation = os.environ.get("star_aggregation", "sync")
+ranking_prior_mean = float(os.environ.get("ranking_prior_mean", 3.0))
+ranking_prior_weight = float(os.environ.get("ranking_prior_weight", 10))
+
+STAR_NAMES = {1: "one", 2: "two", 3: "three", 4: "four", 5: "five"}
+RANKING_PARTITION = "ALL"
+STAR_WRITE_ATTEMPTS = 3
+
+dynamodb = boto3.client("dynamodb")
+
+
+def changes_by_ean(records) -> Dict[str, List[dict]]:
+    changes = {}
+    for record in records:
+        change = record["dynamodb"]
+        changes.setdefault(change["Keys"]["ean"]["S"], []).append(change)
+    return changes
+
+
+def star_delta(changes: List[dict], after: int) -> Optional[dict]:
+    """
+    Net star bucket changes of the rating stream records newer than
+    sequence number `after`, along with the newest sequence number among
+    them. None when the product already has every record folded in.
+
+    Comment-only edits net out to no star change but still count, the
+    product needs its version bumped.
+    """
+    delta = {"stars": {}, "sequence": None}
+    for change in changes:
+        sequence = int(change["SequenceNumber"])
+        if sequence <= after:
+            continue
+        delta["sequence"] = max(delta["sequence"] or 0, sequence)
+
+        old_image = change.get("OldImage") or {}
+        new_image = change.get("NewImage") or {}
+        if "rating" in old_image:
+            name = STAR_NAMES[int(old_image["rating"]["N"])]
+            delta["stars"][name] = delta["stars"].get(name, 0) - 1
+        if "rating" in new_image:
+            name = STAR_NAMES[int(new_image["rating"]["N"])]
+            delta["stars"][name] = delta["stars"].get(name, 0) + 1
+
+    if delta["sequence"] is None:
+        return None
+    return delta
+
+
+def parse_state(item: dict) -> dict:
+    counts = item.get("stars", {}).get("M", {})
+    return {
+        "stars": {
+            name: int(counts.get(name, {}).get("N", 0)) for name in STAR_NAMES.values()
+        },
+        "sequence": int(item.get("stars_seq", {}).get("N", 0)),
+        "version": item.get("version", {}).get("N"),
+    }
+
+
+STATE_PROJECTION = "ean, stars, stars_seq, version"
+
+
+def get_states(eans) -> Dict[str, dict]:
+    """Star counters, last folded sequence number and version per EAN."""
+    states = {}
+    eans = list(eans)
+    for i in range(0, len(eans), 100):
+        request = {
+            products_table_name: {
+                "Keys": [{"ean": {"S": ean}} for ean in eans[i : i + 100]],
+                "ProjectionExpression": STATE_PROJECTION,
+                "ConsistentRead": True,
+            }
+        }
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(products_table_name, []):
+                states[item["ean"]["S"]] = parse_state(item)
+            request = response.get("UnprocessedKeys")
+    return states
+
+
+def get_state(ean: str) -> Optional[dict]:
+    item = dynamodb.get_item(
+        TableName=products_table_name,
+        Key={"ean": {"S": ean}},
+        ProjectionExpression=STATE_PROJECTION,
+        ConsistentRead=True,
+    ).get("Item")
+    return parse_state(item) if item else None
+
+
+def bayesian_score(stars: dict) -> float:
+    count = sum(stars.values())
+    total = sum(value * stars[name] for value, name in STAR_NAMES.items())
+    score = (ranking_prior_weight * ranking_prior_mean + total) / (
+        ranking_prior_weight + count
+    )
+    return round(score, 6)
+
+
+def apply_delta(ean: str, delta: dict, state: dict) -> bool:
+    """
+    Write the counters of `state` plus `delta`. The write is conditioned on
+    the product version that was read, so it is only made against the
+    counters it was computed from. Returns False when the product changed
+    in between.
+    """
+    stars = {
+        name: count + delta["stars"].get(name, 0)
+        for name, count in state["stars"].items()
+    }
+
+    values = {
+        ":stars": {"M": {name: {"N": str(count)} for name, count in stars.items()}},
+        ":score": {"N": str(bayesian_score(stars))},
+        ":partition": {"S": RANKING_PARTITION},
+        ":seq": {"N": str(delta["sequence"])},
+        ":one": {"N": "1"},
+    }
+    if state["version"] is None:
+        version_condition = "attribute_not_exists(version)"
+    else:
+        version_condition = "version = :version"
+        values[":version"] = {"N": state["version"]}
+
+    try:
+        dynamodb.update_item(
+            TableName=products_table_name,
+            Key={"ean": {"S": ean}},
+            UpdateExpression="SET stars = :stars, score = :score, "
+            "rank_partition = :partition, stars_seq = :seq ADD version :one",
+            ConditionExpression="attribute_exists(ean) AND " + version_condition,
+            ExpressionAttributeValues=values,
+        )
+        return True
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def fold(ean: str, changes: List[dict], state: Optional[dict]) -> bool:
+    """
+    Fold the records `state` has not seen yet into the product. stars_seq
+    holds the newest record folded in, so records of a retried batch that
+    were already applied are skipped while the new ones still count.
+    Returns whether the product was written.
+    """
+    for _ in range(STAR_WRITE_ATTEMPTS):
+        if state is None:
+            print(f"Product not found: {ean}")
+            return False
+        delta = star_delta(changes, state["sequence"])
+        if delta is None:
+            print(f"Skipping {ean}: batch already applied")
+            return False
+        if apply_delta(ean, delta, state):
+            return True
+        state = get_state(ean)
+
+    # Failing the batch makes Lambda retry it, nothing is applied twice
+    raise RuntimeError(f"Product {ean} kept changing, giving up on this batch")
+
+
+def handler(event, context):
+    if star_aggregation != "stream":
+        # rate_product keeps the counters up to date itself
+        return
+
+    records = event["Records"]
+    changes = changes_by_ean(records)
+    states = get_states(changes.keys())
+
+    writes = 0
+    for ean, ean_changes in changes.items():
+        if fold(ean, ean_changes, states.get(ean)):
+            writes += 1
+
+    print(f"Applied {len(records)} rating changes with {writes} product writes")
+    return {"records": len(records), "writes": writes}
@@ -0,0 +1,23 @@
+import { AWS } from '@serverless/typescript'
+
+const functions: AWS['functions'] = {
+  starAggregator: {
+    image: 'star-aggregator',
+    runtime: 'python3.8',
+    timeout: 30,
+    events: [
+      {
+        stream: {
+          type: 'dynamodb',
+          arn: {
+            'Fn::ImportValue': '${self:service}-${self:provider.stage}-RatingsTableStreamArn',
+          },
+          batchSize: 500,
+          maximumBatchingWindowInSeconds: 5,
+        },
+      },
+    ],
+  },
+}
+
+export default functions
@@ -0,0 +1,711 @@
+"""
+End-to-end benchmark of every API route against local AWS stand-ins.
+
+Runs main.app in-process with moto standing in for DynamoDB, S3 and the
+Cognito user pool, seeds a synthetic catalog and reports per-route
+latency percentiles, throughput, DynamoDB calls and consumed capacity as
+JSON, so runs on two commits can be compared:
+
+    python tests/benchmark.py --output before.json
+    git checkout <other commit>
+    python tests/benchmark.py --baseline before.json --output after.json
+
+Catalog size is set on the command line, e.g. --products 50000
+--ratings 1000000 --price-rows 5000000. moto keeps everything in memory
+and seeds a few thousand items per second, so large runs take a while.
+
+Numbers describe the app and its request pattern rather than AWS: moto
+charges a flat capacity per request instead of per 4 KB read, has no
+network latency, and copies every table for a TransactWriteItems, so
+rating writes slow down with catalog size. Compare runs of this script
+with each other, not with production.
+"""
+
+import argparse
+import calendar
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from time import perf_counter, time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# moto ignores Segment, so every segment of a parallel scan would read the
+# whole table
+os.environ.setdefault("scan_segments", "1")
+os.environ.setdefault(
+    "search_index_path", os.path.join(tempfile.mkdtemp(), "products.idx")
+)
+
+import support  # noqa: E402
+
+import moto  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from models.pricehistory import PriceHistoryModel, rollup_sk  # noqa: E402
+from models.products import PriceDataModel, ProductModel, StarsModel  # noqa: E402
+from models.ratings import RatingModel  # noqa: E402
+from models.users import UserModel  # noqa: E402
+from utils import instrumentation  # noqa: E402
+from utils.cache import product_cache  # noqa: E402
+from utils.ranking import RANKING_PARTITION, STAR_VALUES, bayesian_score  # noqa: E402
+
+CATEGORIES = [
+    "olut",
+    "siideri",
+    "lonkero",
+    "viini",
+    "kuohuviini",
+    "gini",
+    "viski",
+    "alkoholiton",
+]
+STORES = ["k-citymarket", "prisma", "s-market", "lidl"]
+WORDS = [
+    "lager",
+    "ipa",
+    "stout",
+    "pils",
+    "porter",
+    "vehnä",
+    "sour",
+    "kuiva",
+    "greippi",
+    "karpalo",
+]
+STAR_NAMES = {value: name for name, value in STAR_VALUES.items()}
+FIRST_DAY = date(2023, 1, 1)
+PASSWORD = "Passw0rd!"
+
+
+def ean(i: int) -> str:
+    return "{:013d}".format(6410000000000 + i)
+
+
+def seed_ratings(products: int, ratings: int, seed: int) -> List[Dict[str, int]]:
+    """Write `ratings` ratings and return each product's star counters."""
+    rng = random.Random(seed)
+    stars = [dict.fromkeys(STAR_VALUES, 0) for _ in range(products)]
+    # The i-th rating of a product comes from user i, so (ean, user) is unique
+    users = max(1, math.ceil(ratings / products))
+
+    with UserModel.batch_write() as batch:
+        for u in range(users):
+            batch.save(
+                UserModel(
+                    userId="seed-user-{}".format(u),
+                    username="seed_user_{}".format(u),
+                    email="seed-user-{}@example.com".format(u),
+                    profileImgUrl="",
+                )
+            )
+
+    with RatingModel.batch_write() as batch:
+        for r in range(ratings):
+            p, u = r % products, r // products
+            rating = rng.choices([1, 2, 3, 4, 5], weights=[1, 2, 4, 5, 3])[0]
+            stars[p][STAR_NAMES[rating]] += 1
+            batch.save(
+                RatingModel(
+                    ean=ean(p),
+                    userId="seed-user-{}".format(u),
+                    username="seed_user_{}".format(u),
+                    rating=rating,
+                    comment=(
+                        "{} {}".format(rng.choice(WORDS), rng.choice(WORDS))
+                        if r % 3 == 0
+                        else None
+                    ),
+                    created_at=int(time()) - r,
+                    updated_at=int(time()) - r,
+                )
+            )
+    return stars
+
+
+def seed_products(products: int, stars: List[Dict[str, int]], seed: int) -> None:
+    rng = random.Random(seed)
+    now = int(time())
+    with ProductModel.batch_write() as batch:
+        for p in range(products):
+            words = " ".join(rng.sample(WORDS, 2))
+            counters = StarsModel(**stars[p])
+            batch.save(
+                ProductModel(
+                    ean=ean(p),
+                    name="{} {}".format(words, p),
+                    name_fi="{} {}".format(words, p),
+                    name_en="{} {}".format(words, p),
+                    description_fi=" ".join(rng.choices(WORDS, k=30)),
+                    ingredients_fi=" ".join(rng.choices(WORDS, k=10)),
+                    category=CATEGORIES[p % len(CATEGORIES)],
+                    price=rng.randint(100, 5000),
+                    price_data=[
+                        PriceDataModel(
+                            store=store, price=rng.randint(100, 5000), updated_at=now
+                        )
+                        for store in STORES
+                    ],
+                    store=STORES,
+                    stars=counters,
+                    score=bayesian_score(counters),
+                    rank_partition=RANKING_PARTITION,
+                    created_at=now - p,
+                    updated_at=now - p,
+                )
+            )
+
+
+def seed_price_history(products: int, rows: int, seed: int) -> None:
+    """Daily rows spread over products, stores and days, plus their monthly rollups."""
+    rng = random.Random(seed)
+    rollups: Dict[tuple, list] = {}
+    with PriceHistoryModel.batch_write() as batch:
+        for r in range(rows):
+            p, n = r % products, r // products
+            store, day = STORES[n % len(STORES)], FIRST_DAY + timedelta(
+                days=n // len(STORES)
+            )
+            price = 1000 + rng.randint(-200, 200)
+            created_at = calendar.timegm(day.timetuple())
+            batch.save(
+                PriceHistoryModel(
+                    ean=ean(p),
+                    sk="{}-{}".format(day.isoformat(), store),
+                    price=price,
+                    created_at=created_at,
+                    store=store,
+                )
+            )
+            rollup = rollups.setdefault(
+                (ean(p), day.isoformat()[:7], store), [price, price, 0, 0, 0, 0]
+            )
+            rollup[0], rollup[1] = min(rollup[0], price), max(rollup[1], price)
+            rollup[2], rollup[3] = rollup[2] + price, rollup[3] + 1
+            rollup[4], rollup[5] = price, created_at
+
+        for (product, month, store), (
+            low,
+            high,
+            total,
+            count,
+            price,
+            created_at,
+        ) in rollups.items():
+            batch.save(
+                PriceHistoryModel(
+                    ean=product,
+                    sk=rollup_sk(month, store),
+                    store=store,
+                    price=price,
+                    created_at=created_at,
+                    price_min=low,
+                    price_max=high,
+                    price_sum=total,
+                    price_count=count,
+                    version=1,
+                )
+            )
+
+
+class Users:
+    """Pool users registered through /auth/register, with access tokens."""
+
+    def __init__(
+        self, client: TestClient, cognito: support.LocalCognito, count: int
+    ) -> None:
+        self.emails = ["bench-{}@example.com".format(i) for i in range(count)]
+        self.headers = []
+        for email in self.emails:
+            tokens = client.post(
+                "/auth/register", json={"email": email, "password": PASSWORD}
+            ).json()
+            self.headers.append(bearer(tokens["AccessToken"]))
+
+        cognito.add_to_group(self.emails[0], "Admin")
+        tokens = client.post(
+            "/auth/login", json={"email": self.emails[0], "password": PASSWORD}
+        ).json()
+        self.admin = bearer(tokens["AccessToken"])
+
+
+def bearer(access_token: str) -> dict:
+    return {"Authorization": "Bearer {}".format(access_token)}
+
+
+class Scenario(NamedTuple):
+    router: str
+    name: str
+    method: str
+    route: str
+    # Request number and its Random -> keyword arguments of client.request
+    request: Callable[[int, random.Random], dict]
+    # Caps the request count of slow or heavy routes
+    max_requests: Optional[int] = None
+
+
+def scenarios(args, users: Users, etags: Dict[str, str]) -> List[Scenario]:
+    admin = users.admin
+    revalidated = sorted(etags)
+
+    def any_ean(rng: random.Random) -> str:
+        return ean(rng.randrange(args.products))
+
+    def user(i: int) -> dict:
+        return users.headers[i % len(users.headers)]
+
+    def product_body(rng: random.Random, p: int) -> dict:
+        return {
+            "ean": ean(p),
+            "name": "{} {}".format(rng.choice(WORDS), p),
+            "category": CATEGORIES[p % len(CATEGORIES)],
+            "store": STORES,
+            "price_data": [
+                {"store": store, "price": rng.randint(100, 5000)} for store in STORES
+            ],
+        }
+
+    def stats(interval: str) -> Scenario:
+        return Scenario(
+            "prices",
+            "stats by {}".format(interval),
+            "GET",
+            "/prices/{ean}/stats",
+            lambda i, rng: {
+                "url": "/prices/{}/stats".format(any_ean(rng)),
+                "params": {"interval": interval},
+            },
+        )
+
+    return [
+        Scenario(
+            "products", "list", "GET", "/products", lambda i, rng: {"url": "/products"}
+        ),
+        Scenario(
+            "products",
+            "list projected",
+            "GET",
+            "/products",
+            lambda i, rng: {
+                "url": "/products",
+                "params": {"fields": "ean,name,photo,price,stars"},
+            },
+        ),
+        Scenario(
+            "products",
+            "category by price",
+            "GET",
+            "/products",
+            lambda i, rng: {
+                "url": "/products",
+                "params": {"category": rng.choice(CATEGORIES), "sort": "price"},
+            },
+        ),
+        Scenario(
+            "products",
+            "category by update",
+            "GET",
+            "/products",
+            lambda i, rng: {
+                "url": "/products",
+                "params": {"category": rng.choice(CATEGORIES)},
+            },
+        ),
+        Scenario(
+            "products",
+            "detail",
+            "GET",
+            "/products/{ean}",
+            lambda i, rng: {"url": "/products/{}".format(any_ean(rng))},
+        ),
+        Scenario(
+            "products",
+            "detail projected",
+            "GET",
+            "/products/{ean}",
+            lambda i, rng: {
+                "url": "/products/{}".format(any_ean(rng)),
+                "params": {"fields": "ean,name,price,stars"},
+            },
+        ),
+        Scenario(
+            "products",
+            "detail revalidate",
+            "GET",
+            "/products/{ean}",
+            lambda i, rng: {
+                "url": "/products/{}".format(revalidated[i % len(revalidated)]),
+                "headers": {"If-None-Match": etags[revalidated[i % len(revalidated)]]},
+            },
+        ),
+        Scenario(
+            "products",
+            "update",
+            "PUT",
+            "/products/{ean}",
+            lambda i, rng: {
+                "url": "/products/{}".format(ean(i % args.products)),
+                "json": product_body(rng, i % args.products),
+                "headers": admin,
+            },
+        ),
+        Scenario(
+            "products",
+            "batch",
+            "POST",
+            "/products/batch",
+            lambda i, rng: {
+                "url": "/products/batch",
+                "json": [
+                    product_body(rng, rng.randrange(args.products)) for _ in range(25)
+                ],
+                "headers": admin,
+            },
+        ),
+        Scenario(
+            "products",
+            "scan",
+            "GET",
+            "/products/scan",
+            lambda i, rng: {
+                "url": "/products/scan",
+                "params": {"fields": "ean,name"},
+                "headers": admin,
+            },
+            max_requests=3,
+        ),
+        Scenario(
+            "products",
+            "export",
+            "POST",
+            "/products/export",
+            lambda i, rng: {"url": "/products/export", "headers": admin},
+            max_requests=1,
+        ),
+        Scenario(
+            "search",
+            "build index",
+            "POST",
+            "/products/search/index",
+            lambda i, rng: {"url": "/products/search/index", "headers": admin},
+            max_requests=1,
+        ),
+        Scenario(
+            "search",
+            "search",
+            "GET",
+            "/products/search",
+            lambda i, rng: {
+                "url": "/products/search",
+                "params": {"q": rng.choice(WORDS)},
+            },
+        ),
+        Scenario(
+            "ratings",
+            "rate",
+            "POST",
+            "/ratings/{ean}",
+            lambda i, rng: {
+                "url": "/ratings/{}".format(any_ean(rng)),
+                "json": {"rating": rng.randint(1, 5), "comment": rng.choice(WORDS)},
+                "headers": user(i),
+            },
+        ),
+        Scenario(
+            "ratings",
+            "list",
+            "GET",
+            "/ratings/{ean}",
+            lambda i, rng: {"url": "/ratings/{}".format(any_ean(rng))},
+        ),
+        Scenario(
+            "rankings", "all", "GET", "/rankings", lambda i, rng: {"url": "/rankings"}
+        ),
+        Scenario(
+            "rankings",
+            "category",
+            "GET",
+            "/rankings",
+            lambda i, rng: {
+                "url": "/rankings",
+                "params": {"category": rng.choice(CATEGORIES)},
+            },
+        ),
+        Scenario(
+            "prices",
+            "history",
+            "GET",
+            "/prices/{ean}",
+            lambda i, rng: {"url": "/prices/{}".format(any_ean(rng))},
+        ),
+        stats("day"),
+        stats("week"),
+        stats("month"),
+        Scenario(
+            "users",
+            "me",
+            "GET",
+            "/users/me",
+            lambda i, rng: {"url": "/users/me", "headers": user(i)},
+        ),
+        Scenario(
+            "users",
+            "update me",
+            "PUT",
+            "/users/me",
+            lambda i, rng: {
+                "url": "/users/me",
+                "json": {"username": "bench_{}".format(i)},
+                "headers": user(i),
+            },
+        ),
+        Scenario(
+            "users",
+            "admins",
+            "GET",
+            "/users/admins",
+            lambda i, rng: {"url": "/users/admins", "headers": admin},
+        ),
+        # moto signs every token with RSA, so these are slow, and it cannot
+        # answer REFRESH_TOKEN_AUTH, so /auth/refresh is left out
+        Scenario(
+            "auth",
+            "register",
+            "POST",
+            "/auth/register",
+            lambda i, rng: {
+                "url": "/auth/register",
+                "json": {
+                    "email": "register-{}@example.com".format(i),
+                    "password": PASSWORD,
+                },
+            },
+            max_requests=20,
+        ),
+        Scenario(
+            "auth",
+            "login",
+            "POST",
+            "/auth/login",
+            lambda i, rng: {
+                "url": "/auth/login",
+                "json": {
+                    "email": users.emails[i % len(users.emails)],
+                    "password": PASSWORD,
+                },
+            },
+            max_requests=20,
+        ),
+    ]
+
+
+def percentiles(values: List[float]) -> dict:
+    """Nearest-rank p50/p95/p99, plus mean and max."""
+    values = sorted(values)
+
+    def rank(p: float) -> float:
+        return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+    return {
+        "p50": round(rank(50), 3),
+        "p95": round(rank(95), 3),
+        "p99": round(rank(99), 3),
+        "mean": round(sum(values) / len(values), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+class MetricsRecorder:
+    """Keeps the EMF record of every request the app serves."""
+
+    def __init__(self) -> None:
+        self.records: List[dict] = []
+        self._lock = threading.Lock()
+        emf = instrumentation.RequestMetrics.emf
+        recorder = self
+
+        def recording_emf(metrics, *args, **kwargs):
+            record = emf(metrics, *args, **kwargs)
+            with recorder._lock:
+                recorder.records.append(record)
+            return record
+
+        instrumentation.RequestMetrics.emf = recording_emf
+
+    def take(self) -> List[dict]:
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+
+def run(
+    client: TestClient,
+    scenario: Scenario,
+    count: int,
+    concurrency: int,
+    recorder: MetricsRecorder,
+    seed: int,
+) -> dict:
+    def send(i: int):
+        request = scenario.request(
+            i, random.Random("{}:{}:{}".format(seed, scenario.name, i))
+        )
+        start = perf_counter()
+        response = client.request(scenario.method, **request)
+        return (
+            (perf_counter() - start) * 1000,
+            response.status_code,
+            len(response.content),
+        )
+
+    recorder.take()
+    started = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(count)))
+    elapsed = perf_counter() - started
+    records = recorder.take()
+
+    capacity = sum(record["ConsumedCapacity"] for record in records)
+    return {
+        "router": scenario.router,
+        "name": scenario.name,
+        "method": scenario.method,
+        "route": scenario.route,
+        "requests": count,
+        "concurrency": concurrency,
+        "status": dict(
+            sorted(Counter(str(status) for _, status, _ in results).items())
+        ),
+        "latency_ms": percentiles([latency for latency, _, _ in results]),
+        "server_latency_ms": percentiles([record["Latency"] for record in records]),
+        "throughput_rps": round(count / elapsed, 2),
+        "response_bytes": round(sum(size for _, _, size in results) / count, 1),
+        "dynamodb_calls": round(
+            sum(record["DynamoDBCalls"] for record in records) / count, 3
+        ),
+        "consumed_capacity": {
+            "total": capacity,
+            "per_request": round(capacity / count, 3),
+        },
+    }
+
+
+def compare(results: List[dict], baseline: dict) -> None:
+    """Add each route's ratio to the baseline run, above 1 is slower or costlier."""
+    previous = {(r["router"], r["name"]): r for r in baseline["routes"]}
+    for result in results:
+        before = previous.get((result["router"], result["name"]))
+        if before is None:
+            continue
+        ratios = {
+            p: result["latency_ms"][p] / before["latency_ms"][p]
+            for p in ("p50", "p95", "p99")
+            if before["latency_ms"][p]
+        }
+        if before["consumed_capacity"]["per_request"]:
+            ratios["consumed_capacity"] = (
+                result["consumed_capacity"]["per_request"]
+                / before["consumed_capacity"]["per_request"]
+            )
+        result["vs_baseline"] = {
+            name: round(ratio, 3) for name, ratio in ratios.items()
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=support.ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--ratings", type=int, default=20000)
+    parser.add_argument("--price-rows", type=int, default=50000)
+    parser.add_argument(
+        "--users", type=int, default=10, help="user pool users making the requests"
+    )
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--only", action="append", default=[], help="run only these routers"
+    )
+    parser.add_argument("--baseline", help="earlier output to compare against")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def benchmark(args) -> dict:
+    recorder = MetricsRecorder()
+    client = TestClient(main.app)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": int(time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "moto": moto.__version__,
+        },
+        "scale": vars(args),
+    }
+
+    # The app prints an EMF line per request, keep stdout for the report
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        with support.LocalAWS(), support.LocalCognito() as cognito:
+            started = perf_counter()
+            stars = seed_ratings(args.products, args.ratings, args.seed)
+            seed_products(args.products, stars, args.seed)
+            seed_price_history(args.products, args.price_rows, args.seed)
+            users = Users(client, cognito, args.users)
+            report["meta"]["seed_seconds"] = round(perf_counter() - started, 2)
+
+            etags = {}
+            for p in range(min(args.products, 100)):
+                response = client.get("/products/{}".format(ean(p)))
+                etags[ean(p)] = response.headers["ETag"]
+
+            results = []
+            for scenario in scenarios(args, users, etags):
+                if args.only and scenario.router not in args.only:
+                    continue
+                product_cache.clear()
+                count = min(args.requests, scenario.max_requests or args.requests)
+                results.append(
+                    run(client, scenario, count, args.concurrency, recorder, args.seed)
+                )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+    report["routes"] = results
+    return report
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = benchmark(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,129 @@
+"""
+Per-request cost of access token verification, with and without the
+verified-claims cache.
+
+Signs a Cognito-style access token with a local RSA key and serves the
+matching key set in place of the user pool's jwks.json, so no network is
+involved:
+
+    python tests/benchmark_auth.py --requests 2000
+
+"verify" times CognitoAuth.verify on its own, "dependency" the
+auth.claim(AccessUser) dependency a route runs per request, claims parsing
+included. Both are timed directly rather than through a test client,
+whose own per-request cost is larger than the difference being measured.
+"uncached" disables the claims cache, so every request checks the RS256
+signature as before the cache existed.
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+from time import perf_counter, time
+from typing import Callable, List
+
+import support
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwk, jwt
+
+import utils.auth
+from utils.auth import JWKS, AccessUser, CognitoAuth
+from utils.cache import LRUCache
+
+KID = "benchmark"
+CLIENT_ID = support.ENVIRONMENT["user_pool_client_id"]
+
+
+def signing_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return private, dict(jwk.construct(public, "RS256").to_dict(), kid=KID, use="sig")
+
+
+def cognito_auth(public_jwk: dict, cached: bool) -> CognitoAuth:
+    body = json.dumps({"keys": [public_jwk]}).encode()
+    utils.auth.urlopen = lambda url, timeout: io.BytesIO(body)
+
+    cognito = CognitoAuth(
+        support.ENVIRONMENT["region"], support.ENVIRONMENT["user_pool_id"], CLIENT_ID
+    )
+    cognito.jwks = JWKS(
+        cognito.jwks.url, os.path.join(tempfile.mkdtemp(), "jwks.json"), 60
+    )
+    if not cached:
+        cognito.claims_cache = LRUCache(maxsize=0, ttl=0)
+    return cognito
+
+
+def access_token(cognito: CognitoAuth, private: bytes) -> str:
+    now = int(time())
+    claims = {
+        "sub": "user",
+        "iss": cognito.issuer,
+        "client_id": CLIENT_ID,
+        "token_use": "access",
+        "cognito:groups": ["Admin"],
+        "iat": now,
+        "exp": now + 3600,
+    }
+    return jwt.encode(claims, private, algorithm="RS256", headers={"kid": KID})
+
+
+def measure(call: Callable[[], object], requests: int) -> List[float]:
+    call()  # the first call fetches the key set
+    times = []
+    for _ in range(requests):
+        start = perf_counter()
+        call()
+        times.append((perf_counter() - start) * 1e6)
+    return times
+
+
+def summary(times: List[float]) -> dict:
+    return {
+        "median_us": round(statistics.median(times), 1),
+        "mean_us": round(statistics.mean(times), 1),
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    return parser.parse_args(argv)
+
+
+def benchmark(args) -> List[dict]:
+    private, public_jwk = signing_key()
+    results = []
+    for mode, cached in (("uncached", False), ("cached", True)):
+        cognito = cognito_auth(public_jwk, cached)
+        token = access_token(cognito, private)
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        dependency = cognito.claim(AccessUser)
+
+        verify = measure(lambda: cognito.verify(token), args.requests)
+        claim = measure(lambda: dependency(credentials), args.requests)
+        results.append(
+            {"mode": mode, "verify": summary(verify), "dependency": summary(claim)}
+        )
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark(parse_args()):
+        json.dump(result, sys.stdout)
+        sys.stdout.write("\n")
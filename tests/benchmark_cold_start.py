@@ -0,0 +1,173 @@
+"""
+Cold-start cost of the API Lambda: `import main` time and time to the
+first response through the Mangum handler.
+
+Every sample is a fresh Python process that imports main, then answers
+a synthetic API Gateway HTTP API event, then a second one for the warm
+cost. DynamoDB is a moto server on localhost, started by this script, so
+the first request pays for importing boto3 and pynamodb and for opening
+a connection as it would in Lambda:
+
+    python tests/benchmark_cold_start.py --runs 10
+
+Prints one JSON object with the per-run samples and their medians.
+`preloaded` lists the heavy modules that `import main` already pulled in,
+so a new eager import shows up there.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+EAN = "6410000000001"
+HEAVY_MODULES = (
+    "boto3",
+    "botocore",
+    "pynamodb",
+    "jose",
+    "cryptography",
+    "PIL",
+    "numpy",
+)
+
+
+def event(path: str) -> dict:
+    """API Gateway HTTP API (payload version 2.0) GET request."""
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": "",
+        "headers": {"host": "localhost", "accept": "application/json"},
+        "requestContext": {
+            "accountId": "123456789012",
+            "apiId": "benchmark",
+            "domainName": "localhost",
+            "http": {
+                "method": "GET",
+                "path": path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": "127.0.0.1",
+                "userAgent": "benchmark",
+            },
+            "requestId": "benchmark",
+            "routeKey": "$default",
+            "stage": "$default",
+        },
+        "isBase64Encoded": False,
+    }
+
+
+def child(endpoint: str, path: str) -> None:
+    """One cold start. Runs in a fresh process, see benchmark()."""
+    start = perf_counter()
+    import main
+
+    imported = perf_counter()
+    preloaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    # Table models connect on first use; point them at the moto server
+    from models.products import ProductModel
+    from models.ratings import RatingModel
+
+    for model in (ProductModel, RatingModel):
+        model.Meta.host = endpoint
+
+    timings = []
+    for _ in range(2):
+        request_start = perf_counter()
+        response = main.handler(event(path), None)
+        timings.append((perf_counter() - request_start) * 1000)
+        assert response["statusCode"] == 200, response
+
+    json.dump(
+        {
+            "import_ms": (imported - start) * 1000,
+            "first_response_ms": timings[0],
+            "warm_response_ms": timings[1],
+            "preloaded": preloaded,
+        },
+        sys.stdout,
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed(endpoint: str) -> None:
+    from models.products import ProductModel
+    from models.ratings import RatingModel
+
+    for model in (ProductModel, RatingModel):
+        model.Meta.host = endpoint
+        model.create_table(read_capacity_units=5, write_capacity_units=5, wait=True)
+    ProductModel(ean=EAN, name="olut", category="beer", price=199, version=1).save()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--path", default="/products/{}".format(EAN))
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def benchmark(args) -> dict:
+    # Only here: support imports moto and boto3, which a cold start child
+    # must not inherit
+    import support
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    port = free_port()
+    endpoint = "http://127.0.0.1:{}".format(port)
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    try:
+        seed(endpoint)
+        environment = dict(
+            os.environ,
+            PYTHONPATH=os.path.join(support.FUNCTIONS, "app"),
+            request_metrics="false",
+        )
+        samples = []
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, __file__, "--child", endpoint, "--path", args.path],
+                env=environment,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            samples.append(json.loads(output.splitlines()[-1]))
+    finally:
+        server.stop()
+
+    return {
+        "runs": args.runs,
+        "path": args.path,
+        "median": {
+            name: round(statistics.median(s[name] for s in samples), 1)
+            for name in ("import_ms", "first_response_ms", "warm_response_ms")
+        },
+        "preloaded": sorted({name for s in samples for name in s["preloaded"]}),
+        "samples": samples,
+    }
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.child:
+        child(arguments.child, arguments.path)
+    else:
+        json.dump(benchmark(arguments), sys.stdout)
+        sys.stdout.write("\n")
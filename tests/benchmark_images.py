@@ -0,0 +1,133 @@
+"""
+Peak memory and time per image of the image-download-handler encode path
+on large generated JPEG and PNG sources.
+
+Each image is encoded by encode_outputs in a fresh process, so the peak
+RSS of one image does not hide the next one's. Uploads go to moto's
+in-process S3, which keeps the encoded variants in memory; they are a
+few hundred KB next to the decoded source.
+
+    python tests/benchmark_images.py --runs 3
+
+Prints one JSON object per source image with the median seconds, the
+peak RSS of the process while encoding and its growth over the RSS
+before encoding. Peak RSS is read from /proc, so this runs on Linux only,
+as Lambda does.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from PIL import Image
+
+# format, width, height: a phone photo, a 48 MP camera photo and PNG
+# sources, which have no reduced decode
+CASES = [
+    ("jpeg", 4000, 3000),
+    ("jpeg", 8000, 6000),
+    ("png", 4000, 3000),
+    ("png", 6000, 4000),
+]
+
+
+def generate(fmt: str, width: int, height: int, path: str) -> None:
+    """Noisy image, so the source file is as large as a real photo's."""
+    image = Image.merge(
+        "RGB", [Image.effect_noise((width, height), sigma) for sigma in (30, 50, 70)]
+    )
+    image.save(path, format=fmt.upper(), **({"quality": 90} if fmt == "jpeg" else {}))
+
+
+def memory_mb(field: str) -> float:
+    """VmRSS or VmHWM (peak RSS) of this process, Linux only."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise KeyError(field)
+
+
+def reset_peak_rss() -> None:
+    # Resets VmHWM to the current RSS, so the peak covers the encode only
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def child(path: str) -> None:
+    """Encode one image. Runs in a fresh process, see benchmark()."""
+    import support
+
+    with support.LocalAWS():
+        images = support.load_handler("image-download-handler")
+        with open(path, "rb") as f:
+            body = f.read()
+
+        reset_peak_rss()
+        before = memory_mb("VmRSS")
+        start = perf_counter()
+        assert images.encode_outputs(
+            body, "6410000000001", "https://example.com/" + os.path.basename(path)
+        )
+        seconds = perf_counter() - start
+        after = memory_mb("VmHWM")
+
+    json.dump(
+        {"seconds": seconds, "peak_rss_mb": after, "rss_growth_mb": after - before},
+        sys.stdout,
+    )
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def benchmark(args) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for fmt, width, height in CASES:
+            path = os.path.join(directory, "{}x{}.{}".format(width, height, fmt))
+            generate(fmt, width, height, path)
+
+            samples = []
+            for _ in range(args.runs):
+                output = subprocess.run(
+                    [sys.executable, __file__, "--child", path],
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                samples.append(json.loads(output.splitlines()[-1]))
+
+            results.append(
+                {
+                    "format": fmt,
+                    "width": width,
+                    "height": height,
+                    "source_mb": round(os.path.getsize(path) / 1024 / 1024, 1),
+                    "seconds": round(
+                        statistics.median(s["seconds"] for s in samples), 2
+                    ),
+                    "peak_rss_mb": round(max(s["peak_rss_mb"] for s in samples), 1),
+                    "rss_growth_mb": round(max(s["rss_growth_mb"] for s in samples), 1),
+                }
+            )
+    return results
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.child:
+        child(arguments.child)
+    else:
+        for result in benchmark(arguments):
+            json.dump(result, sys.stdout)
+            sys.stdout.write("\n")
@@ -0,0 +1,76 @@
+"""
+Wall-clock time of parallel_scan against the number of scan segments.
+
+moto ignores Segment and returns a whole table in one page without any
+latency, so it cannot show how a parallel scan scales. This benchmark
+scans a stand-in table instead: items are split between segments the way
+DynamoDB splits them, and every page of `--page-items` items costs
+`--page-ms` of simulated round trip. The defaults approximate a 1 MB page
+of 2.5 KB products:
+
+    python tests/benchmark_scan.py --items 50000 --segments 1,2,4,8,16
+
+Prints one JSON object per segment count with the scan time, throughput
+and speedup over the first segment count.
+"""
+
+import argparse
+import json
+import sys
+from time import perf_counter, sleep
+from typing import List
+
+import support  # noqa: F401
+
+from utils.scan import parallel_scan
+
+
+class SimulatedTable:
+    """Segmented, paged scan with a fixed latency per page."""
+
+    def __init__(self, items: int, page_items: int, page_ms: float) -> None:
+        self.items = items
+        self.page_items = page_items
+        self.page_seconds = page_ms / 1000
+
+    def scan(self, segment: int, total_segments: int, **kwargs):
+        mine = range(segment, self.items, total_segments)
+        for start in range(0, len(mine), self.page_items):
+            sleep(self.page_seconds)
+            yield from mine[start : start + self.page_items]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--page-items", type=int, default=400)
+    parser.add_argument("--page-ms", type=float, default=60.0)
+    parser.add_argument("--segments", default="1,2,4,8,16,32")
+    return parser.parse_args(argv)
+
+
+def benchmark(args) -> List[dict]:
+    table = SimulatedTable(args.items, args.page_items, args.page_ms)
+    results = []
+    for total_segments in [int(s) for s in args.segments.split(",")]:
+        start = perf_counter()
+        scanned = sum(1 for _ in parallel_scan(table, total_segments=total_segments))
+        seconds = perf_counter() - start
+        assert scanned == args.items
+        results.append(
+            {
+                "segments": total_segments,
+                "seconds": round(seconds, 3),
+                "items_per_second": round(scanned / seconds),
+                "speedup": (
+                    round(results[0]["seconds"] / seconds, 2) if results else 1.0
+                ),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark(parse_args()):
+        json.dump(result, sys.stdout)
+        sys.stdout.write("\n")
@@ -0,0 +1,213 @@
+"""
+Serialization time of 1k-product payloads, precompiled orjson encoders
+against the DTO classes and jsons they replaced.
+
+Both paths start from the same in-memory ProductModel instances, so no
+DynamoDB is involved:
+
+    python tests/benchmark_serialization.py --products 1000 --repeat 20
+
+"list" is a GET /products style response body: DTOs through FastAPI's
+jsonable_encoder and JSONResponse rendering before, encode_product through
+ORJSONResponse now. "export" is the S3 export body: jsons.dumps of the DTO
+list before, one orjson.dumps per item now.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+from time import perf_counter
+from typing import Callable, List
+
+import support  # noqa: F401
+
+import jsons
+import orjson
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from models.products import NutrientsModel, PriceDataModel, ProductModel, StarsModel
+from utils.serialization import encode_product
+
+
+# The response classes removed from models/products.py, kept here as the
+# baseline of the comparison
+class PriceDataDTO:
+    def __init__(self, price, updated_at, store) -> None:
+        self.price = price
+        self.updated_at = updated_at
+        self.store = store
+
+
+class NutrientsDTO:
+    def __init__(self, name, ri, value) -> None:
+        self.name = name
+        self.ri = ri
+        self.value = value
+
+
+class StarsDTO:
+    def __init__(self, one, two, three, four, five) -> None:
+        self.one = one
+        self.two = two
+        self.three = three
+        self.four = four
+        self.five = five
+
+
+class ProductDTO:
+    def __init__(self, product: ProductModel) -> None:
+        self.ean = product.ean
+        self.name = product.name
+        self.category = product.category
+        self.stars = StarsDTO(
+            one=product.stars.one,
+            two=product.stars.two,
+            three=product.stars.three,
+            four=product.stars.four,
+            five=product.stars.five,
+        )
+        self.photo = product.photo
+        self.price = product.price
+        self.created_at = product.created_at
+        self.updated_at = product.updated_at
+        if product.price_data is not None:
+            self.price_data = [
+                PriceDataDTO(price=pd.price, updated_at=pd.updated_at, store=pd.store)
+                for pd in product.price_data
+                if pd is not None
+            ]
+        self.store = product.store
+        self.main_product_ean = product.main_product_ean
+        self.name_fi = product.name_fi
+        self.name_sv = product.name_sv
+        self.name_en = product.name_en
+        self.description_fi = product.description_fi
+        self.description_sv = product.description_sv
+        self.description_en = product.description_en
+        self.ingredients_fi = product.ingredients_fi
+        self.ingredients_sv = product.ingredients_sv
+        self.ingredients_en = product.ingredients_en
+        if product.nutrients is not None:
+            self.nutrients = [
+                NutrientsDTO(name=n.name, ri=n.ri, value=n.value)
+                for n in product.nutrients
+                if n is not None
+            ]
+        self.supplier = product.supplier
+
+
+def products(count: int, seed: int) -> List[ProductModel]:
+    rng = random.Random(seed)
+    text = "Maltainen ja humalainen, täyteläinen olut. " * 4
+    return [
+        ProductModel(
+            ean="{:013d}".format(6410000000000 + i),
+            name="olut {}".format(i),
+            name_fi="olut {}".format(i),
+            name_sv="öl {}".format(i),
+            name_en="beer {}".format(i),
+            category="beer",
+            price=rng.randint(100, 2000),
+            stars=StarsModel(
+                **{
+                    n: rng.randint(0, 50)
+                    for n in ("one", "two", "three", "four", "five")
+                }
+            ),
+            photo="https://example.com/{}.jpg".format(i),
+            store=["prisma", "lidl"],
+            price_data=[
+                PriceDataModel(
+                    price=rng.randint(100, 2000), updated_at=1700000000, store=store
+                )
+                for store in ("prisma", "lidl")
+            ],
+            description_fi=text,
+            description_en=text,
+            ingredients_fi=text,
+            nutrients=[
+                NutrientsModel(name="energia", ri="5 %", value="{} kJ".format(n))
+                for n in range(8)
+            ],
+            supplier="panimo",
+            created_at=1700000000,
+            updated_at=1700000000,
+        )
+        for i in range(count)
+    ]
+
+
+def old_list(models: List[ProductModel]) -> bytes:
+    return JSONResponse(
+        jsonable_encoder({"items": [ProductDTO(pm) for pm in models]})
+    ).body
+
+
+def new_list(models: List[ProductModel]) -> bytes:
+    return ORJSONResponse({"items": [encode_product(pm) for pm in models]}).body
+
+
+def old_export(models: List[ProductModel]) -> bytes:
+    return jsons.dumps([ProductDTO(pm) for pm in models]).encode()
+
+
+def new_export(models: List[ProductModel]) -> bytes:
+    return b"".join(orjson.dumps(encode_product(pm)) + b"\n" for pm in models)
+
+
+def measure(
+    serialize: Callable[[List[ProductModel]], bytes], models, repeat: int
+) -> dict:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        body = serialize(models)
+        times.append((perf_counter() - start) * 1000)
+    return {
+        "median_ms": round(statistics.median(times), 2),
+        "min_ms": round(min(times), 2),
+        "bytes": len(body),
+    }
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args(argv)
+
+
+def benchmark(args) -> List[dict]:
+    models = products(args.products, args.seed)
+    # Both paths must describe the same products
+    assert [p["ean"] for p in json.loads(old_list(models))["items"]] == [
+        p["ean"] for p in json.loads(new_list(models))["items"]
+    ]
+
+    results = []
+    for payload, old, new in (
+        ("list", old_list, new_list),
+        ("export", old_export, new_export),
+    ):
+        before = measure(old, models, args.repeat)
+        after = measure(new, models, args.repeat)
+        results.append(
+            {
+                "payload": payload,
+                "products": args.products,
+                "before": before,
+                "after": after,
+                "speedup": round(before["median_ms"] / after["median_ms"], 1),
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    for result in benchmark(parse_args()):
+        json.dump(result, sys.stdout)
+        sys.stdout.write("\n")
@@ -0,0 +1,23 @@
+import pytest
+
+import support
+
+
+@pytest.fixture(autouse=True)
+def aws():
+    with support.LocalAWS() as local_aws:
+        from utils.cache import product_cache
+
+        product_cache.clear()
+        yield local_aws
+
+
+@pytest.fixture
+def client(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from main import app
+    from utils.auth import auth
+
+    monkeypatch.setattr(auth, "verify", support.fake_verify)
+    return TestClient(app)
@@ -0,0 +1,213 @@
+"""
+Local AWS stand-ins shared by the tests and the benchmark.
+
+Importing this module points the app at moto: it sets the environment the
+Lambda functions read at import time and puts src/functions/app on
+sys.path. Import it before anything from the app.
+"""
+
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = os.path.join(ROOT, "src", "functions")
+
+ENVIRONMENT = {
+    "STAGE": "test",
+    "region": "eu-north-1",
+    "AWS_DEFAULT_REGION": "eu-north-1",
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "products_table_name": "test-products",
+    "ratings_table_name": "test-ratings",
+    "users_table_name": "test-users",
+    "pricehistory_table_name": "test-pricehistory",
+    "public_content_bucket_name": "test-public-content",
+    "user_pool_id": "eu-north-1_test",
+    "user_pool_client_id": "test-client",
+    "cursor_secret": "test-cursor-secret",
+    "request_metrics": "true",
+    "request_profiling": "false",
+}
+
+os.environ.update(ENVIRONMENT)
+sys.path.insert(0, os.path.join(FUNCTIONS, "app"))
+
+# moto has to be imported before the first boto3 client is created
+from moto import mock_cognitoidp, mock_dynamodb, mock_s3  # noqa: E402
+from moto.core.botocore_stubber import BotocoreStubber  # noqa: E402
+
+
+def _atomic_requests() -> None:
+    """
+    DynamoDB applies every request atomically; moto does not (a transaction
+    deep-copies the tables while other threads write to them). Requests are
+    serialized so tests that hit the API from many threads see DynamoDB's
+    behaviour rather than moto's races.
+    """
+    call = BotocoreStubber.__call__
+    lock = threading.Lock()
+
+    def locked_call(self, *args, **kwargs):
+        with lock:
+            return call(self, *args, **kwargs)
+
+    BotocoreStubber.__call__ = locked_call
+
+
+_atomic_requests()
+
+
+def create_tables() -> None:
+    from models.pricehistory import PriceHistoryModel
+    from models.products import ProductModel
+    from models.ratings import RatingModel
+    from models.users import UserModel
+
+    for model in (ProductModel, RatingModel, UserModel, PriceHistoryModel):
+        model.create_table(read_capacity_units=5, write_capacity_units=5, wait=True)
+
+    import boto3
+
+    boto3.client("s3").create_bucket(
+        Bucket=ENVIRONMENT["public_content_bucket_name"],
+        CreateBucketConfiguration={"LocationConstraint": ENVIRONMENT["region"]},
+    )
+
+
+class LocalAWS:
+    """moto DynamoDB and S3 with the app's tables and bucket created."""
+
+    def __enter__(self) -> "LocalAWS":
+        self._mocks = [mock_dynamodb(), mock_s3()]
+        for mock in self._mocks:
+            mock.start()
+        create_tables()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for mock in reversed(self._mocks):
+            mock.stop()
+
+
+class LocalCognito:
+    """
+    A moto user pool the app logs in against and verifies tokens of.
+
+    moto picks the pool id, so the /auth endpoints and the shared
+    CognitoAuth are pointed at it on enter and back on exit. The pool's
+    JWKS is served from moto's key file instead of over HTTP.
+    """
+
+    def __enter__(self) -> "LocalCognito":
+        import boto3
+        import moto.cognitoidp
+
+        import endpoints.auth
+        import utils.auth
+
+        self._mock = mock_cognitoidp()
+        self._mock.start()
+        self.client = boto3.client("cognito-idp", region_name=ENVIRONMENT["region"])
+        self.user_pool_id = self.client.create_user_pool(PoolName="test")["UserPool"][
+            "Id"
+        ]
+        self.client_id = self.client.create_user_pool_client(
+            UserPoolId=self.user_pool_id,
+            ClientName="test",
+            ExplicitAuthFlows=["ADMIN_USER_PASSWORD_AUTH", "REFRESH_TOKEN_AUTH"],
+        )["UserPoolClient"]["ClientId"]
+        self.client.create_group(UserPoolId=self.user_pool_id, GroupName="Admin")
+
+        with open(
+            os.path.join(
+                os.path.dirname(moto.cognitoidp.__file__),
+                "resources",
+                "jwks-public.json",
+            ),
+            "rb",
+        ) as f:
+            jwks = f.read()
+        self._jwks_dir = tempfile.TemporaryDirectory()
+
+        auth = utils.auth.auth
+        issuer = "https://cognito-idp.{}.amazonaws.com/{}".format(
+            ENVIRONMENT["region"], self.user_pool_id
+        )
+        patches = [
+            (endpoints.auth, "user_pool_id", self.user_pool_id),
+            (endpoints.auth, "user_pool_client_id", self.client_id),
+            (utils.auth, "urlopen", lambda url, timeout: io.BytesIO(jwks)),
+            (auth, "issuer", issuer),
+            (auth, "client_id", self.client_id),
+            (
+                auth,
+                "jwks",
+                utils.auth.JWKS(
+                    "{}/.well-known/jwks.json".format(issuer),
+                    os.path.join(self._jwks_dir.name, "jwks.json"),
+                    60,
+                ),
+            ),
+        ]
+        self._originals = [(obj, name, getattr(obj, name)) for obj, name, _ in patches]
+        for obj, name, value in patches:
+            setattr(obj, name, value)
+        auth.claims_cache.clear()
+        return self
+
+    def add_to_group(self, email: str, group: str) -> None:
+        self.client.admin_add_user_to_group(
+            UserPoolId=self.user_pool_id, Username=email, GroupName=group
+        )
+
+    def __exit__(self, *exc_info) -> None:
+        for obj, name, original in self._originals:
+            setattr(obj, name, original)
+        self._jwks_dir.cleanup()
+        self._mock.stop()
+
+
+def token(sub: str, *groups: str) -> str:
+    """Bearer token understood by fake_verify."""
+    return "{}|{}".format(sub, ",".join(groups))
+
+
+def fake_verify(token: str) -> dict:
+    """Stands in for CognitoAuth.verify, which needs a signed Cognito token."""
+    sub, _, groups = token.partition("|")
+    return {"sub": sub, "cognito:groups": [g for g in groups.split(",") if g]}
+
+
+def bearer(sub: str, *groups: str) -> dict:
+    return {"Authorization": "Bearer {}".format(token(sub, *groups))}
+
+
+ADMIN = bearer("admin", "Admin")
+
+
+def emf_records(output: str) -> list:
+    """The EMF lines RequestMetricsMiddleware printed into `output`."""
+    return [
+        json.loads(line)
+        for line in output.splitlines()
+        if line.startswith("{") and '"_aws"' in line
+    ]
+
+
+def load_handler(function: str):
+    """Import a Lambda function's handler.py under a name of its own."""
+    name = function.replace("-", "_") + "_handler"
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            name, os.path.join(FUNCTIONS, function, "handler.py")
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
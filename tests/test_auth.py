@@ -0,0 +1,203 @@
+import io
+import json
+from time import time
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwk, jwt
+
+import utils.auth
+import utils.cache
+from utils.auth import JWKS, CognitoAuth
+
+from support import ENVIRONMENT
+
+CLIENT_ID = ENVIRONMENT["user_pool_client_id"]
+
+
+def generate_key(kid: str) -> dict:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return {
+        "kid": kid,
+        "private": private,
+        "jwk": dict(jwk.construct(public, "RS256").to_dict(), kid=kid, use="sig"),
+    }
+
+
+class JWKSEndpoint:
+    """Stands in for the user pool's jwks.json, counting downloads."""
+
+    def __init__(self, *keys: dict) -> None:
+        self.keys = list(keys)
+        self.fetches = 0
+
+    def urlopen(self, url: str, timeout: float):
+        self.fetches += 1
+        return io.BytesIO(
+            json.dumps({"keys": [key["jwk"] for key in self.keys]}).encode()
+        )
+
+
+@pytest.fixture
+def keys():
+    return {kid: generate_key(kid) for kid in ("first", "rotated", "unknown")}
+
+
+@pytest.fixture
+def endpoint(keys, monkeypatch):
+    endpoint = JWKSEndpoint(keys["first"])
+    monkeypatch.setattr(utils.auth, "urlopen", endpoint.urlopen)
+    return endpoint
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic time as seen by the JWKS refresh limit and the claims cache."""
+    now = {"value": 1000.0}
+    monkeypatch.setattr(utils.auth, "monotonic", lambda: now["value"])
+    monkeypatch.setattr(utils.cache, "monotonic", lambda: now["value"])
+
+    def advance(seconds: float) -> None:
+        now["value"] += seconds
+
+    return advance
+
+
+@pytest.fixture
+def cognito(endpoint, tmp_path):
+    cognito = CognitoAuth(ENVIRONMENT["region"], ENVIRONMENT["user_pool_id"], CLIENT_ID)
+    cognito.jwks = JWKS(cognito.jwks.url, str(tmp_path / "jwks.json"), 60)
+    return cognito
+
+
+def sign(cognito: CognitoAuth, key: dict, **claims) -> str:
+    now = int(time())
+    claims = dict(
+        {
+            "sub": "user",
+            "iss": cognito.issuer,
+            "client_id": CLIENT_ID,
+            "token_use": "access",
+            "iat": now,
+            "exp": now + 3600,
+        },
+        **claims,
+    )
+    return jwt.encode(
+        claims, key["private"], algorithm="RS256", headers={"kid": key["kid"]}
+    )
+
+
+def assert_rejected(cognito: CognitoAuth, token: str) -> None:
+    with pytest.raises(HTTPException) as e:
+        cognito.verify(token)
+    assert e.value.status_code == 401
+
+
+def test_access_token_is_verified(cognito, keys):
+    assert cognito.verify(sign(cognito, keys["first"]))["sub"] == "user"
+
+
+@pytest.mark.parametrize(
+    "claims",
+    [
+        {"client_id": "another-client"},
+        {"client_id": None},
+        {"token_use": "id", "aud": CLIENT_ID},
+        {"iss": "https://cognito-idp.eu-north-1.amazonaws.com/eu-north-1_other"},
+    ],
+)
+def test_tokens_of_other_clients_or_pools_are_rejected(cognito, keys, claims):
+    assert_rejected(cognito, sign(cognito, keys["first"], **claims))
+
+
+def test_token_signed_with_another_key_is_rejected(cognito, keys):
+    forged = sign(cognito, dict(keys["unknown"], kid="first"))
+
+    assert_rejected(cognito, forged)
+
+
+def test_unknown_kid_refetches_at_most_once_per_interval(
+    cognito, endpoint, keys, clock
+):
+    cognito.verify(sign(cognito, keys["first"]))
+    assert endpoint.fetches == 1
+
+    # The pool rotates its keys
+    endpoint.keys.append(keys["rotated"])
+    clock(60)
+    assert cognito.verify(sign(cognito, keys["rotated"]))["sub"] == "user"
+    assert endpoint.fetches == 2
+
+    # Unknown kids cannot make every request download the key set
+    for _ in range(3):
+        assert_rejected(cognito, sign(cognito, keys["unknown"]))
+    assert endpoint.fetches == 2
+
+    clock(60)
+    assert_rejected(cognito, sign(cognito, keys["unknown"]))
+    assert endpoint.fetches == 3
+
+
+def test_key_set_is_shared_through_the_file(cognito, endpoint, keys, tmp_path):
+    cognito.verify(sign(cognito, keys["first"]))
+
+    fresh = CognitoAuth(ENVIRONMENT["region"], ENVIRONMENT["user_pool_id"], CLIENT_ID)
+    fresh.jwks = JWKS(cognito.jwks.url, str(tmp_path / "jwks.json"), 60)
+    fresh.verify(sign(fresh, keys["first"]))
+
+    assert endpoint.fetches == 1
+
+
+def test_claims_are_cached_until_the_token_expires(cognito, keys, clock, monkeypatch):
+    decode = jwt.decode
+    decoded = []
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(True)
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(jwt, "decode", counting_decode)
+    token = sign(cognito, keys["first"], exp=int(time()) + 300)
+
+    for _ in range(3):
+        cognito.verify(token)
+    assert len(decoded) == 1
+
+    clock(301)
+    cognito.verify(token)
+    assert len(decoded) == 2
+
+
+def test_user_pool_tokens_work_end_to_end():
+    from fastapi.testclient import TestClient
+
+    import main
+    from support import LocalCognito
+
+    client = TestClient(main.app)
+    credentials = {"email": "user@example.com", "password": "Passw0rd!"}
+    with LocalCognito() as cognito:
+        tokens = client.post("/auth/register", json=credentials).json()
+        headers = {"Authorization": "Bearer {}".format(tokens["AccessToken"])}
+
+        assert (
+            client.get("/users/me", headers=headers).json()["email"]
+            == credentials["email"]
+        )
+        assert client.get("/users/admins", headers=headers).status_code == 403
+
+        cognito.add_to_group(credentials["email"], "Admin")
+        tokens = client.post("/auth/login", json=credentials).json()
+        headers = {"Authorization": "Bearer {}".format(tokens["AccessToken"])}
+        assert client.get("/users/admins", headers=headers).status_code == 200
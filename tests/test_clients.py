@@ -0,0 +1,85 @@
+import logging
+import socket
+
+import boto3
+import pytest
+import urllib3.connectionpool
+from moto.server import ThreadedMotoServer
+
+import utils.clients
+from models.products import ProductModel
+from utils.clients import get_client
+
+from support import ENVIRONMENT
+
+BUCKET = "connection-reuse"
+REQUESTS = 20
+
+
+@pytest.fixture
+def endpoint(aws):
+    """
+    moto as a real HTTP server: the in-process mocks answer before a
+    request reaches a connection, so they cannot show connection reuse.
+    """
+    aws.__exit__(None, None, None)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+    server.start()
+    yield "http://127.0.0.1:{}".format(port)
+    server.stop()
+    aws.__enter__()
+
+
+@pytest.fixture
+def new_connections(monkeypatch):
+    """Counts the HTTP connections botocore and pynamodb open."""
+    opened = []
+    new_conn = urllib3.connectionpool.HTTPConnectionPool._new_conn
+
+    def counting_new_conn(self):
+        opened.append((self.host, self.port))
+        return new_conn(self)
+
+    monkeypatch.setattr(
+        urllib3.connectionpool.HTTPConnectionPool, "_new_conn", counting_new_conn
+    )
+    return opened
+
+
+def test_shared_s3_client_reuses_its_connection(endpoint, new_connections, monkeypatch):
+    session_client = boto3.session.Session.client
+
+    def local_client(self, service, **kwargs):
+        return session_client(self, service, endpoint_url=endpoint, **kwargs)
+
+    monkeypatch.setattr(boto3.session.Session, "client", local_client)
+    monkeypatch.setattr(utils.clients, "_clients", {})
+
+    s3 = get_client("s3")
+    s3.create_bucket(
+        Bucket=BUCKET,
+        CreateBucketConfiguration={"LocationConstraint": ENVIRONMENT["region"]},
+    )
+    for i in range(REQUESTS):
+        get_client("s3").put_object(
+            Bucket=BUCKET, Key="object-{}".format(i), Body=b"{}"
+        )
+
+    assert get_client("s3") is s3
+    assert len(new_connections) == 1
+
+
+def test_table_models_reuse_their_connection(endpoint, new_connections, monkeypatch):
+    monkeypatch.setattr(ProductModel.Meta, "host", endpoint)
+    monkeypatch.setattr(ProductModel, "_connection", None)
+
+    ProductModel.create_table(read_capacity_units=5, write_capacity_units=5, wait=True)
+    for i in range(REQUESTS):
+        ProductModel(ean="64100000000{:02d}".format(i), name="olut").save()
+    assert ProductModel.count() == REQUESTS
+
+    assert len(new_connections) == 1
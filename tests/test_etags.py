@@ -0,0 +1,94 @@
+import pytest
+
+import endpoints.products
+import utils.http
+from models.products import ProductModel
+from utils.cache import product_cache
+
+from support import ADMIN
+
+EAN = "6410000000001"
+
+
+@pytest.fixture
+def same_second(monkeypatch):
+    """Every write lands in the same second, so updated_at cannot tell them apart."""
+    monkeypatch.setattr(endpoints.products, "time", lambda: 1700000000.0)
+
+
+@pytest.fixture
+def product(client, same_second):
+    response = client.post(
+        "/products", json={"ean": EAN, "name": "olut", "store": []}, headers=ADMIN
+    )
+    assert response.status_code == 200
+
+
+def etag(client) -> str:
+    response = client.get("/products/{}".format(EAN))
+    assert response.status_code == 200
+    return response.headers["ETag"]
+
+
+def revalidate(client, tag: str) -> int:
+    return client.get(
+        "/products/{}".format(EAN), headers={"If-None-Match": tag}
+    ).status_code
+
+
+def test_updates_within_a_second_change_the_etag(client, product):
+    first = etag(client)
+
+    response = client.put(
+        "/products/{}".format(EAN),
+        json={"ean": EAN, "name": "kalja", "store": []},
+        headers=ADMIN,
+    )
+    assert response.status_code == 200
+    second = etag(client)
+
+    assert second != first
+    assert revalidate(client, first) == 200
+    assert revalidate(client, second) == 304
+
+
+def test_batch_syncs_within_a_second_change_the_etag(client, product):
+    tags = []
+    for price in (199, 249):
+        tags.append(etag(client))
+        products = [
+            {
+                "ean": EAN,
+                "name": "olut",
+                "store": ["a"],
+                "price_data": [{"store": "a", "price": price}],
+            }
+        ]
+        assert (
+            client.post("/products/batch", json=products, headers=ADMIN).json()[
+                "written"
+            ]
+            == 1
+        )
+    tags.append(etag(client))
+
+    assert len(set(tags)) == 3
+
+
+def test_representation_version_changes_the_etag(client, product, monkeypatch):
+    before = etag(client)
+
+    monkeypatch.setattr(
+        utils.http, "REPRESENTATION_VERSION", utils.http.REPRESENTATION_VERSION + 1
+    )
+
+    assert etag(client) != before
+    assert revalidate(client, before) == 200
+
+
+def test_product_without_a_version_can_be_revalidated(client):
+    ProductModel(ean=EAN, name="olut").save()
+    tag = etag(client)
+    product_cache.clear()
+
+    assert revalidate(client, tag) == 304
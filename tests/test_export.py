@@ -0,0 +1,80 @@
+import gzip
+import hashlib
+import json
+
+import boto3
+import pytest
+
+import utils.scan
+from models.products import ProductModel
+from utils.export import export_items
+
+from support import ADMIN, ENVIRONMENT
+
+BUCKET = ENVIRONMENT["public_content_bucket_name"]
+EANS = ["641000000000{}".format(i) for i in range(1, 6)]
+
+
+@pytest.fixture
+def products(monkeypatch):
+    # moto ignores Segment, each segment of a parallel scan reads every item
+    monkeypatch.setattr(utils.scan, "scan_segments", 1)
+    for i, ean in enumerate(EANS):
+        ProductModel(
+            ean=ean, name="olut {}".format(i), price=100 + i, category="beer"
+        ).save()
+
+
+def read_object(key: str) -> bytes:
+    return boto3.client("s3").get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def assert_manifest(key: str, body: bytes) -> None:
+    manifest = json.loads(read_object("{}.manifest.json".format(key)))
+    assert manifest["item_count"] == len(EANS)
+    assert manifest["bytes"] == len(body)
+    assert manifest["sha256"] == hashlib.sha256(body).hexdigest()
+
+
+def test_export_ndjson(client, products):
+    response = client.post("/products/export", headers=ADMIN)
+
+    assert response.status_code == 200
+    assert response.json()["ok"] == len(EANS)
+    body = gzip.decompress(read_object("products.ndjson"))
+    lines = body.decode().splitlines()
+    assert sorted(json.loads(line)["ean"] for line in lines) == EANS
+    assert_manifest("products.ndjson", body)
+
+
+def test_export_json_array(client, products):
+    response = client.post("/products/export", params={"format": "json"}, headers=ADMIN)
+
+    assert response.status_code == 200
+    body = gzip.decompress(read_object("products.json"))
+    exported = json.loads(body)
+    assert sorted(product["ean"] for product in exported) == EANS
+    assert {product["name"] for product in exported} == {
+        "olut {}".format(i) for i in range(5)
+    }
+    assert_manifest("products.json", body)
+
+
+def test_failed_export_aborts_the_upload():
+    s3 = boto3.client("s3")
+
+    def items():
+        yield {"ean": EANS[0]}
+        raise RuntimeError("scan failed")
+
+    with pytest.raises(RuntimeError):
+        export_items(
+            s3,
+            BUCKET,
+            "products.ndjson",
+            items(),
+            serialize=lambda item: json.dumps(item).encode(),
+        )
+
+    assert "Uploads" not in s3.list_multipart_uploads(Bucket=BUCKET)
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET)
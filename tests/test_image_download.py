@@ -0,0 +1,203 @@
+import hashlib
+import io
+import json
+import threading
+
+import boto3
+import pytest
+import requests
+from PIL import Image
+
+from support import ENVIRONMENT, load_handler
+
+images = load_handler("image-download-handler")
+
+
+class FakeResponse:
+    def __init__(
+        self, status_code: int, content: bytes = b"", headers: dict = None
+    ) -> None:
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+def png(width: int, height: int) -> bytes:
+    body = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(body, format="PNG")
+    return body.getvalue()
+
+
+def record(
+    sequence_number: str, ean: str, photo: str, event_name: str = "INSERT"
+) -> dict:
+    return {
+        "eventName": event_name,
+        "dynamodb": {
+            "SequenceNumber": sequence_number,
+            "NewImage": {"ean": {"S": ean}, "photo": {"S": photo}},
+        },
+    }
+
+
+@pytest.fixture
+def source(monkeypatch):
+    """
+    Stands in for the image hosts. URL -> a response, an exception to raise
+    or a function of the request headers returning the response.
+    """
+    responses = {}
+    requested = []
+
+    def get(url, headers=None, timeout=None):
+        requested.append((url, headers or {}))
+        response = responses[url]
+        if isinstance(response, Exception):
+            raise response
+        if callable(response):
+            return response(headers or {})
+        return response
+
+    monkeypatch.setattr(images.requests, "get", get)
+    return {"responses": responses, "requested": requested}
+
+
+def test_failed_records_are_reported_by_sequence_number(source, monkeypatch):
+    monkeypatch.setattr(images, "image_widths", [128])
+    source["responses"].update(
+        {
+            "https://example.com/ok.png": FakeResponse(200, png(300, 300)),
+            "https://example.com/missing.png": FakeResponse(404),
+            "https://example.com/down.png": requests.ConnectionError(
+                "connection refused"
+            ),
+            "https://example.com/broken.png": FakeResponse(200, b"not an image"),
+        }
+    )
+    event = {
+        "Records": [
+            record("100", "6410000000001", "https://example.com/ok.png"),
+            record("200", "6410000000002", "https://example.com/missing.png"),
+            record("300", "6410000000003", "https://example.com/down.png"),
+            record("400", "6410000000004", "https://example.com/broken.png"),
+            # Only inserts are processed, a failing modify is not reported
+            record("500", "6410000000005", "https://example.com/missing.png", "MODIFY"),
+        ]
+    }
+
+    response = images.handler(event, None)
+
+    assert response == {
+        "batchItemFailures": [{"itemIdentifier": seq} for seq in ("200", "300", "400")]
+    }
+
+
+def test_record_that_raises_is_reported(monkeypatch):
+    def process_record(record):
+        if record["dynamodb"]["SequenceNumber"] == "200":
+            raise KeyError("NewImage")
+        return True
+
+    monkeypatch.setattr(images, "process_record", process_record)
+    event = {"Records": [record("100", "1", "a"), record("200", "2", "b")]}
+
+    assert images.handler(event, None) == {
+        "batchItemFailures": [{"itemIdentifier": "200"}]
+    }
+
+
+URL = "https://example.com/photo.png"
+
+
+def manifest(ean: str) -> dict:
+    response = boto3.client("s3").get_object(
+        Bucket=ENVIRONMENT["public_content_bucket_name"], Key=images.manifest_key(ean)
+    )
+    return json.loads(response["Body"].read())
+
+
+@pytest.fixture
+def photo(source, monkeypatch):
+    """URL serving a PNG with an ETag, answering 304 to a matching If-None-Match."""
+    monkeypatch.setattr(images, "image_widths", [128])
+    body = png(300, 300)
+
+    def respond(headers: dict) -> FakeResponse:
+        if headers.get("If-None-Match") == '"v1"':
+            return FakeResponse(304)
+        return FakeResponse(200, body, {"ETag": '"v1"'})
+
+    source["responses"][URL] = respond
+    assert images.image_download(
+        images.ImageRequest(image_url=URL, ean="6410000000001")
+    )
+    assert images.stats.snapshot() == {"encoded": 1}
+    return body
+
+
+def test_not_modified_url_copies_the_earlier_outputs(source, photo, monkeypatch):
+    def encode_outputs(*args):
+        raise AssertionError("a 304 must not encode again")
+
+    monkeypatch.setattr(images, "encode_outputs", encode_outputs)
+
+    assert images.image_download(
+        images.ImageRequest(image_url=URL, ean="6410000000002")
+    )
+
+    assert source["requested"][-1] == (URL, {"If-None-Match": '"v1"'})
+    assert len(source["requested"]) == 2
+    assert images.stats.snapshot() == {"not_modified": 1}
+    assert [
+        (v["width"], v["format"]) for v in manifest("6410000000002")["variants"]
+    ] == [(v["width"], v["format"]) for v in manifest("6410000000001")["variants"]]
+
+
+def test_not_modified_without_the_outputs_downloads_again(source, photo):
+    boto3.client("s3").delete_object(
+        Bucket=ENVIRONMENT["public_content_bucket_name"],
+        Key=images.content_record_key(hashlib.sha256(photo).hexdigest()),
+    )
+
+    assert images.image_download(
+        images.ImageRequest(image_url=URL, ean="6410000000002")
+    )
+
+    # The 304, then an unconditional request for the body
+    assert [headers for _, headers in source["requested"][1:]] == [
+        {"If-None-Match": '"v1"'},
+        {},
+    ]
+    assert images.stats.snapshot() == {"encoded": 1}
+
+
+def test_key_locks_are_dropped_when_released(photo):
+    assert images._key_locks == {}
+
+    entered = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def hold():
+        with images.key_lock("key"):
+            entered.set()
+            release.wait(5)
+            order.append("first")
+
+    def wait():
+        with images.key_lock("key"):
+            order.append("second")
+
+    first = threading.Thread(target=hold)
+    first.start()
+    entered.wait(5)
+    second = threading.Thread(target=wait)
+    second.start()
+    while images._key_locks["key"][1] < 2:
+        pass
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert order == ["first", "second"]
+    assert images._key_locks == {}
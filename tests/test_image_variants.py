@@ -0,0 +1,79 @@
+import hashlib
+import io
+import json
+
+import boto3
+import pytest
+from PIL import Image
+
+from support import ENVIRONMENT, load_handler
+
+images = load_handler("image-download-handler")
+
+
+@pytest.fixture
+def widths(monkeypatch):
+    monkeypatch.setattr(images, "image_widths", [128, 256, 512, 1080])
+
+
+def png(width: int, height: int) -> bytes:
+    body = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(body, format="PNG")
+    return body.getvalue()
+
+
+def manifest(ean: str) -> dict:
+    response = boto3.client("s3").get_object(
+        Bucket=ENVIRONMENT["public_content_bucket_name"], Key=images.manifest_key(ean)
+    )
+    return json.loads(response["Body"].read())
+
+
+@pytest.mark.parametrize(
+    "source_width, expected",
+    [
+        (300, [128, 256, 300]),
+        (512, [128, 256, 512]),
+        (2000, [128, 256, 512, 1080]),
+        (100, [100]),
+    ],
+)
+def test_variant_widths_are_never_upscaled(widths, source_width, expected):
+    assert images.variant_widths(source_width) == expected
+
+
+def test_narrow_source_gets_one_native_variant(widths):
+    assert images.encode_outputs(
+        png(300, 900), "6410000000001", "https://example.com/a.png"
+    )
+
+    variants = manifest("6410000000001")["variants"]
+    keys = [(v["width"], v["format"]) for v in variants]
+    assert len(keys) == len(set(keys))
+    assert [v["width"] for v in variants] == [
+        width for width in (128, 256, 300) for _ in images.variant_formats
+    ]
+    assert {v["format"] for v in variants} == set(images.variant_formats)
+    native = [v for v in variants if v["width"] == 300]
+    assert {v["height"] for v in native} == {900}
+    assert {v["url"] for v in native} == {
+        "/products/6410000000001/300.{}".format(fmt) for fmt in images.variant_formats
+    }
+
+
+def test_content_hit_copies_the_same_variants(widths):
+    body = png(300, 900)
+    images.encode_outputs(body, "6410000000001", "https://example.com/a.png")
+
+    assert images.copy_outputs(hashlib.sha256(body).hexdigest(), "6410000000002")
+    assert [
+        (v["width"], v["format"]) for v in manifest("6410000000002")["variants"]
+    ] == [(v["width"], v["format"]) for v in manifest("6410000000001")["variants"]]
+
+
+def test_content_record_of_another_matrix_is_a_miss(widths, monkeypatch):
+    body = png(300, 900)
+    images.encode_outputs(body, "6410000000001", "https://example.com/a.png")
+
+    monkeypatch.setattr(images, "image_widths", [128, 640])
+    assert not images.copy_outputs(hashlib.sha256(body).hexdigest(), "6410000000002")
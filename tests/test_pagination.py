@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+from pynamodb.exceptions import ScanError
+
+from models.products import ProductModel
+from utils.pagination import encode_cursor, read_page
+
+
+def seed_products(count: int, category=None) -> None:
+    with ProductModel.batch_write() as batch:
+        for i in range(count):
+            batch.save(
+                ProductModel(
+                    ean="{:013d}".format(i),
+                    name="product {}".format(i),
+                    category=category,
+                    price=i % 997,
+                    updated_at=i,
+                )
+            )
+
+
+def walk(client, url: str, page_size: int) -> list:
+    eans = []
+    cursor = None
+    while True:
+        params = {"page_size": page_size, "fields": "ean"}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = client.get(url, params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= page_size
+        eans.extend(item["ean"] for item in page["items"])
+        cursor = page["cursor"]
+        if cursor is None:
+            return eans
+
+
+def test_pages_through_10k_products_once(client):
+    seed_products(10_000)
+
+    eans = walk(client, "/products", page_size=100)
+
+    assert len(eans) == 10_000
+    assert set(eans) == {"{:013d}".format(i) for i in range(10_000)}
+
+
+@pytest.mark.parametrize("sort", ["price", "updated_at"])
+def test_pages_through_category_index_once(client, sort):
+    seed_products(250, category="beer")
+
+    eans = walk(client, "/products?category=beer&sort={}".format(sort), page_size=40)
+
+    assert sorted(eans) == ["{:013d}".format(i) for i in range(250)]
+
+
+def forged_cursor(key: dict, secret: str, scope: str = "products") -> str:
+    payload = json.dumps(key).encode()
+    signature = hmac.new(
+        secret.encode(), scope.encode() + b"\0" + payload, hashlib.sha256
+    )
+    return base64.urlsafe_b64encode(signature.digest()[:16] + payload).decode()
+
+
+def test_rejects_cursor_signed_with_another_key(client):
+    # The user pool client id used to be the fallback key
+    cursor = forged_cursor({"ean": {"S": "1"}}, "test-client")
+
+    response = client.get("/products", params={"cursor": cursor})
+
+    assert response.status_code == 400
+
+
+def test_rejects_cursor_for_another_query(client):
+    cursor = encode_cursor({"ean": {"S": "1"}}, "rankings:")
+
+    response = client.get("/products", params={"cursor": cursor})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "key", [{"ean": "1"}, ["ean"], {"ean": {"S": 1}}, {"ean": {"M": {}}}]
+)
+def test_rejects_signed_cursor_that_is_not_a_key(client, key):
+    response = client.get(
+        "/products", params={"cursor": encode_cursor(key, "products")}
+    )
+
+    assert response.status_code == 400
+
+
+def test_start_key_rejected_by_dynamodb_is_a_bad_request():
+    error = ClientError(
+        {
+            "Error": {
+                "Code": "ValidationException",
+                "Message": "The provided starting key is invalid",
+            }
+        },
+        "Scan",
+    )
+
+    def results():
+        raise ScanError("Failed to scan", error)
+        yield
+
+    with pytest.raises(HTTPException) as e:
+        read_page(results(), "cursor")
+    assert e.value.status_code == 400
+
+    # Without a cursor the request itself was fine, so it stays a server error
+    with pytest.raises(ScanError):
+        read_page(results(), None)
@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import endpoints.products
+from models.pricehistory import ROLLUP_PREFIX, PriceHistoryModel
+
+from support import ADMIN
+
+START = datetime(2024, 3, 1, 6)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Sets the time the products endpoints see."""
+    now = {"value": START}
+    monkeypatch.setattr(endpoints.products, "time", lambda: now["value"].timestamp())
+
+    def set_time(value: datetime) -> None:
+        now["value"] = value
+
+    return set_time
+
+
+def sync(client, prices: dict) -> None:
+    products = [
+        {
+            "ean": "6410000000001",
+            "name": "olut",
+            "store": list(prices),
+            "price_data": [
+                {"store": store, "price": price} for store, price in prices.items()
+            ],
+        }
+    ]
+    response = client.post("/products/batch", json=products, headers=ADMIN)
+    assert response.status_code == 200
+    assert response.json()["failed"] == 0
+
+
+def daily_rows(ean: str = "6410000000001"):
+    return [
+        row
+        for row in PriceHistoryModel.query(ean)
+        if not row.sk.startswith(ROLLUP_PREFIX)
+    ]
+
+
+def test_month_of_repeated_syncs_writes_a_row_per_price_change(client, clock):
+    for day in range(30):
+        for sync_hour in range(0, 24, 6):
+            clock(START + timedelta(days=day, hours=sync_hour))
+            # Store "a" changes price on day 10 and back on day 20, "b" never does
+            sync(client, {"a": 250 if 10 <= day < 20 else 199, "b": 300})
+
+    rows = daily_rows()
+
+    assert [(row.sk, row.price) for row in rows] == [
+        ("2024-03-01-a", 199),
+        ("2024-03-01-b", 300),
+        ("2024-03-11-a", 250),
+        ("2024-03-21-a", 199),
+    ]
+    # Stamped with the sync that saw the change, not the first sync of the day
+    assert rows[2].created_at == (START + timedelta(days=10)).timestamp()
+
+
+def test_new_store_gets_a_row_without_repeating_the_others(client, clock):
+    sync(client, {"a": 199})
+    clock(START + timedelta(days=1))
+    sync(client, {"a": 199, "b": 300})
+
+    assert [row.sk for row in daily_rows()] == ["2024-03-01-a", "2024-03-02-b"]
+
+
+def stats(client, interval: str) -> dict:
+    response = client.get("/prices/6410000000001/stats", params={"interval": interval})
+    assert response.status_code == 200
+    return {
+        store: {key: value for key, value in summary.items() if key != "series"}
+        for store, summary in response.json()["stores"].items()
+    }
+
+
+def test_monthly_rollup_agrees_with_daily_rows_after_same_day_changes(client, clock):
+    for hour, price in enumerate([100, 200, 100]):
+        clock(START + timedelta(hours=hour))
+        sync(client, {"a": price})
+
+    assert stats(client, "day") == {
+        "a": {"min": 100, "max": 100, "mean": 100, "count": 1}
+    }
+    assert stats(client, "month") == stats(client, "day")
+
+
+def test_monthly_rollup_agrees_with_daily_rows_over_a_month(client, clock):
+    for day in range(30):
+        clock(START + timedelta(days=day))
+        sync(client, {"a": 100 + day % 7 * 10, "b": 300 if day < 15 else 280})
+        clock(START + timedelta(days=day, hours=12))
+        sync(client, {"a": 105 + day % 5 * 10, "b": 300 if day < 15 else 280})
+
+    assert stats(client, "month") == stats(client, "day")
+
+
+def test_overlapping_syncs_do_not_lose_rollup_updates(client, clock, monkeypatch):
+    import utils.pricehistory
+
+    sync(client, {"a": 100})
+
+    # Another sync writes a new day and finishes its rollup while this
+    # one is between reading the month and writing the rollup
+    rows_by_store = utils.pricehistory.daily_rows_by_store
+    interleaved = []
+
+    def daily_rows_with_concurrent_sync(ean, month):
+        rows = rows_by_store(ean, month)
+        if not interleaved:
+            interleaved.append(True)
+            clock(START + timedelta(days=2))
+            sync(client, {"a": 300})
+        return rows
+
+    monkeypatch.setattr(
+        utils.pricehistory, "daily_rows_by_store", daily_rows_with_concurrent_sync
+    )
+    clock(START + timedelta(days=1))
+    sync(client, {"a": 200})
+
+    assert interleaved
+    assert stats(client, "month") == {
+        "a": {"min": 100, "max": 300, "mean": 200, "count": 3}
+    }
+
+
+def test_new_product_listed_twice_in_one_batch_gets_history(client, clock):
+    product = {
+        "ean": "6410000000002",
+        "name": "siideri",
+        "store": ["a"],
+        "price_data": [{"store": "a", "price": 349}],
+    }
+
+    response = client.post("/products/batch", json=[product, product], headers=ADMIN)
+
+    assert response.status_code == 200
+    assert [(row.sk, row.price) for row in daily_rows("6410000000002")] == [
+        ("2024-03-01-a", 349)
+    ]
@@ -0,0 +1,41 @@
+from models.products import ProductModel
+from utils.cache import LRUCache, product_cache
+
+from support import ADMIN, emf_records
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 2, "misses": 1}
+
+
+def test_product_reads_are_served_from_cache(client, capsys):
+    ProductModel(ean="1", name="olut").save()
+
+    client.get("/products/1")
+    client.get("/products/1")
+
+    first, second = emf_records(capsys.readouterr().out)
+    assert first["DynamoDBCalls"] > 0
+    assert second["DynamoDBCalls"] == 0
+    assert second["product_cache"]["hits"] == first["product_cache"]["hits"] + 1
+
+
+def test_update_evicts_cached_product(client):
+    ProductModel(ean="1", name="olut").save()
+    assert client.get("/products/1").json()["name"] == "olut"
+
+    response = client.put(
+        "/products/1", json={"ean": "1", "name": "kalja", "store": []}, headers=ADMIN
+    )
+    assert response.status_code == 200
+
+    assert client.get("/products/1").json()["name"] == "kalja"
+    assert product_cache.stats()["size"] == 1
@@ -0,0 +1,97 @@
+import pytest
+
+import utils.scan
+from models.products import NutrientsModel, ProductModel
+from models.ratings import RatingModel
+
+from support import ADMIN, emf_records
+
+EAN = "6410000000001"
+LONG_TEXT = "Maltainen ja humalainen, pitkä kuvaus. " * 20
+
+
+@pytest.fixture
+def product():
+    ProductModel(
+        ean=EAN,
+        name="olut",
+        price=199,
+        category="beer",
+        stars={"one": 0, "two": 0, "three": 1, "four": 0, "five": 0},
+        description_fi=LONG_TEXT,
+        description_sv=LONG_TEXT,
+        description_en=LONG_TEXT,
+        ingredients_fi=LONG_TEXT,
+        nutrients=[
+            NutrientsModel(name="energia", value="{} kJ".format(i)) for i in range(20)
+        ],
+        updated_at=1,
+    ).save()
+    RatingModel(
+        ean=EAN, userId="user", username="user", rating=3, comment="hyvää", created_at=1
+    ).save()
+
+
+def read(client, capsys, url: str, **params):
+    capsys.readouterr()
+    response = client.get(url, params=params, headers=ADMIN)
+    assert response.status_code == 200
+    (record,) = emf_records(capsys.readouterr().out)
+    return response, record
+
+
+def test_projected_product_read_is_smaller_and_skips_ratings(client, capsys, product):
+    projected, projected_record = read(
+        client, capsys, "/products/{}".format(EAN), fields="name,price"
+    )
+    full, full_record = read(client, capsys, "/products/{}".format(EAN))
+
+    assert projected.json() == {"ean": EAN, "name": "olut", "price": 199}
+    assert len(projected.content) * 10 < len(full.content)
+    # Only the GetItem, full reads also query the latest ratings
+    assert list(projected_record["calls"]) == ["dynamodb.GetItem"]
+    assert "dynamodb.Query" in full_record["calls"]
+    assert projected_record["ConsumedCapacity"] < full_record["ConsumedCapacity"]
+
+
+def test_product_read_can_ask_for_ratings(client, product):
+    response = client.get("/products/{}".format(EAN), params={"fields": "name,ratings"})
+
+    assert response.status_code == 200
+    assert set(response.json()) == {"ean", "name", "ratings"}
+    assert [r["comment"] for r in response.json()["ratings"]] == ["hyvää"]
+
+
+@pytest.fixture
+def one_segment(monkeypatch):
+    # moto ignores Segment, each segment of a parallel scan reads every item
+    monkeypatch.setattr(utils.scan, "scan_segments", 1)
+
+
+@pytest.mark.parametrize("url", ["/products", "/products/scan"])
+def test_projected_list_reads_are_smaller(client, capsys, product, one_segment, url):
+    projected, projected_record = read(client, capsys, url, fields="name,price")
+    full, full_record = read(client, capsys, url)
+
+    items = projected.json()["items"] if url == "/products" else projected.json()
+    assert items == [{"ean": EAN, "name": "olut", "price": 199}]
+    assert len(projected.content) * 10 < len(full.content)
+    # DynamoDB charges a scan or query by the items read, not the attributes
+    # returned, so projection saves transfer and decoding only
+    assert projected_record["ConsumedCapacity"] <= full_record["ConsumedCapacity"]
+
+
+@pytest.mark.parametrize("url", ["/products", "/products/scan"])
+def test_list_reads_reject_ratings(client, product, url):
+    response = client.get(url, params={"fields": "name,ratings"}, headers=ADMIN)
+
+    assert response.status_code == 400
+
+
+def test_unknown_fields_are_rejected(client, product):
+    response = client.get(
+        "/products/{}".format(EAN), params={"fields": "name,stars_seq"}
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown fields: stars_seq"
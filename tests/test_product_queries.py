@@ -0,0 +1,69 @@
+import pytest
+
+from models.products import ProductModel
+
+from support import emf_records
+
+
+def seed_category(category: str, count: int, offset: int = 0) -> None:
+    with ProductModel.batch_write() as batch:
+        for i in range(offset, offset + count):
+            batch.save(
+                ProductModel(
+                    ean="{:013d}".format(i),
+                    name="product {}".format(i),
+                    category=category,
+                    price=1000 - i % 1000,
+                    updated_at=i,
+                )
+            )
+
+
+def read_page(client, capsys, **params):
+    capsys.readouterr()
+    response = client.get("/products", params=params)
+    assert response.status_code == 200
+    (record,) = emf_records(capsys.readouterr().out)
+    return response.json(), record
+
+
+@pytest.mark.parametrize("sort", ["price", "updated_at"])
+def test_category_page_reads_scale_with_page_size_not_table_size(client, capsys, sort):
+    seed_category("beer", 50)
+    small, small_record = read_page(
+        client, capsys, category="beer", sort=sort, page_size=10
+    )
+
+    # Ten times the category, plus products of other categories
+    seed_category("beer", 450, offset=50)
+    seed_category("cider", 500, offset=500)
+    large, large_record = read_page(
+        client, capsys, category="beer", sort=sort, page_size=10
+    )
+
+    assert len(small["items"]) == len(large["items"]) == 10
+    assert {item["category"] for item in large["items"]} == {"beer"}
+    # One key-condition query per page, never a scan. moto charges a flat
+    # unit per request, so equal capacity means equal requests here.
+    for record in (small_record, large_record):
+        assert list(record["calls"]) == ["dynamodb.Query"]
+        assert record["calls"]["dynamodb.Query"]["count"] == 1
+    assert small_record["ConsumedCapacity"] == large_record["ConsumedCapacity"]
+
+
+def test_category_pages_are_sorted(client):
+    seed_category("beer", 30)
+
+    prices = [
+        item["price"]
+        for item in client.get(
+            "/products", params={"category": "beer", "sort": "price", "order": "asc"}
+        ).json()["items"]
+    ]
+    assert prices == sorted(prices)
+
+    updated = [
+        item["updated_at"]
+        for item in client.get("/products", params={"category": "beer"}).json()["items"]
+    ]
+    assert updated == sorted(updated, reverse=True)
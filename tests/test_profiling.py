@@ -0,0 +1,102 @@
+import time
+
+import boto3
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils import profiling
+from utils.auth import auth
+
+from support import ADMIN, ENVIRONMENT, bearer, fake_verify
+
+PROFILE = {"X-Profile": "1"}
+
+
+@pytest.fixture
+def calls():
+    return []
+
+
+@pytest.fixture
+def profiled(calls, monkeypatch, tmp_path):
+    """An app with only the profiling middleware, writing profiles to tmp_path."""
+    monkeypatch.setattr(auth, "verify", fake_verify)
+    monkeypatch.setattr(profiling, "profile_path", str(tmp_path))
+    monkeypatch.setattr(profiling, "profile_bucket_name", None)
+
+    app = FastAPI()
+    profiling.install(app)
+
+    @app.get("/work")
+    def work():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"ok": True}
+
+    return TestClient(app)
+
+
+def test_request_without_the_header_is_not_profiled(profiled, calls, monkeypatch):
+    def sampler(interval):
+        raise AssertionError("sampled a request without X-Profile")
+
+    monkeypatch.setattr(profiling, "Sampler", sampler)
+
+    response = profiled.get("/work", headers=ADMIN)
+
+    assert response.status_code == 200
+    assert "X-Profile-Location" not in response.headers
+    assert calls == [1]
+
+
+@pytest.mark.parametrize(
+    "headers, status_code",
+    [
+        (PROFILE, 401),
+        (dict(PROFILE, Authorization="Basic dXNlcjpwYXNz"), 401),
+        (dict(PROFILE, **bearer("user")), 403),
+    ],
+)
+def test_profiling_needs_an_admin_token(profiled, calls, headers, status_code):
+    response = profiled.get("/work", headers=headers)
+
+    assert response.status_code == status_code
+    assert "X-Profile-Location" not in response.headers
+    assert calls == []
+
+
+def test_admin_request_is_profiled_to_files(profiled, tmp_path):
+    response = profiled.get("/work", headers=dict(PROFILE, **ADMIN))
+
+    assert response.status_code == 200
+    assert response.json() == {"ok": True}
+    collapsed = response.headers["X-Profile-Location"]
+    summary = response.headers["X-Profile-Summary"]
+    assert collapsed.startswith(str(tmp_path)) and collapsed.endswith(".collapsed")
+    assert summary.startswith(str(tmp_path)) and summary.endswith(".txt")
+
+    with open(collapsed) as f:
+        # The route's time.sleep shows up under its own frame
+        assert "test_profiling.py:work" in f.read()
+    with open(summary) as f:
+        assert f.readline() == "GET /work\n"
+
+
+def test_admin_request_is_profiled_to_the_bucket(profiled, monkeypatch):
+    bucket = ENVIRONMENT["public_content_bucket_name"]
+    monkeypatch.setattr(profiling, "profile_bucket_name", bucket)
+
+    response = profiled.get("/work", headers=dict(PROFILE, **ADMIN))
+
+    assert response.status_code == 200
+    s3 = boto3.client("s3")
+    for header, suffix in (
+        ("X-Profile-Location", ".collapsed"),
+        ("X-Profile-Summary", ".txt"),
+    ):
+        location = response.headers[header]
+        prefix = "s3://{}/profiles/".format(bucket)
+        assert location.startswith(prefix) and location.endswith(suffix)
+        key = location[len("s3://{}/".format(bucket)) :]
+        assert s3.get_object(Bucket=bucket, Key=key)["Body"].read()
@@ -0,0 +1,90 @@
+import pytest
+
+import utils.scan
+from models.products import ProductModel, StarsModel
+
+from support import ADMIN, bearer
+
+NO_STARS = {"one": 0, "two": 0, "three": 0, "four": 0, "five": 0}
+
+
+@pytest.fixture
+def legacy_products(monkeypatch):
+    """Products written before rankings: stars but no score or rank_partition."""
+    # moto ignores Segment, each segment of a parallel scan reads every item
+    monkeypatch.setattr(utils.scan, "scan_segments", 1)
+    for ean, category, stars in [
+        ("6410000000001", "beer", dict(NO_STARS, five=3)),
+        ("6410000000002", "beer", dict(NO_STARS, one=2)),
+        ("6410000000003", "beer", NO_STARS),
+        ("6410000000004", "cider", dict(NO_STARS, four=5)),
+    ]:
+        ProductModel(
+            ean=ean, name=ean, category=category, stars=StarsModel(**stars)
+        ).save()
+
+
+def rankings(client, **params) -> list:
+    response = client.get("/rankings", params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_backfill_ranks_legacy_products(client, legacy_products):
+    assert rankings(client)["items"] == []
+
+    response = client.post("/rankings/backfill", headers=ADMIN)
+
+    assert response.json() == {"ok": 4, "conflicts": 0}
+    items = rankings(client)["items"]
+    assert [item["ean"] for item in items] == [
+        "6410000000001",
+        "6410000000004",
+        "6410000000003",
+        "6410000000002",
+    ]
+    # Three five-star ratings against the prior of ten three-star ratings
+    assert items[0]["score"] == pytest.approx(45 / 13, abs=1e-6)
+    assert items[2]["score"] == 3.0
+
+    assert client.post("/rankings/backfill", headers=ADMIN).json() == {
+        "ok": 0,
+        "conflicts": 0,
+    }
+
+
+def test_category_rankings_are_paged(client, legacy_products):
+    client.post("/rankings/backfill", headers=ADMIN)
+
+    first = rankings(client, category="beer", limit=2)
+    second = rankings(client, category="beer", limit=2, cursor=first["cursor"])
+
+    assert [item["ean"] for item in first["items"] + second["items"]] == [
+        "6410000000001",
+        "6410000000003",
+        "6410000000002",
+    ]
+    assert second["cursor"] is None
+
+
+def test_backfill_is_admin_only(client, legacy_products):
+    response = client.post("/rankings/backfill", headers=bearer("user"))
+
+    assert response.status_code == 403
+    assert rankings(client)["items"] == []
+
+
+def test_batch_sync_scores_legacy_products_from_their_stars(client, legacy_products):
+    product = {
+        "ean": "6410000000001",
+        "name": "renamed",
+        "category": "beer",
+        "store": [],
+    }
+
+    response = client.post("/products/batch", json=[product], headers=ADMIN)
+
+    assert response.json()["written"] == 1
+    (item,) = rankings(client)["items"]
+    assert item["ean"] == "6410000000001"
+    assert item["score"] == pytest.approx(45 / 13, abs=1e-6)
@@ -0,0 +1,208 @@
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pynamodb.exceptions import TransactWriteError, VerboseClientError
+
+import endpoints.ratings
+from models.products import ProductModel
+from models.ratings import RatingModel
+from models.users import UserModel
+from utils.ranking import STAR_VALUES, bayesian_score
+
+from support import bearer
+
+EAN = "6410000000001"
+STAR_NAMES = {value: name for name, value in STAR_VALUES.items()}
+
+
+@pytest.fixture
+def product(client):
+    response = client.post(
+        "/products",
+        json={"ean": EAN, "name": "olut", "store": []},
+        headers=bearer("admin", "Admin"),
+    )
+    assert response.status_code == 200
+
+
+def create_users(count: int) -> list:
+    users = ["user-{}".format(i) for i in range(count)]
+    with UserModel.batch_write() as batch:
+        for user in users:
+            batch.save(
+                UserModel(userId=user, username=user, email="", profileImgUrl="")
+            )
+    return users
+
+
+def rate(client, user: str, rating: int, ean: str = EAN) -> int:
+    return client.post(
+        "/ratings/{}".format(ean), json={"rating": rating}, headers=bearer(user)
+    ).status_code
+
+
+def assert_counters_match_ratings(ean: str = EAN) -> None:
+    product = ProductModel.get(ean)
+    stars = {name: getattr(product.stars, name) for name in STAR_VALUES}
+    ratings = Counter(STAR_NAMES[r.rating] for r in RatingModel.query(ean))
+
+    assert stars == {name: ratings[name] for name in STAR_VALUES}
+    assert product.score == bayesian_score(product.stars)
+
+
+def test_rating_moves_counters_between_buckets(client, product):
+    (user,) = create_users(1)
+
+    assert rate(client, user, 5) == 204
+    assert rate(client, user, 3) == 204
+
+    assert_counters_match_ratings()
+    assert ProductModel.get(EAN).stars.three == 1
+
+
+def test_rating_unknown_product_is_not_found(client, product):
+    (user,) = create_users(1)
+
+    assert rate(client, user, 5, ean="404") == 404
+
+
+def test_interleaved_ratings_by_different_users_keep_the_score(
+    client, product, monkeypatch
+):
+    first, second = create_users(2)
+
+    # The second user's request reads the product, then the first user's
+    # rating lands before the second one writes
+    read_rating_state = endpoints.ratings.read_rating_state
+    calls = []
+
+    def read_then_interleave(ean, user_id):
+        state = read_rating_state(ean, user_id)
+        calls.append(user_id)
+        if calls == [second]:
+            assert rate(client, first, 5) == 204
+        return state
+
+    monkeypatch.setattr(endpoints.ratings, "read_rating_state", read_then_interleave)
+
+    assert rate(client, second, 5) == 204
+
+    # Lost the race once, then retried from a fresh read
+    assert calls == [second, first, second]
+    assert_counters_match_ratings()
+    assert ProductModel.get(EAN).score == pytest.approx(3.333333)
+
+
+def test_parallel_re_ratings_keep_counters_consistent(client, product):
+    users = create_users(25)
+    random.seed(7)
+    requests = [(random.choice(users), random.randint(1, 5)) for _ in range(300)]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        statuses = Counter(executor.map(lambda r: rate(client, *r), requests))
+
+    # 409 is the documented answer when every attempt lost a race, and
+    # such a request changes nothing
+    assert set(statuses) <= {204, 409}
+    assert statuses[204] > 0
+    assert_counters_match_ratings()
+
+
+def transaction_error(code: str, message: str) -> TransactWriteError:
+    cause = VerboseClientError(
+        {"Error": {"Code": code, "Message": message}}, "TransactWriteItems"
+    )
+    return TransactWriteError("Failed to write transaction items", cause=cause)
+
+
+CANCELLED = (
+    "Transaction cancelled, please refer cancellation reasons for specific reasons [{}]"
+)
+
+
+@pytest.mark.parametrize(
+    "code, message, lost_race",
+    [
+        (
+            "TransactionCanceledException",
+            CANCELLED.format("None, ConditionalCheckFailed"),
+            True,
+        ),
+        (
+            "TransactionCanceledException",
+            CANCELLED.format("TransactionConflict, None"),
+            True,
+        ),
+        (
+            "TransactionCanceledException",
+            CANCELLED.format("ThrottlingError, None"),
+            False,
+        ),
+        (
+            "TransactionCanceledException",
+            CANCELLED.format("ConditionalCheckFailed, ValidationError"),
+            False,
+        ),
+        (
+            "ValidationException",
+            "Item size has exceeded the maximum allowed size",
+            False,
+        ),
+        ("ProvisionedThroughputExceededException", "Rate exceeded", False),
+    ],
+)
+def test_only_condition_failures_count_as_lost_races(code, message, lost_race):
+    assert endpoints.ratings.lost_race(transaction_error(code, message)) is lost_race
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(endpoints.ratings, "sleep", sleeps.append)
+    return sleeps
+
+
+def failing_write(error: TransactWriteError, calls: list):
+    def write_rating(*args):
+        calls.append(args)
+        raise error
+
+    return write_rating
+
+
+def test_every_attempt_losing_a_race_is_a_conflict(
+    client, product, monkeypatch, sleeps
+):
+    (user,) = create_users(1)
+    calls = []
+    error = transaction_error(
+        "TransactionCanceledException", CANCELLED.format("None, ConditionalCheckFailed")
+    )
+    monkeypatch.setattr(endpoints.ratings, "write_rating", failing_write(error, calls))
+
+    assert rate(client, user, 5) == 409
+
+    assert len(calls) == endpoints.ratings.RATING_WRITE_ATTEMPTS
+    # Jittered, growing waits between the attempts, none after the last one
+    assert len(sleeps) == endpoints.ratings.RATING_WRITE_ATTEMPTS - 1
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay <= endpoints.ratings.RATING_RETRY_BASE_DELAY * 2**attempt
+
+
+def test_other_write_errors_are_not_retried_as_conflicts(
+    client, product, monkeypatch, sleeps
+):
+    (user,) = create_users(1)
+    calls = []
+    error = transaction_error(
+        "ValidationException", "Item size has exceeded the maximum allowed size"
+    )
+    monkeypatch.setattr(endpoints.ratings, "write_rating", failing_write(error, calls))
+
+    with pytest.raises(TransactWriteError):
+        rate(client, user, 5)
+
+    assert len(calls) == 1
+    assert sleeps == []
@@ -0,0 +1,35 @@
+import boto3
+import pytest
+from botocore.config import Config
+from botocore.exceptions import EndpointConnectionError
+
+from utils import instrumentation
+
+from support import ENVIRONMENT
+
+
+def refuse_connection(request, **kwargs):
+    raise EndpointConnectionError(endpoint_url=request.url)
+
+
+def test_calls_that_never_get_a_response_are_timed():
+    client = boto3.client(
+        "s3",
+        region_name=ENVIRONMENT["region"],
+        config=Config(retries={"max_attempts": 1}),
+    )
+    instrumentation.instrument_client(client)
+    client.meta.events.register_first("before-send", refuse_connection)
+
+    metrics = instrumentation.RequestMetrics()
+    token = instrumentation._current.set(metrics)
+    try:
+        with pytest.raises(EndpointConnectionError):
+            client.head_object(
+                Bucket=ENVIRONMENT["public_content_bucket_name"], Key="missing"
+            )
+    finally:
+        instrumentation._current.reset(token)
+
+    assert metrics.calls["s3.HeadObject"][0] == 1
+    assert "s3" in metrics.segments
@@ -0,0 +1,62 @@
+import threading
+from time import sleep
+
+import pytest
+
+from utils.scan import parallel_scan
+
+
+class FakeModel:
+    """A model whose scan yields `per_segment` numbered items for each segment."""
+
+    def __init__(self, per_segment: int, fail_segment=None) -> None:
+        self.per_segment = per_segment
+        self.fail_segment = fail_segment
+        self.calls = []
+        self.produced = 0
+        self._lock = threading.Lock()
+
+    def scan(self, segment: int, total_segments: int, **kwargs):
+        self.calls.append((segment, total_segments, kwargs))
+        for i in range(self.per_segment):
+            if segment == self.fail_segment and i == 10:
+                raise RuntimeError("segment {} failed".format(segment))
+            with self._lock:
+                self.produced += 1
+            yield (segment, i)
+
+
+def test_every_segment_is_scanned_once():
+    model = FakeModel(per_segment=50)
+
+    items = list(parallel_scan(model, total_segments=4, attributes_to_get=["ean"]))
+
+    assert sorted(items) == [(s, i) for s in range(4) for i in range(50)]
+    assert sorted(model.calls) == [
+        (segment, 4, {"attributes_to_get": ["ean"]}) for segment in range(4)
+    ]
+
+
+def test_slow_consumer_bounds_the_buffer():
+    model = FakeModel(per_segment=5000)
+    scan = parallel_scan(model, total_segments=2)
+
+    next(scan)
+    sleep(0.5)
+    # The segments block on the full hand-off queue instead of reading ahead
+    assert model.produced <= 1000 + 2 + 1
+
+    # Closing the scan early releases the blocked segment threads
+    scan.close()
+    assert model.produced < 2 * 5000
+
+
+def test_segment_error_reaches_the_consumer():
+    model = FakeModel(per_segment=5000, fail_segment=1)
+
+    with pytest.raises(RuntimeError, match="segment 1 failed"):
+        for _ in parallel_scan(model, total_segments=3):
+            pass
+
+    # The other segments stop instead of reading the rest of the table
+    assert model.produced < 2 * 5000 + 10
@@ -0,0 +1,164 @@
+import pytest
+
+import endpoints.search
+import utils.scan
+from models.products import ProductModel
+from utils.search import SearchIndex, build_index, tokenize, within_distance
+
+from support import ADMIN
+
+PRODUCTS = [
+    ProductModel(
+        ean="6410000000001",
+        name="Karhu III",
+        name_fi="Karhu olut",
+        name_sv="Karhu öl",
+        description_fi="Täyteläinen lager panimolta",
+        description_sv="Fyllig lager från bryggeriet",
+        category="beer",
+        score=3.2,
+    ),
+    ProductModel(
+        ean="6410000000002",
+        name="Sandels",
+        description_fi="Kevyt olut",
+        category="beer",
+        score=3.5,
+    ),
+    ProductModel(
+        ean="6410000000003",
+        name="Lonkero Greippi",
+        description_en="Grapefruit flavoured long drink",
+        category="long drink",
+        score=None,
+    ),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "products.idx")
+    assert build_index(iter(PRODUCTS), path) == len(PRODUCTS)
+    index = SearchIndex(path)
+    yield index
+    index.close()
+
+
+def eans(results: list) -> list:
+    return [result["ean"] for result in results]
+
+
+@pytest.mark.parametrize(
+    "text, lang, expected",
+    [
+        ("Oluessa ja PANIMOLTA", "fi", ["olue", "panimo"]),
+        ("Äyräpää", "fi", ["ayrapaa"]),
+        ("Fyllig öl från bryggerierna", "sv", ["fyllig", "ol", "fran", "bryggeri"]),
+        ("Flavoured drinks and the lager", "en", ["flavour", "drink", "lager"]),
+        (None, "fi", []),
+    ],
+)
+def test_tokenize_stems_folds_and_drops_stopwords(text, lang, expected):
+    assert tokenize(text, lang) == expected
+
+
+@pytest.mark.parametrize(
+    "a, b, max_distance, expected",
+    [
+        ("lager", "lager", 0, True),
+        ("lager", "lagr", 1, True),
+        ("stout", "stoat", 1, True),
+        ("lager", "lgaer", 1, False),
+        ("lager", "lgaer", 2, True),
+        ("ipa", "porter", 2, False),
+    ],
+)
+def test_within_distance(a, b, max_distance, expected):
+    assert within_distance(a, b, max_distance) is expected
+
+
+def test_stemmed_and_folded_words_match(index):
+    assert eans(index.search("panimo", "fi", 10)) == ["6410000000001"]
+    assert eans(index.search("taytelainen", "fi", 10)) == ["6410000000001"]
+    assert eans(index.search("bryggerierna", "sv", 10)) == ["6410000000001"]
+
+
+def test_exact_matches_rank_first_then_by_score(index):
+    # Both beers say "olut", Sandels has the higher score
+    assert eans(index.search("olut", "fi", 10)) == ["6410000000002", "6410000000001"]
+    assert eans(index.search("olut", "fi", 1)) == ["6410000000002"]
+
+
+def test_prefix_matches(index):
+    (result,) = index.search("grei", "en", 10)
+
+    assert result["ean"] == "6410000000003"
+    assert result["relevance"] == 0.8
+
+
+def test_typos_are_corrected_except_in_the_first_letter(index):
+    (result,) = index.search("sandelz", "fi", 10)
+    assert result["ean"] == "6410000000002"
+    assert result["relevance"] == 0.5
+
+    assert index.search("zandels", "fi", 10) == []
+
+
+def test_every_query_word_has_to_match(index):
+    assert eans(index.search("karhu lager", "fi", 10)) == ["6410000000001"]
+    assert index.search("karhu greippi", "fi", 10) == []
+    assert index.search("ja", "fi", 10) == []
+
+
+def test_documents_come_from_the_mapped_file(index, tmp_path):
+    (result,) = index.search("6410000000003", "sv", 10)
+
+    assert result == {
+        "ean": "6410000000003",
+        "name": "Lonkero Greippi",
+        "name_fi": None,
+        "name_sv": None,
+        "name_en": None,
+        "photo": None,
+        "price": None,
+        "category": "long drink",
+        "score": None,
+        "relevance": 1.0,
+    }
+
+    # A rebuilt index is read from the new file
+    path = str(tmp_path / "rebuilt.idx")
+    build_index(PRODUCTS[:1], path)
+    rebuilt = SearchIndex(path)
+    try:
+        assert eans(rebuilt.search("olut", "fi", 10)) == ["6410000000001"]
+    finally:
+        rebuilt.close()
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "products.idx"
+    path.write_bytes(b"not an index")
+
+    with pytest.raises(ValueError):
+        SearchIndex(str(path))
+
+
+def test_index_is_built_and_served_through_s3(client, tmp_path, monkeypatch):
+    # moto ignores Segment, each segment of a parallel scan reads every item
+    monkeypatch.setattr(utils.scan, "scan_segments", 1)
+    monkeypatch.setattr(
+        endpoints.search, "search_index_path", str(tmp_path / "build.idx")
+    )
+    monkeypatch.setattr(
+        endpoints.search.search_index, "path", str(tmp_path / "products.idx")
+    )
+    monkeypatch.setattr(endpoints.search.search_index, "_index", None)
+    for product in PRODUCTS:
+        product.save()
+
+    assert client.post("/products/search/index", headers=ADMIN).json() == {"ok": 3}
+    response = client.get("/products/search", params={"q": "greippi", "lang": "fi"})
+
+    assert response.status_code == 200
+    assert eans(response.json()["items"]) == ["6410000000003"]
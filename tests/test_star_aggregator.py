@@ -0,0 +1,129 @@
+import pytest
+
+import endpoints.products
+import endpoints.ratings
+from models.products import ProductModel
+
+from support import ADMIN, bearer, load_handler
+
+from test_ratings import EAN, create_users, rate
+
+aggregator = load_handler("star-aggregator")
+
+
+@pytest.fixture
+def stream_mode(monkeypatch):
+    monkeypatch.setattr(aggregator, "star_aggregation", "stream")
+    monkeypatch.setattr(endpoints.ratings, "star_aggregation", "stream")
+
+
+@pytest.fixture
+def product(client):
+    sync_product(client, "olut")
+
+
+def sync_product(client, name: str) -> None:
+    response = client.post(
+        "/products/batch", json=[{"ean": EAN, "name": name, "store": []}], headers=ADMIN
+    )
+    assert response.status_code == 200
+    assert response.json()["failed"] == 0
+
+
+def record(sequence: int, old: int = None, new: int = None, ean: str = EAN) -> dict:
+    """A rating table stream record changing a rating from `old` to `new`."""
+    change = {"Keys": {"ean": {"S": ean}}, "SequenceNumber": str(sequence)}
+    if old is not None:
+        change["OldImage"] = {"rating": {"N": str(old)}}
+    if new is not None:
+        change["NewImage"] = {"rating": {"N": str(new)}}
+    return {"eventName": "MODIFY" if old and new else "INSERT", "dynamodb": change}
+
+
+def stars(ean: str = EAN) -> dict:
+    counts = ProductModel.get(ean).stars
+    return {
+        name: getattr(counts, name) for name in ("one", "two", "three", "four", "five")
+    }
+
+
+UNRATED = {"one": 0, "two": 0, "three": 0, "four": 0, "five": 0}
+
+
+def test_replayed_batch_after_product_sync_is_not_double_counted(
+    client, product, stream_mode
+):
+    batch = {"Records": [record(1, new=3), record(2, new=4)]}
+
+    assert aggregator.handler(batch, None) == {"records": 2, "writes": 1}
+    assert stars() == dict(UNRATED, three=1, four=1)
+
+    # A supplier sync rewrites the product between delivery and the retry
+    sync_product(client, "olut 0,33")
+    assert aggregator.handler(batch, None) == {"records": 2, "writes": 0}
+
+    product = ProductModel.get(EAN)
+    assert stars() == dict(UNRATED, three=1, four=1)
+    assert product.stars_seq == 2
+    assert product.name == "olut 0,33"
+
+
+def test_retried_batch_applies_only_the_new_records(product, stream_mode):
+    aggregator.handler({"Records": [record(1, new=3), record(2, new=4)]}, None)
+    aggregator.handler(
+        {"Records": [record(1, new=3), record(2, new=4), record(3, old=4, new=5)]}, None
+    )
+
+    assert stars() == dict(UNRATED, three=1, five=1)
+    assert ProductModel.get(EAN).stars_seq == 3
+
+
+def test_product_sync_keeps_counters_written_while_it_runs(
+    client, product, stream_mode, monkeypatch
+):
+    # The aggregator writes after the sync has read the product and before
+    # it writes the supplier data back
+    update_price_data = endpoints.products.update_product_price_data
+
+    def aggregate_then_update(product_model, product):
+        aggregator.handler({"Records": [record(1, new=5)]}, None)
+        return update_price_data(product_model, product)
+
+    monkeypatch.setattr(
+        endpoints.products, "update_product_price_data", aggregate_then_update
+    )
+    sync_product(client, "olut 0,5")
+
+    product = ProductModel.get(EAN)
+    assert stars() == dict(UNRATED, five=1)
+    assert product.stars_seq == 1
+    assert product.name == "olut 0,5"
+
+
+def test_product_update_keeps_counters(client, product, stream_mode):
+    aggregator.handler({"Records": [record(1, new=2)]}, None)
+
+    response = client.put(
+        "/products/{}".format(EAN),
+        json={"ean": EAN, "name": "olut", "store": [], "stars": UNRATED},
+        headers=ADMIN,
+    )
+    assert response.status_code == 200
+    assert stars() == dict(UNRATED, two=1)
+
+
+def test_stream_rating_of_unknown_product_is_not_found(client, product, stream_mode):
+    (user,) = create_users(1)
+
+    assert rate(client, user, 5, ean="404") == 404
+    assert rate(client, user, 5) == 204
+
+
+def test_batch_costs_one_write_per_product(product, stream_mode):
+    records = [record(sequence, new=sequence % 5 + 1) for sequence in range(1, 101)]
+
+    assert aggregator.handler({"Records": records}, None) == {
+        "records": 100,
+        "writes": 1,
+    }
+    assert sum(stars().values()) == 100